@@ -1,85 +1,1281 @@
 import hashlib
+import hmac
 import json
 import time
 from datetime import datetime
 import random
+import threading
+import asyncio
+import concurrent.futures
+import sys
+import multiprocessing
+import os
+import queue
+import array
+import bisect
+import collections
+import collections.abc
+import contextlib
+import copy
+import csv
+import functools
+import heapq
+import itertools
+import math
+import mmap
+import struct
+import tracemalloc
+import zlib
+
+try:
+    import numpy  # Optional; vectorizes the ledger analytics reports
+except ImportError:
+    numpy = None
+
+# Block hash formats:
+#   1 - SHA-256 of the sorted JSON of all block fields, nonce included
+#   2 - SHA-256 of the compact sorted JSON body (nonce excluded) followed by
+#       the decimal nonce, so miners can reuse the hashed body per nonce
+#   3 - as version 2, but the body commits to the Merkle root of the block
+#       records instead of embedding the records themselves
+#   4 - as version 3, but the body also commits to the difficulty the block
+#       was mined at, so retargeted difficulties can be checked
+BLOCK_HASH_VERSION = 4
+
+# Binary block storage: magic byte, then version, index, timestamp and nonce;
+# version 4+ blocks follow this with their difficulty
+BLOCK_MAGIC = b'\xb1'
+BLOCK_HEADER = struct.Struct('>BqdQ')
+BLOCK_DIFFICULTY = struct.Struct('>B')
+
+# Fixed so that independently started nodes share a genesis block
+GENESIS_TIMESTAMP = 1704067200.0
+
+def merkle_leaf_hash(record):
+    """Hash one block record as a Merkle tree leaf"""
+    if isinstance(record, Record):
+        return hashlib.sha256(b'\x00' + record.encode()).digest()
+    record_string = json.dumps(record, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(b'\x00' + record_string.encode()).digest()
+
+def merkle_levels(leaf_hashes):
+    """Build every level of a Merkle tree, from the leaves up to the root
+    
+    An odd node at the end of a level is promoted to the next level as is.
+    """
+    levels = [leaf_hashes]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [
+            hashlib.sha256(b'\x01' + level[i] + level[i + 1]).digest()
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+def verify_merkle_proof(record, proof, merkle_root):
+    """Check that a Merkle inclusion proof links record to merkle_root
+    
+    proof is a list of [sibling_hash, side] pairs from the leaf upwards,
+    where side says whether the sibling sits to the 'left' or 'right'.
+    """
+    node = merkle_leaf_hash(record)
+    for sibling_hash, side in proof:
+        sibling = bytes.fromhex(sibling_hash)
+        if side == 'left':
+            node = hashlib.sha256(b'\x01' + sibling + node).digest()
+        else:
+            node = hashlib.sha256(b'\x01' + node + sibling).digest()
+    return node.hex() == merkle_root
+
+def verify_block_header(header):
+    """Check that a block header's hash matches its fields
+    
+    Version 4+ headers must also meet the difficulty they commit to.
+    """
+    body = {
+        "index": header['index'],
+        "timestamp": header['timestamp'],
+        "merkle_root": header['merkle_root'],
+        "previous_hash": header['previous_hash'],
+        "version": header['version']
+    }
+    if header['version'] >= 4:
+        body["difficulty"] = header['difficulty']
+        if header['hash'][:header['difficulty']] != "0" * header['difficulty']:
+            return False
+    hasher = _body_hasher(body)
+    hasher.update(str(header['nonce']).encode())
+    return hasher.hexdigest() == header['hash']
+
+def verify_ticket_proof(reservation, proof, header):
+    """Check a ticket against a block header without the block body"""
+    return (verify_block_header(header) and
+            verify_merkle_proof(reservation, proof, header['merkle_root']))
+
+def _body_hasher(body):
+    """Return a SHA-256 object fed the compact sorted JSON of body"""
+    body_string = json.dumps(body, sort_keys=True, separators=(',', ':'),
+                             default=record_to_json)
+    return hashlib.sha256(body_string.encode())
 
 class Block:
-    def __init__(self, index, timestamp, data, previous_hash, nonce=0):
+    def __init__(self, index, timestamp, data, previous_hash, nonce=0,
+                 hash_version=BLOCK_HASH_VERSION, difficulty=0):
         self.index = index
         self.timestamp = timestamp
         self.data = data  # Railway reservation data
         self.previous_hash = previous_hash
         self.nonce = nonce
-        self.hash = self.calculate_hash()
+        self.hash_version = hash_version
+        # Older blocks do not record their difficulty
+        self.difficulty = difficulty if hash_version >= 4 else None
+        self.merkle_root = self.compute_merkle_root() if hash_version >= 3 else None
+        self._merkle_levels = None
+        self._encoded_size = None
+        self.hash = self.calculate_hash(self.merkle_root)
+    
+    def calculate_hash(self, merkle_root=None):
+        """Calculate SHA-256 hash of the block
+        
+        Callers that have just computed the Merkle root can pass it in to
+        avoid hashing every record twice.
+        """
+        if self.hash_version == 1:
+            block_string = json.dumps({
+                "index": self.index,
+                "timestamp": self.timestamp,
+                "data": self.data,
+                "previous_hash": self.previous_hash,
+                "nonce": self.nonce
+            }, sort_keys=True, default=record_to_json)
+            return hashlib.sha256(block_string.encode()).hexdigest()
+        
+        hasher = self.body_hasher(merkle_root)
+        hasher.update(str(self.nonce).encode())
+        return hasher.hexdigest()
     
-    def calculate_hash(self):
-        """Calculate SHA-256 hash of the block"""
-        block_string = json.dumps({
+    def body_hasher(self, merkle_root=None):
+        """Return a SHA-256 object already fed the block body (version 2+)"""
+        body = {
             "index": self.index,
             "timestamp": self.timestamp,
-            "data": self.data,
             "previous_hash": self.previous_hash,
-            "nonce": self.nonce
-        }, sort_keys=True)
-        return hashlib.sha256(block_string.encode()).hexdigest()
+            "version": self.hash_version
+        }
+        if self.hash_version >= 3:
+            body["merkle_root"] = merkle_root or self.compute_merkle_root()
+        else:
+            body["data"] = self.data
+        if self.hash_version >= 4:
+            body["difficulty"] = self.difficulty
+        return _body_hasher(body)
+    
+    def compute_merkle_root(self):
+        """Calculate the Merkle root over the block records"""
+        levels = merkle_levels([merkle_leaf_hash(record) for record in self.records()])
+        return levels[-1][0].hex()
+    
+    def merkle_proof(self, offset):
+        """Return the inclusion proof for the record at offset (version 3+)"""
+        if self._merkle_levels is None:
+            self._merkle_levels = merkle_levels(
+                [merkle_leaf_hash(record) for record in self.records()]
+            )
+        
+        proof = []
+        for level in self._merkle_levels[:-1]:
+            sibling = offset ^ 1
+            if sibling < len(level):
+                proof.append([level[sibling].hex(), 'left' if sibling < offset else 'right'])
+            offset //= 2
+        return proof
     
-    def mine_block(self, difficulty):
-        """Proof of Work mining with adjustable difficulty"""
+    def to_dict(self):
+        """Return the block as a JSON-serializable dict"""
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'data': self.data,
+            'previous_hash': self.previous_hash,
+            'nonce': self.nonce,
+            'version': self.hash_version,
+            'difficulty': self.difficulty,
+            'hash': self.hash
+        }
+    
+    @classmethod
+    def from_dict(cls, block_dict):
+        """Rebuild a block from to_dict output, keeping its stored hash"""
+        block = cls(
+            block_dict['index'],
+            block_dict['timestamp'],
+            block_dict['data'],
+            block_dict['previous_hash'],
+            block_dict['nonce'],
+            block_dict.get('version', 1),
+            block_dict.get('difficulty') or 0
+        )
+        block.hash = block_dict['hash']
+        return block
+    
+    def encode(self):
+        """Encode the block in the compact binary storage format"""
+        parts = [
+            BLOCK_MAGIC,
+            BLOCK_HEADER.pack(self.hash_version, self.index, self.timestamp, self.nonce),
+            BLOCK_DIFFICULTY.pack(self.difficulty) if self.hash_version >= 4 else b'',
+            _pack_str(self.previous_hash),
+            _pack_str(self.hash),
+            _pack_str(self.merkle_root or '')
+        ]
+        if isinstance(self.data, list):
+            parts.append(b'L' + _U32.pack(len(self.data)))
+        else:
+            parts.append(b'S')
+        for record in self.records():
+            encoded = encode_record(record)
+            parts.append(_U32.pack(len(encoded)) + encoded)
+        return b''.join(parts)
+    
+    @classmethod
+    def decode(cls, buffer):
+        """Rebuild a block from encode output without rehashing it"""
+        version, index, timestamp, nonce = BLOCK_HEADER.unpack_from(buffer, 1)
+        offset = 1 + BLOCK_HEADER.size
+        difficulty = None
+        if version >= 4:
+            (difficulty,) = BLOCK_DIFFICULTY.unpack_from(buffer, offset)
+            offset += BLOCK_DIFFICULTY.size
+        previous_hash, offset = _unpack_str(buffer, offset)
+        block_hash, offset = _unpack_str(buffer, offset)
+        merkle_root, offset = _unpack_str(buffer, offset)
+        
+        is_list = buffer[offset:offset + 1] == b'L'
+        offset += 1
+        count = 1
+        if is_list:
+            (count,) = _U32.unpack_from(buffer, offset)
+            offset += 4
+        records = []
+        for _ in range(count):
+            (length,) = _U32.unpack_from(buffer, offset)
+            offset += 4
+            records.append(decode_record(buffer[offset:offset + length]))
+            offset += length
+        
+        block = cls.__new__(cls)
+        block.index = index
+        block.timestamp = timestamp
+        block.data = records if is_list else records[0]
+        block.previous_hash = previous_hash
+        block.nonce = nonce
+        block.hash_version = version
+        block.difficulty = difficulty
+        block.merkle_root = merkle_root or None
+        block._merkle_levels = None
+        block._encoded_size = offset
+        block.hash = block_hash
+        return block
+    
+    def encoded_size(self):
+        """Length of the encode output, remembered once known"""
+        if self._encoded_size is None:
+            self._encoded_size = len(self.encode())
+        return self._encoded_size
+    
+    def header(self):
+        """Return the block fields needed to verify its hash without the body"""
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
+            'nonce': self.nonce,
+            'version': self.hash_version,
+            'difficulty': self.difficulty,
+            'hash': self.hash
+        }
+    
+    def nonce_hasher(self):
+        """Return a function mapping a nonce to this block's hash
+        
+        For version 2+ blocks the body is serialized and hashed once, and
+        each nonce only costs a copy of that midstate plus the nonce digits.
+        """
+        if self.hash_version == 1:
+            def hash_nonce(nonce):
+                self.nonce = nonce
+                return self.calculate_hash()
+            return hash_nonce
+        
+        midstate = self.body_hasher()
+        
+        def hash_nonce(nonce):
+            hasher = midstate.copy()
+            hasher.update(str(nonce).encode())
+            return hasher.hexdigest()
+        return hash_nonce
+    
+    def records(self):
+        """Return the block data as a list of records"""
+        return self.data if isinstance(self.data, list) else [self.data]
+    
+    def indexed_records(self):
+        """Return (offset, record) pairs for the records the block holds"""
+        return enumerate(self.records())
+    
+    def record_at(self, offset):
+        """Return the record at offset, or None if it is no longer held"""
+        return self.records()[offset]
+    
+    def mine_block(self, difficulty, workers=1):
+        """Proof of Work mining with adjustable difficulty
+        
+        With workers > 1 the nonce space is split across a process pool;
+        workers=None uses one process per CPU core. The default stays at one
+        process, since at ledger difficulties starting a pool per block costs
+        more than the search itself. If the pool fails, mining continues here.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if self.hash_version >= 4 and self.difficulty != difficulty:
+            # The difficulty is part of the hashed body
+            self.difficulty = difficulty
+            self.hash = self.calculate_hash()
+        
+        if workers <= 1 or not self._mine_parallel(difficulty, workers):
+            self._mine_serial(difficulty)
+        print(f"Block mined: {self.hash}")
+    
+    def _mine_serial(self, difficulty):
+        """Search nonces upwards from the current one in this process"""
         target = "0" * difficulty
+        hash_nonce = self.nonce_hasher()
+        start_nonce = self.nonce
+        start = time.perf_counter()
         while self.hash[:difficulty] != target:
             self.nonce += 1
-            self.hash = self.calculate_hash()
-        print(f"Block mined: {self.hash}")
+            self.hash = hash_nonce(self.nonce)
+        elapsed = time.perf_counter() - start
+        self.mining_stats = _mining_stats(
+            [(0, self.nonce - start_nonce + 1, elapsed)], elapsed
+        )
+    
+    def _mine_parallel(self, difficulty, workers):
+        """Search strided slices of the nonce space in worker processes
+        
+        Returns False if no worker found a nonce, e.g. because every one
+        of them died, so the caller can mine in process instead.
+        """
+        found = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        start = time.perf_counter()
+        
+        processes = [
+            multiprocessing.Process(
+                target=_mine_nonce_slice,
+                args=(self, difficulty, worker_id, workers, found, results),
+                daemon=True
+            )
+            for worker_id in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        
+        # Every live worker reports exactly once, whether or not it won; a
+        # worker that dies first never will, so stop waiting once the only
+        # workers left unreported have exited
+        reports = {}
+        while len(reports) < workers:
+            try:
+                report = results.get(timeout=0.5)
+            except queue.Empty:
+                if any(process.is_alive() for worker_id, process in enumerate(processes)
+                       if worker_id not in reports):
+                    continue
+                # A report sent just before its worker exited may still be in flight
+                try:
+                    report = results.get(timeout=0.5)
+                except queue.Empty:
+                    break
+            reports[report[0]] = report
+        found.set()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        elapsed = time.perf_counter() - start
+        
+        winner = next((report for report in reports.values() if report[1] is not None), None)
+        if winner is None:
+            print("Mining workers exited without a result; mining in process")
+            return False
+        self.nonce = winner[1]
+        self.hash = self.calculate_hash()
+        self.mining_stats = _mining_stats(
+            [(worker_id, hashes, worker_elapsed)
+             for worker_id, _, hashes, worker_elapsed in sorted(reports.values())],
+            elapsed
+        )
+        for worker in self.mining_stats['workers']:
+            print(f"  worker {worker['worker']}: {worker['hashes_per_second']:.0f} H/s")
+        return True
+
+class PrunedBlock(Block):
+    """The header of a block whose body was pruned, plus the records kept
+    
+    Kept records stay at their original offsets, each with its Merkle
+    proof, so PNR lookups still verify against the header. The header
+    alone lets is_chain_valid check linkage and proof of work; the Merkle
+    root is taken on trust, as the body is gone.
+    """
+    def __init__(self, block, keep):
+        self.index = block.index
+        self.timestamp = block.timestamp
+        self.previous_hash = block.previous_hash
+        self.nonce = block.nonce
+        self.hash_version = block.hash_version
+        self.difficulty = block.difficulty
+        self.merkle_root = block.merkle_root
+        self.hash = block.hash
+        self._merkle_levels = None
+        self._encoded_size = block.encoded_size()
+        records = block.records()
+        self.record_count = len(records)
+        self.retained = {offset: records[offset] for offset in keep}
+        # Only the sibling hashes are stored; their sides follow from the offset
+        self.proofs = {
+            offset: b''.join(bytes.fromhex(sibling) for sibling, _ in block.merkle_proof(offset))
+            for offset in keep
+        }
+    
+    def compute_merkle_root(self):
+        return self.merkle_root
+    
+    def records(self):
+        return list(self.retained.values())
+    
+    def indexed_records(self):
+        return list(self.retained.items())
+    
+    def record_at(self, offset):
+        return self.retained.get(offset)
+    
+    def merkle_proof(self, offset):
+        siblings = self.proofs[offset]
+        proof = []
+        width = self.record_count
+        position = 0
+        while width > 1:
+            sibling = offset ^ 1
+            if sibling < width:
+                proof.append([siblings[position:position + 32].hex(),
+                              'left' if sibling < offset else 'right'])
+                position += 32
+            offset //= 2
+            width = (width + 1) // 2
+        return proof
+    
+    def drop(self, offset):
+        """Forget a kept record, e.g. once its ticket is cancelled"""
+        self.retained.pop(offset, None)
+        self.proofs.pop(offset, None)
+    
+    def encode(self):
+        raise ValueError('Pruned blocks have no body; use RailwayBlockchain.full_block')
+    
+    def to_dict(self):
+        raise ValueError('Pruned blocks have no body; use RailwayBlockchain.full_block')
+
+def _mine_nonce_slice(block, difficulty, worker_id, step, found, results):
+    """Mining worker: try nonces worker_id, worker_id + step, ... until found"""
+    target = "0" * difficulty
+    hash_nonce = block.nonce_hasher()
+    nonce = block.nonce + worker_id
+    hashes = 0
+    start = time.perf_counter()
+    winning_nonce = None
+    
+    while winning_nonce is None and not found.is_set():
+        # Only poll the shared event every 1024 hashes
+        for _ in range(1024):
+            hashes += 1
+            if hash_nonce(nonce)[:difficulty] == target:
+                winning_nonce = nonce
+                found.set()
+                break
+            nonce += step
+    
+    results.put((worker_id, winning_nonce, hashes, time.perf_counter() - start))
+
+def _mining_stats(worker_reports, elapsed):
+    """Summarize (worker, hashes, seconds) reports from one mining run"""
+    workers = [
+        {
+            'worker': worker_id,
+            'hashes': hashes,
+            'hashes_per_second': hashes / worker_elapsed if worker_elapsed else 0.0
+        }
+        for worker_id, hashes, worker_elapsed in worker_reports
+    ]
+    total_hashes = sum(worker['hashes'] for worker in workers)
+    return {
+        'workers': workers,
+        'total_hashes': total_hashes,
+        'elapsed': elapsed,
+        'hashes_per_second': total_hashes / elapsed if elapsed else 0.0
+    }
+
+def _encodable(record):
+    """Check that a record fits the binary block encoding"""
+    try:
+        encode_record(record)
+    except (struct.error, OverflowError, TypeError, ValueError):
+        return False
+    return True
+
+def _verify_block_hashes(blocks, difficulty):
+    """Validation worker: return the index of the first bad block, or None
+    
+    Blocks that record their difficulty are checked against it; older
+    blocks against the chain-wide difficulty.
+    """
+    for block in blocks:
+        block_difficulty = difficulty if block.difficulty is None else block.difficulty
+        merkle_root = block.compute_merkle_root() if block.hash_version >= 3 else None
+        if (block.hash != block.calculate_hash(merkle_root) or
+                block.hash[:block_difficulty] != "0" * block_difficulty):
+            return block.index
+        if block.hash_version >= 3 and block.merkle_root != merkle_root:
+            return block.index
+    return None
+
+MEMPOOL_FULL = 'Mempool full, retry later'
+
+class Mempool:
+    """Bounded, prioritized and deduplicated pool of records awaiting a block
+    
+    Blocks take records by priority class, most urgent first. Records that
+    share a conflict key (the train they touch) always stay in arrival
+    order, so replaying a block reproduces the seat state seen live.
+    Duplicate tickets and byte-identical records are rejected, as is
+    anything offered once capacity records are waiting.
+    """
+    # Lower runs first: cancellations free seats ahead of new bookings
+    PRIORITIES = {
+        'ticket_cancellation': 0,
+        'ticket_booking': 1,
+        'waitlist_request': 1,
+        'user_registration': 2,
+        'train_registration': 3
+    }
+    DEFAULT_PRIORITY = 4
+    
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.lock = threading.RLock()
+        self._entries = {}  # sequence -> (priority, key, record id, record, added)
+        self._chains = {}  # conflict key -> deque of sequences in arrival order
+        self._record_ids = set()
+        self._sequence = 0
+        self.tickets = {}  # ticket_id -> record awaiting a block
+        self.in_flight = None  # records in the block being mined
+        self.in_flight_tickets = {}  # ticket_id -> record in the block being mined
+        self._in_flight_ids = set()
+        self.by_type = collections.Counter()
+        self.accepted = 0
+        self.rejected_full = 0
+        self.rejected_duplicate = 0
+        self.batches = 0
+        self.batched_records = 0
+        self.total_wait = 0.0
+        self.started = time.time()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __iter__(self):
+        with self.lock:
+            records = [entry[3] for entry in self._entries.values()]
+        return iter(records)
+    
+    @property
+    def pending_since(self):
+        """Arrival time of the oldest waiting record, or None"""
+        with self.lock:
+            for entry in self._entries.values():
+                return entry[4]
+        return None
+    
+    @staticmethod
+    def record_id(record):
+        """Deduplication ID: the ticket ID, else the record's leaf hash
+        
+        A waitlisted ticket's request and its promotion share the ticket
+        ID, so requests get their own namespace.
+        """
+        ticket_id = record.get('ticket_id')
+        if ticket_id is None:
+            return merkle_leaf_hash(record)
+        return ticket_id if record.get('type') != 'waitlist_request' else 'waitlist:' + ticket_id
+    
+    def add(self, records, keys):
+        """Queue records (with their conflict keys) all-or-nothing
+        
+        Returns None when accepted, otherwise the rejection reason.
+        """
+        record_ids = [self.record_id(record) for record in records]
+        with self.lock:
+            if len(self._entries) + len(records) > self.capacity:
+                self.rejected_full += len(records)
+                return MEMPOOL_FULL
+            if (len(set(record_ids)) != len(record_ids) or
+                    any(record_id in self._record_ids or record_id in self._in_flight_ids
+                        for record_id in record_ids)):
+                self.rejected_duplicate += len(records)
+                return 'Duplicate record'
+            
+            added = time.time()
+            for record, key, record_id in zip(records, keys, record_ids):
+                record_type = record.get('type')
+                priority = self.PRIORITIES.get(record_type, self.DEFAULT_PRIORITY)
+                sequence = self._sequence
+                self._sequence += 1
+                self._entries[sequence] = (priority, key, record_id, record, added)
+                if key is not None:
+                    self._chains.setdefault(key, collections.deque()).append(sequence)
+                self._record_ids.add(record_id)
+                if 'ticket_id' in record:
+                    self.tickets[record['ticket_id']] = record
+                self.by_type[record_type] += 1
+            self.accepted += len(records)
+        return None
+    
+    def get_ticket(self, ticket_id):
+        """Return a waiting or in-flight booking record, or None"""
+        record = self.tickets.get(ticket_id)
+        if record is None:
+            record = self.in_flight_tickets.get(ticket_id)
+        return record
+    
+    def take(self, limit=None):
+        """Remove and return up to limit records for the next block
+        
+        Records leave in priority order, but a record is only eligible once
+        every earlier record with its conflict key has been taken. The taken
+        tickets stay visible through get_ticket until settle() is called.
+        """
+        with self.lock:
+            heap = []
+            for sequence, entry in self._entries.items():
+                key = entry[1]
+                if key is None or self._chains[key][0] == sequence:
+                    heap.append((entry[0], sequence))
+            heapq.heapify(heap)
+            
+            taken = []
+            while heap and (limit is None or len(taken) < limit):
+                _, sequence = heapq.heappop(heap)
+                taken.append(sequence)
+                key = self._entries[sequence][1]
+                if key is not None:
+                    chain = self._chains[key]
+                    chain.popleft()
+                    if chain:
+                        heapq.heappush(heap, (self._entries[chain[0]][0], chain[0]))
+                    else:
+                        del self._chains[key]
+            
+            now = time.time()
+            batch = [self._entries[sequence][3] for sequence in taken]
+            self.in_flight = batch
+            self.in_flight_tickets = {record['ticket_id']: record
+                                      for record in batch if 'ticket_id' in record}
+            self._in_flight_ids = {self._entries[sequence][2] for sequence in taken}
+            for sequence in taken:
+                _, _, record_id, record, added = self._entries.pop(sequence)
+                self._record_ids.discard(record_id)
+                self._forget_ticket(record)
+                self.by_type[record.get('type')] -= 1
+                self.total_wait += now - added
+            self.batches += 1
+            self.batched_records += len(batch)
+        return batch
+    
+    def discard(self, records):
+        """Drop waiting records that reached the chain some other way"""
+        record_ids = {self.record_id(record) for record in records}
+        with self.lock:
+            for sequence, entry in list(self._entries.items()):
+                if entry[2] not in record_ids:
+                    continue
+                _, key, record_id, record, _ = self._entries.pop(sequence)
+                if key is not None:
+                    self._chains[key].remove(sequence)
+                    if not self._chains[key]:
+                        del self._chains[key]
+                self._record_ids.discard(record_id)
+                self._forget_ticket(record)
+                self.by_type[record.get('type')] -= 1
+    
+    def _forget_ticket(self, record):
+        # A later record for the same ticket may have replaced this one
+        ticket_id = record.get('ticket_id')
+        if ticket_id is not None and self.tickets.get(ticket_id) is record:
+            del self.tickets[ticket_id]
+    
+    def settle(self, batch):
+        """Forget the in-flight batch once its block is on the chain"""
+        with self.lock:
+            if batch is self.in_flight:
+                self.in_flight = None
+                self.in_flight_tickets = {}
+                self._in_flight_ids = set()
+    
+    def stats(self):
+        """Depth, rejections, arrival rate and wait times for tuning block size"""
+        with self.lock:
+            now = time.time()
+            oldest = self.pending_since
+            return {
+                'depth': len(self._entries),
+                'capacity': self.capacity,
+                'utilization': len(self._entries) / self.capacity if self.capacity else 0.0,
+                'by_type': {record_type: count for record_type, count in self.by_type.items()
+                            if count},
+                'accepted': self.accepted,
+                'rejected_full': self.rejected_full,
+                'rejected_duplicate': self.rejected_duplicate,
+                'arrivals_per_second': self.accepted / (now - self.started),
+                'blocks': self.batches,
+                'mean_block_records': (self.batched_records / self.batches
+                                       if self.batches else 0.0),
+                'mean_wait_seconds': (self.total_wait / self.batched_records
+                                      if self.batched_records else 0.0),
+                'oldest_wait_seconds': now - oldest if oldest is not None else 0.0
+            }
 
 class RailwayBlockchain:
-    def __init__(self):
-        self.chain = [self.create_genesis_block()]
-        self.difficulty = 4
-        self.pending_reservations = []
+    def __init__(self, store=None, build_indexes=True, mempool_capacity=100000):
+        if store is None:
+            self.chain = [self.create_genesis_block()]
+        else:
+            # Blocks stay on disk and are read back on demand
+            self.chain = PersistentChain(store)
+            if len(self.chain) == 0:
+                self.chain.append(self.create_genesis_block())
+        self.difficulty = 4  # fixed difficulty, or the starting point when retargeting
+        self.target_block_time = None  # seconds per block to retarget toward, None to disable
+        self.retarget_interval = 16  # blocks between difficulty adjustments
+        self.min_difficulty = 1
+        self.max_difficulty = 8
+        self.max_retarget_step = 1  # hex digits the difficulty may move per retarget
+        self.metrics = MetricsRegistry()
+        self.chain_bytes = (sum(block.encoded_size() for block in self.chain)
+                            if store is None else store.payload_bytes())
+        self.metrics.set_gauge('chain_bytes', self.chain_bytes)
+        self.mempool = Mempool(mempool_capacity)
+        self.max_block_records = None  # records per mined block, None for all waiting
+        # One miner extends the chain at a time; block listeners run under it
+        # and may take it again
+        self.mining_lock = threading.RLock()
         self.mining_reward = 100
+        self.mining_workers = 1  # processes used for proof of work, None for all cores
+        self.block_listeners = []  # called with each appended block
+        self.validated_height = 0  # blocks up to here passed is_chain_valid
+        self.checkpoints = {}  # trusted block height -> block hash
+        self.checkpoint_key = None  # HMAC key required to accept checkpoints
+        self.ticket_index = {}  # ticket_id -> (block index, record offset)
+        self.user_index = {}  # username -> [(block index, record offset), ...]
+        self.prune_depth = None  # keep bodies of only this many newest blocks, None to keep all
+        self.pruned_height = 0  # blocks up to here keep only their header and live records
+        self.cold_store = None  # optional BlockStore that receives pruned bodies
+        self._kept_by_date = {}  # travel date -> locations of kept bookings, to expire
+        self._kept_requests = {}  # ticket_id -> location of a kept waitlist request
+        self.prune_listeners = []  # called with each booking or waitlist request pruned away
+        if build_indexes:
+            self.rebuild_indexes()
         
+    @property
+    def pending_reservations(self):
+        """Records awaiting a block; supports len() and iteration"""
+        return self.mempool
+    
+    @property
+    def pending_since(self):
+        return self.mempool.pending_since
+    
+    @property
+    def mining_batch(self):
+        """Records in the block being mined, or None"""
+        return self.mempool.in_flight
+    
     def create_genesis_block(self):
         """Create the first block in the blockchain"""
-        return Block(0, time.time(), "Genesis Block", "0")
+        return Block(0, GENESIS_TIMESTAMP, "Genesis Block", "0")
     
     def get_latest_block(self):
         return self.chain[-1]
     
-    def add_reservation(self, reservation):
-        """Add reservation to pending transactions"""
-        self.pending_reservations.append(reservation)
+    def index_block(self, block):
+        """Add the records of a chained block to the lookup indexes"""
+        for offset, record in block.indexed_records():
+            if not isinstance(record, collections.abc.Mapping):
+                continue
+            if 'ticket_id' in record:
+                self.ticket_index[record['ticket_id']] = (block.index, offset)
+            if record.get('type') == 'ticket_booking':
+                username = record.get('passenger_info', {}).get('user')
+                self.user_index.setdefault(username, []).append((block.index, offset))
     
-    def mine_pending_reservations(self, mining_reward_address):
-        """Mine pending reservations into a new block"""
-        reward_reservation = {
-            'type': 'mining_reward',
-            'amount': self.mining_reward,
-            'to': mining_reward_address
+    def rebuild_indexes(self):
+        """Rebuild the lookup indexes from the blocks in the chain"""
+        self.ticket_index = {}
+        self.user_index = {}
+        for block in self.chain:
+            self.index_block(block)
+    
+    def append_block(self, block, notify=True):
+        """Append a mined block to the chain and index its records
+        
+        notify=False defers the block listeners to a later
+        notify_block_listeners call, e.g. until state locks are released.
+        """
+        self.chain.append(block)
+        self.index_block(block)
+        self.chain_bytes += block.encoded_size()
+        self.metrics.set_gauge('chain_bytes', self.chain_bytes)
+        self.metrics.set_gauge('chain_height', len(self.chain) - 1)
+        # The mined batch is now reachable through the indexes
+        self.mempool.settle(block.data)
+        if self.prune_depth is not None:
+            self.prune(len(self.chain) - 1 - self.prune_depth)
+        if notify:
+            self.notify_block_listeners(block)
+    
+    def notify_block_listeners(self, block):
+        for listener in self.block_listeners:
+            listener(block)
+    
+    def truncate(self, height):
+        """Drop the blocks at height and above and rebuild the indexes"""
+        removed = sum(self.chain[i].encoded_size() for i in range(height, len(self.chain)))
+        if isinstance(self.chain, list):
+            del self.chain[height:]
+        else:
+            self.chain.truncate(height)
+        self.chain_bytes -= removed
+        self.metrics.set_gauge('chain_bytes', self.chain_bytes)
+        self.metrics.set_gauge('chain_height', len(self.chain) - 1)
+        self.validated_height = min(self.validated_height, height - 1)
+        self.pruned_height = min(self.pruned_height, height - 1)
+        self.rebuild_indexes()
+    
+    def prune(self, height):
+        """Drop the bodies of the blocks up to height, keeping their headers
+        
+        Train registrations, and bookings and unpromoted waitlist requests
+        that are neither cancelled nor past their travel date, are kept:
+        replaying the chain and live PNR lookups need them. Everything else leaves the block and the
+        indexes, after being appended to cold_store if one is set. The tip
+        is never pruned. Chains kept in a BlockStore already read bodies
+        from disk on demand and are left alone.
+        """
+        if not isinstance(self.chain, list):
+            return
+        today = datetime.now().strftime('%Y-%m-%d')
+        for block_height in range(self.pruned_height + 1, min(height, len(self.chain) - 2) + 1):
+            self._prune_block(self.chain[block_height], today)
+            self.pruned_height = block_height
+        
+        for travel_date in [date for date in self._kept_by_date if date < today]:
+            for block_height, offset in self._kept_by_date.pop(travel_date):
+                self._drop_kept(block_height, offset)
+        self.metrics.set_gauge('pruned_height', self.pruned_height)
+    
+    def _prune_block(self, block, today):
+        if block.hash_version < 3:
+            return  # Older hashes cover the whole body
+        if self.cold_store is not None:
+            if len(self.cold_store) == 0:
+                self.cold_store.append(self.chain[0])
+            if len(self.cold_store) == block.index:
+                self.cold_store.append(block)
+        
+        keep = []
+        cancelled = []
+        promoted = []
+        for offset, record in block.indexed_records():
+            if not isinstance(record, collections.abc.Mapping):
+                continue
+            record_type = record.get('type')
+            if record_type == 'train_registration':
+                keep.append(offset)
+            elif record_type in ('ticket_booking', 'waitlist_request'):
+                if record_type == 'ticket_booking':
+                    promoted.append(record['ticket_id'])
+                elif self.ticket_index.get(record['ticket_id']) != (block.index, offset):
+                    continue  # Already promoted; the booking replaces the request
+                else:
+                    self._kept_requests[record['ticket_id']] = (block.index, offset)
+                travel_date = record.get('travel_date')
+                if travel_date is None:
+                    keep.append(offset)
+                elif travel_date >= today:
+                    keep.append(offset)
+                    self._kept_by_date.setdefault(travel_date, []).append((block.index, offset))
+            elif record_type == 'ticket_cancellation':
+                cancelled.append(record['original_ticket_id'])
+        
+        pruned = PrunedBlock(block, keep)
+        self.chain[block.index] = pruned
+        for offset, record in block.indexed_records():
+            if offset not in pruned.retained:
+                self._unindex(block.index, offset, record)
+        # A cancelled booking is no longer live once its cancellation is pruned
+        for ticket_id in cancelled:
+            location = self.ticket_index.get(ticket_id)
+            if location is not None and location[0] <= block.index:
+                self._drop_kept(*location)
+        # Nor is the waitlist request of a booking once the booking is pruned
+        for ticket_id in promoted:
+            location = self._kept_requests.get(ticket_id)
+            if location is not None:
+                self._drop_kept(*location)
+    
+    def _drop_kept(self, height, offset):
+        """Drop a record kept by a pruned block and unindex it"""
+        holder = self.chain[height]
+        record = holder.record_at(offset) if isinstance(holder, PrunedBlock) else None
+        if record is None:
+            return
+        self._unindex(height, offset, record)
+        holder.drop(offset)
+        if record.get('type') == 'waitlist_request':
+            self._kept_requests.pop(record['ticket_id'], None)
+    
+    def _unindex(self, height, offset, record):
+        """Remove a record at (height, offset) from the lookup indexes"""
+        if not isinstance(record, collections.abc.Mapping):
+            return
+        ticket_id = record.get('ticket_id')
+        if ticket_id is not None and self.ticket_index.get(ticket_id) == (height, offset):
+            del self.ticket_index[ticket_id]
+            for listener in self.prune_listeners:
+                listener(record)
+        if record.get('type') == 'ticket_booking':
+            username = record.get('passenger_info', {}).get('user')
+            locations = self.user_index.get(username)
+            if locations and (height, offset) in locations:
+                locations.remove((height, offset))
+                if not locations:
+                    del self.user_index[username]
+    
+    def full_block(self, height):
+        """Return the block at height with its whole body, or None if pruned"""
+        block = self.chain[height]
+        if not isinstance(block, PrunedBlock):
+            return block
+        if self.cold_store is not None and height < len(self.cold_store):
+            return self.cold_store.read(height)
+        return None
+    
+    def block_work(self, block):
+        """Expected hashes needed to mine a block (or a header dict), for
+        most-work fork choice
+        """
+        difficulty = block.get('difficulty') if isinstance(block, dict) else block.difficulty
+        return 16 ** (self.difficulty if difficulty is None else difficulty)
+    
+    def check_block(self, block, previous, block_at=None):
+        """Check that a block received from a peer may follow previous
+        
+        block_at(height) looks up earlier blocks of the branch being
+        checked, for the difficulty schedule; it defaults to this chain.
+        """
+        if block.index != previous.index + 1 or block.previous_hash != previous.hash:
+            return False
+        # The hash is checked against the difficulty the block records, so
+        # that must be the one this chain expects, fixed or retargeted
+        if (block.difficulty is not None and
+                block.difficulty != self.next_difficulty(block.index, block_at)):
+            return False
+        return _verify_block_hashes([block], self.difficulty) is None
+    
+    def export_indexes(self):
+        """Return the lookup indexes in JSON-serializable form"""
+        return {
+            'ticket_index': {ticket_id: list(location)
+                             for ticket_id, location in self.ticket_index.items()},
+            'user_index': {username: [list(location) for location in locations]
+                           for username, locations in self.user_index.items()}
         }
-        self.pending_reservations.append(reward_reservation)
+    
+    def load_indexes(self, indexes):
+        """Restore lookup indexes saved by export_indexes"""
+        self.ticket_index = {ticket_id: tuple(location)
+                             for ticket_id, location in indexes['ticket_index'].items()}
+        self.user_index = {username: [tuple(location) for location in locations]
+                           for username, locations in indexes['user_index'].items()}
+    
+    def find_ticket(self, ticket_id):
+        """Return (block, reservation) for a ticket ID, or (None, None)
         
-        block = Block(
-            len(self.chain),
-            time.time(),
-            self.pending_reservations,
-            self.get_latest_block().hash
-        )
+        Tickets that are still waiting to be mined are returned with a
+        block of None.
+        """
+        location = self.ticket_index.get(ticket_id)
+        if location is None:
+            pending = self.mempool.get_ticket(ticket_id)
+            if pending is None:
+                # The block may have been appended while we were looking
+                location = self.ticket_index.get(ticket_id)
+            if location is None:
+                return None, pending
+        block_index, offset = location
+        block = self.chain[block_index]
+        reservation = block.record_at(offset)
+        if reservation is None:
+            return None, None  # Pruned while we were looking
+        return block, reservation
+    
+    def get_record(self, location):
+        """Return the record stored at a (block index, record offset) location"""
+        block_index, offset = location
+        return self.chain[block_index].record_at(offset)
+    
+    def find_user_bookings(self, username):
+        """Return the locations of a user's bookings, oldest first"""
+        return self.user_index.get(username, [])
+    
+    def conflict_key(self, record):
+        """Return the train a record touches, so its order can be kept"""
+        train_id = record.get('train_id')
+        if train_id is None and 'original_ticket_id' in record:
+            _, booking = self.find_ticket(record['original_ticket_id'])
+            if booking is not None:
+                train_id = booking['train_id']
+        return train_id
+    
+    def add_reservation(self, reservation):
+        """Add reservation to pending transactions
         
-        block.mine_block(self.difficulty)
-        self.chain.append(block)
-        self.pending_reservations = []
+        Returns a failed result when the mempool is full or already holds
+        the record; callers must then undo the state change it recorded.
+        """
+        return self.add_reservations([reservation])
+    
+    def add_reservations(self, reservations):
+        """Add a batch of records to pending transactions, all or nothing"""
+        if not reservations:
+            return {'status': 'success'}
+        keys = [self.conflict_key(reservation) for reservation in reservations]
+        reason = self.mempool.add(reservations, keys)
+        self.metrics.set_gauge('mempool_depth', len(self.mempool))
+        if reason is not None:
+            self.metrics.increment('mempool_rejected_total', len(reservations))
+            return {'status': 'failed', 'reason': reason}
+        return {'status': 'success'}
+    
+    def take_pending_reservations(self):
+        """Atomically hand the next block's worth of records to the miner
+        
+        The taken tickets stay visible through find_ticket until their
+        block is appended.
+        """
+        depth = len(self.mempool)
+        batch = self.mempool.take(self.max_block_records)
+        self.metrics.set_gauge('mempool_depth', len(self.mempool))
+        # Depth at seal time, kept as a history for mempool depth over time
+        self.metrics.set_gauge('mempool_depth_at_seal', depth, record=True)
+        return batch
     
-    def is_chain_valid(self):
-        """Validate the entire blockchain"""
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i-1]
+    def next_difficulty(self, height=None, block_at=None):
+        """Return the difficulty the block at height must be mined at
+        
+        Without a target_block_time this is the fixed difficulty. Otherwise
+        the previous block's difficulty carries over, except every
+        retarget_interval blocks, where it moves one hex digit per factor
+        of 16 between the target and the window's average block interval.
+        block_at(height) looks blocks up on another branch than this chain.
+        """
+        if self.target_block_time is None:
+            return self.difficulty
+        if height is None:
+            height = len(self.chain)
+        if block_at is None:
+            block_at = self.chain.__getitem__
+        
+        previous = block_at(height - 1)
+        difficulty = previous.difficulty if height > 1 and previous.difficulty else self.difficulty
+        if height % self.retarget_interval == 0 and height > self.retarget_interval:
+            first = block_at(height - self.retarget_interval)
+            interval = max(previous.timestamp - first.timestamp, 1e-6) / (self.retarget_interval - 1)
+            steps = round(math.log(self.target_block_time / interval, 16))
+            difficulty += max(-self.max_retarget_step, min(self.max_retarget_step, steps))
+        return max(self.min_difficulty, min(self.max_difficulty, difficulty))
+    
+    def mine_pending_reservations(self, mining_reward_address):
+        """Mine pending reservations into a new block"""
+        with self.mining_lock:
+            reward_reservation = MiningReward(
+                amount=self.mining_reward,
+                to=mining_reward_address
+            )
+            batch = self.take_pending_reservations()
+            batch.append(reward_reservation)
             
-            if current_block.hash != current_block.calculate_hash():
-                return False
+            difficulty = self.next_difficulty()
+            try:
+                block = Block(len(self.chain), time.time(), batch,
+                              self.get_latest_block().hash, difficulty=difficulty)
+            except (struct.error, OverflowError, TypeError, ValueError):
+                # Drop only the records that can't be encoded, not the whole
+                # batch; filter in place so settle() still matches in_flight
+                kept = [record for record in batch if _encodable(record)]
+                self.metrics.increment('records_dropped_total', len(batch) - len(kept))
+                batch[:] = kept
+                block = Block(len(self.chain), time.time(), batch,
+                              self.get_latest_block().hash, difficulty=difficulty)
             
-            if current_block.previous_hash != previous_block.hash:
+            block.mine_block(difficulty, self.mining_workers)
+            stats = block.mining_stats
+            self.metrics.observe('mine_block', stats['elapsed'])
+            self.metrics.increment('blocks_mined_total')
+            self.metrics.increment('mining_nonces_total', stats['total_hashes'])
+            self.metrics.set_gauge('mining_hashes_per_second', stats['hashes_per_second'])
+            self.metrics.set_gauge('mining_difficulty', difficulty)
+            self.append_block(block)
+            return block
+    
+    def sign_checkpoint(self, height, block_hash):
+        """Sign a checkpoint with this node's checkpoint key"""
+        message = f"{height}:{block_hash}".encode()
+        return hmac.new(self.checkpoint_key, message, hashlib.sha256).hexdigest()
+    
+    def add_checkpoint(self, height, block_hash, signature=None):
+        """Trust the block at height to have block_hash
+        
+        When a checkpoint_key is configured the checkpoint must carry a
+        matching signature from sign_checkpoint.
+        """
+        if self.checkpoint_key is not None:
+            expected = self.sign_checkpoint(height, block_hash)
+            if signature is None or not hmac.compare_digest(expected, signature):
+                return False
+        self.checkpoints[height] = block_hash
+        return True
+    
+    def is_chain_valid(self, full=False, workers=1):
+        """Validate the blockchain
+        
+        By default only blocks above the validated-height watermark (or the
+        latest matching checkpoint) are checked. full=True rechecks every
+        block from genesis, spreading hash recomputation over worker
+        processes when workers > 1 (None for every CPU core). Blocks that
+        record a difficulty must meet it, and it must be the chain's fixed
+        difficulty or, with retargeting enabled, match the schedule.
+        Pruned blocks are checked by their headers alone.
+        """
+        for height, block_hash in self.checkpoints.items():
+            if height < len(self.chain) and self.chain[height].hash != block_hash:
+                return False
+        
+        if full or self.validated_height >= len(self.chain):
+            start = 1
+        else:
+            trusted = [height for height in self.checkpoints if height < len(self.chain)]
+            start = max([self.validated_height] + trusted) + 1
+        
+        for i in range(start, len(self.chain)):
+            block = self.chain[i]
+            if block.previous_hash != self.chain[i-1].hash:
+                return False
+            if block.difficulty is not None and block.difficulty != self.next_difficulty(i):
+                return False
+        
+        if workers is None:
+            workers = os.cpu_count() or 1
+        blocks = [self.chain[i] for i in range(start, len(self.chain))]
+        
+        if workers > 1 and len(blocks) > workers:
+            chunk_size = -(-len(blocks) // workers)
+            chunks = [blocks[i:i + chunk_size] for i in range(0, len(blocks), chunk_size)]
+            with multiprocessing.Pool(workers) as pool:
+                bad_blocks = pool.starmap(
+                    _verify_block_hashes, [(chunk, self.difficulty) for chunk in chunks]
+                )
+            if any(bad is not None for bad in bad_blocks):
                 return False
+        elif _verify_block_hashes(blocks, self.difficulty) is not None:
+            return False
         
+        self.validated_height = len(self.chain) - 1
         return True
+
+class BlockBuilder:
+    """Group-commit pending reservations into blocks
+    
+    A block is sealed once max_reservations records are pending or the
+    oldest pending record has waited max_wait seconds, so one proof of
+    work covers a whole batch of bookings.
+    """
+    def __init__(self, blockchain, max_reservations=1, max_wait=None):
+        self.blockchain = blockchain
+        self.max_reservations = max_reservations
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def is_due(self):
+        """Check whether the pending reservations should be sealed"""
+        pending = len(self.blockchain.mempool)
+        pending_since = self.blockchain.mempool.pending_since
+        if pending == 0 or pending_since is None:
+            return False
+        if pending >= self.max_reservations:
+            return True
+        return self.max_wait is not None and time.time() - pending_since >= self.max_wait
+    
+    def seal_if_due(self, mining_reward_address):
+        """Mine a block if the batch is full or its window has elapsed"""
+        with self.lock:
+            if self.is_due():
+                return self.blockchain.mine_pending_reservations(mining_reward_address)
+        return None
+    
+    def flush(self, mining_reward_address):
+        """Mine all pending reservations now, regardless of batch limits
+        
+        Returns the last block mined, or None if nothing was waiting.
+        """
+        block = None
+        with self.lock:
+            while len(self.blockchain.mempool):
+                block = self.blockchain.mine_pending_reservations(mining_reward_address)
+        return block
+    
+    def start(self, mining_reward_address='system', poll_interval=0.1):
+        """Seal batches from a background thread when their window elapses"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        
+        def run():
+            while not self._stop_event.wait(poll_interval):
+                self.seal_if_due(mining_reward_address)
+        
+        self._thread = threading.Thread(target=run, name='block-builder', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background sealing thread"""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,468 @@
+# Analytics column layouts as (name, array typecode). Trains, journeys and
+# days hold codes into LedgerAnalytics' dictionaries, or -1 when unknown.
+BOOKING_COLUMNS = (('height', 'i'), ('train', 'i'), ('journey', 'i'), ('travel_day', 'i'),
+                   ('booked_day', 'i'), ('seats', 'i'), ('seat_stops', 'i'), ('fare', 'd'))
+CANCELLATION_COLUMNS = (('height', 'i'), ('train', 'i'), ('journey', 'i'), ('travel_day', 'i'),
+                        ('cancelled_day', 'i'), ('seats', 'i'), ('seat_stops', 'i'),
+                        ('refund', 'd'))
+REWARD_COLUMNS = (('height', 'i'), ('day', 'i'), ('amount', 'd'))
+
+SECONDS_PER_DAY = 86400
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+def _group_totals(codes, size, weights=None):
+    """Count rows, or sum weights, per code in range(size); codes below 0 are skipped"""
+    if numpy is not None:
+        codes = numpy.frombuffer(codes, dtype=codes.typecode)
+        known = codes >= 0
+        if weights is not None:
+            weights = numpy.frombuffer(weights, dtype=weights.typecode)[known]
+        return numpy.bincount(codes[known], weights, minlength=size).tolist()
+    
+    totals = [0] * size
+    if weights is None:
+        for code in codes:
+            if code >= 0:
+                totals[code] += 1
+    else:
+        for code, weight in zip(codes, weights):
+            if code >= 0:
+                totals[code] += weight
+    return totals
+
+def _pair_totals(first, second, weights, first_size, second_size):
+    """Sum weights per distinct (first, second) code pair
+    
+    Rows whose first code is below 0 are skipped; second codes may be -1.
+    """
+    width = second_size + 1
+    if numpy is not None:
+        first = numpy.frombuffer(first, dtype=first.typecode)
+        known = first >= 0
+        second = numpy.frombuffer(second, dtype=second.typecode)[known]
+        weights = numpy.frombuffer(weights, dtype=weights.typecode)[known]
+        keys = first[known].astype(numpy.int64) * width + second + 1
+        if first_size * width <= max(len(keys), 1 << 22):
+            # Few enough pairs to count them all directly, which avoids a sort
+            present = numpy.flatnonzero(numpy.bincount(keys, minlength=first_size * width))
+            totals = numpy.bincount(keys, weights, minlength=first_size * width)[present]
+        else:
+            present, inverse = numpy.unique(keys, return_inverse=True)
+            totals = numpy.bincount(inverse.ravel(), weights, minlength=len(present))
+        return {(key // width, key % width - 1): total
+                for key, total in zip(present.tolist(), totals.tolist())}
+    
+    totals = {}
+    for pair in zip(first, second, weights):
+        if pair[0] >= 0:
+            totals[pair[:2]] = totals.get(pair[:2], 0) + pair[2]
+    return totals
+
+class ColumnTable:
+    """Equal-length typed columns, each held in one array.array"""
+    def __init__(self, layout):
+        self.layout = layout
+        self.columns = {name: array.array(typecode) for name, typecode in layout}
+    
+    def __len__(self):
+        return len(self.columns[self.layout[0][0]])
+    
+    def __getitem__(self, name):
+        return self.columns[name]
+    
+    def extend(self, rows):
+        """Append rows given as tuples in layout order"""
+        if rows:
+            for (name, _), values in zip(self.layout, zip(*rows)):
+                self.columns[name].extend(values)
+    
+    def truncate(self, length):
+        for column in self.columns.values():
+            del column[length:]
+    
+    def save(self, directory, prefix):
+        """Write each column to its own file in native byte order"""
+        for name, column in self.columns.items():
+            path = os.path.join(directory, f"{prefix}.{name}.col")
+            with open(path + '.tmp', 'wb') as column_file:
+                column.tofile(column_file)
+            os.replace(path + '.tmp', path)
+    
+    def load(self, directory, prefix, length):
+        """Read the first length rows written by save; False if any column is short"""
+        for name, typecode in self.layout:
+            column = array.array(typecode)
+            try:
+                with open(os.path.join(directory, f"{prefix}.{name}.col"), 'rb') as column_file:
+                    column.fromfile(column_file, length)
+            except (OSError, EOFError):
+                return False
+            self.columns[name] = column
+        return True
+
+class LedgerAnalytics:
+    """Columnar copy of the chain's bookings, cancellations and mining rewards
+    
+    update() appends the records of blocks added since the last call,
+    first rewinding any blocks a reorganization replaced. Trains, journeys
+    (source and destination station) and days are dictionary-encoded as
+    int codes, so reports group whole columns at once with NumPy when it
+    is installed, or with plain loops over the same arrays when it is not.
+    Pruned blocks contribute only the records they kept unless the chain
+    has a cold store.
+    """
+    def __init__(self, blockchain, directory=None):
+        self.blockchain = blockchain
+        self.directory = directory  # where save() keeps the columns, or None
+        self.lock = threading.RLock()
+        self._reset()
+        if directory is not None and os.path.exists(os.path.join(directory, 'manifest.json')):
+            self.load()
+    
+    def _reset(self):
+        self.bookings = ColumnTable(BOOKING_COLUMNS)
+        self.cancellations = ColumnTable(CANCELLATION_COLUMNS)
+        self.rewards = ColumnTable(REWARD_COLUMNS)
+        self.trains = []  # train code -> train ID
+        self.journeys = []  # journey code -> (source, destination)
+        self.days = []  # day code -> days since 1970-01-01
+        self.train_seats = array.array('i')  # train code -> total seats
+        self.train_segments = array.array('i')  # train code -> stops - 1
+        self.routes = {}  # train ID -> route as last registered on chain
+        self._registrations = []  # [height, train ID, route, total seats] per registration
+        self._train_codes = {}
+        self._journey_codes = {}
+        self._day_codes = {}
+        self._travel_days = {}  # travel date text -> day code
+        self._block_ends = array.array('q')  # table lengths after each exported block
+        self._block_hashes = bytearray()  # raw 32-byte hash of each exported block
+    
+    @property
+    def height(self):
+        """Height of the last exported block, -1 before the first update"""
+        return len(self._block_ends) // 3 - 1
+    
+    def _code(self, codes, values, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+    
+    def _train_code(self, train_id):
+        code = self._code(self._train_codes, self.trains, train_id)
+        if code == len(self.train_seats):
+            self.train_seats.append(0)
+            self.train_segments.append(0)
+        return code
+    
+    def _day_code(self, timestamp):
+        return self._code(self._day_codes, self.days, int(timestamp // SECONDS_PER_DAY))
+    
+    def _travel_day(self, travel_date):
+        code = self._travel_days.get(travel_date)
+        if code is None:
+            try:
+                day = datetime.strptime(travel_date, '%Y-%m-%d').toordinal() - _EPOCH_ORDINAL
+                code = self._code(self._day_codes, self.days, day)
+            except (TypeError, ValueError):
+                code = -1
+            self._travel_days[travel_date] = code
+        return code
+    
+    def _describe_booking(self, booking):
+        """Return (train, journey, travel day, seats, seat-stops) codes and counts"""
+        train_id = booking['train_id']
+        route = self.routes.get(train_id)
+        start, end = booking.get('from_stop', 0), booking.get('to_stop', -1)
+        journey = -1
+        if route is not None:
+            if end < 0:
+                end = len(route) - 1
+            if 0 <= start < end < len(route):
+                journey = self._code(self._journey_codes, self.journeys, (route[start], route[end]))
+        travel_date = booking.get('travel_date')
+        seats = booking['num_seats']
+        return (self._train_code(train_id), journey,
+                -1 if travel_date is None else self._travel_day(travel_date),
+                seats, seats * max(end - start, 0))
+    
+    def update(self):
+        """Export the blocks added to the chain since the last call
+        
+        Returns the number of blocks exported.
+        """
+        with self.lock:
+            chain = self.blockchain.chain
+            tip = len(chain) - 1
+            height = min(self.height, tip)
+            while (height >= 0 and
+                   chain[height].hash != self._block_hashes[32 * height:32 * height + 32].hex()):
+                height -= 1
+            if height < self.height:
+                self._rewind(height)
+            for block_height in range(height + 1, tip + 1):
+                self._export_block(self.blockchain.full_block(block_height) or chain[block_height])
+            return tip - height
+    
+    def _rewind(self, height):
+        """Forget the blocks above height, and the train registrations they held"""
+        ends = self._block_ends[3 * height:3 * height + 3] if height >= 0 else (0, 0, 0)
+        for table, end in zip((self.bookings, self.cancellations, self.rewards), ends):
+            table.truncate(end)
+        del self._block_ends[3 * (height + 1):]
+        del self._block_hashes[32 * (height + 1):]
+        
+        registrations = [entry for entry in self._registrations if entry[0] <= height]
+        self._registrations = []
+        self.routes = {}
+        self.train_seats = array.array('i', [0] * len(self.trains))
+        self.train_segments = array.array('i', [0] * len(self.trains))
+        for registration in registrations:
+            self._register_train(*registration)
+    
+    def _register_train(self, height, train_id, route, total_seats):
+        self._registrations.append([height, train_id, route, total_seats])
+        self.routes[train_id] = route
+        code = self._train_code(train_id)
+        self.train_seats[code] = total_seats
+        self.train_segments[code] = len(route) - 1
+    
+    def _export_block(self, block):
+        bookings, cancellations, rewards = [], [], []
+        for record in block.records():
+            if not isinstance(record, collections.abc.Mapping):
+                continue
+            record_type = record.get('type')
+            if record_type == 'ticket_booking':
+                train, journey, travel_day, seats, seat_stops = self._describe_booking(record)
+                bookings.append((block.index, train, journey, travel_day,
+                                 self._day_code(record['booking_time']), seats, seat_stops,
+                                 record['total_fare']))
+            elif record_type == 'ticket_cancellation':
+                _, booking = self.blockchain.find_ticket(record['original_ticket_id'])
+                if booking is not None and booking.get('type') == 'waitlist_request':
+                    continue  # Withdrawn from the waitlist; nothing was sold
+                train, journey, travel_day, seats, seat_stops = (
+                    self._describe_booking(booking) if booking is not None else (-1, -1, -1, 0, 0)
+                )
+                cancellations.append((block.index, train, journey, travel_day,
+                                      self._day_code(record['cancellation_time']), seats,
+                                      seat_stops, record['refund_amount']))
+            elif record_type == 'mining_reward':
+                rewards.append((block.index, self._day_code(block.timestamp), record['amount']))
+            elif record_type == 'train_registration':
+                self._register_train(block.index, record['train_id'], list(record['route']),
+                                     record['total_seats'])
+        
+        self.bookings.extend(bookings)
+        self.cancellations.extend(cancellations)
+        self.rewards.extend(rewards)
+        self._block_ends.extend((len(self.bookings), len(self.cancellations), len(self.rewards)))
+        self._block_hashes += bytes.fromhex(block.hash)
+    
+    def _net_seat_stops(self):
+        """Booked minus cancelled seat-stops per (train, travel day) code pair"""
+        sizes = len(self.trains), len(self.days)
+        occupied = _pair_totals(self.bookings['train'], self.bookings['travel_day'],
+                                self.bookings['seat_stops'], *sizes)
+        cancelled = _pair_totals(self.cancellations['train'], self.cancellations['travel_day'],
+                                 self.cancellations['seat_stops'], *sizes)
+        for pair, seat_stops in cancelled.items():
+            occupied[pair] = occupied.get(pair, 0) - seat_stops
+        return occupied
+    
+    def _capacity(self, train):
+        return self.train_seats[train] * self.train_segments[train]
+    
+    def train_report(self):
+        """Bookings, cancellations, revenue and occupancy per train
+        
+        Occupancy is the share of seat-stops sold, net of cancellations,
+        over the travel dates the train has bookings for; the open-date
+        pool counts as one date.
+        """
+        with self.lock:
+            self.update()
+            size = len(self.trains)
+            bookings = _group_totals(self.bookings['train'], size)
+            seats = _group_totals(self.bookings['train'], size, self.bookings['seats'])
+            revenue = _group_totals(self.bookings['train'], size, self.bookings['fare'])
+            cancellations = _group_totals(self.cancellations['train'], size)
+            refunds = _group_totals(self.cancellations['train'], size, self.cancellations['refund'])
+            occupied = [0] * size
+            dates = [0] * size
+            for (train, _), seat_stops in self._net_seat_stops().items():
+                occupied[train] += seat_stops
+                dates[train] += 1
+            
+            return [
+                {
+                    'train_id': train_id,
+                    'bookings': int(bookings[train]),
+                    'seats_booked': int(seats[train]),
+                    'cancellations': int(cancellations[train]),
+                    'cancellation_rate': (cancellations[train] / bookings[train]
+                                          if bookings[train] else 0.0),
+                    'revenue': revenue[train],
+                    'refunds': refunds[train],
+                    'net_revenue': revenue[train] - refunds[train],
+                    'occupancy': (occupied[train] / (self._capacity(train) * dates[train])
+                                  if self._capacity(train) and dates[train] else 0.0)
+                }
+                for train, train_id in enumerate(self.trains)
+            ]
+    
+    def route_report(self):
+        """Bookings, cancellations and revenue per journey (source, destination)"""
+        with self.lock:
+            self.update()
+            size = len(self.journeys)
+            bookings = _group_totals(self.bookings['journey'], size)
+            seats = _group_totals(self.bookings['journey'], size, self.bookings['seats'])
+            revenue = _group_totals(self.bookings['journey'], size, self.bookings['fare'])
+            cancellations = _group_totals(self.cancellations['journey'], size)
+            refunds = _group_totals(self.cancellations['journey'], size,
+                                    self.cancellations['refund'])
+            return [
+                {
+                    'source': source,
+                    'destination': destination,
+                    'bookings': int(bookings[journey]),
+                    'seats_booked': int(seats[journey]),
+                    'cancellations': int(cancellations[journey]),
+                    'cancellation_rate': (cancellations[journey] / bookings[journey]
+                                          if bookings[journey] else 0.0),
+                    'revenue': revenue[journey],
+                    'refunds': refunds[journey],
+                    'net_revenue': revenue[journey] - refunds[journey]
+                }
+                for journey, (source, destination) in enumerate(self.journeys)
+            ]
+    
+    def daily_report(self):
+        """Bookings, revenue, cancellations, refunds and mining rewards per calendar day
+        
+        Bookings count on the day they were made and cancellations on the
+        day they were requested, in UTC.
+        """
+        with self.lock:
+            self.update()
+            size = len(self.days)
+            bookings = _group_totals(self.bookings['booked_day'], size)
+            revenue = _group_totals(self.bookings['booked_day'], size, self.bookings['fare'])
+            cancellations = _group_totals(self.cancellations['cancelled_day'], size)
+            refunds = _group_totals(self.cancellations['cancelled_day'], size,
+                                    self.cancellations['refund'])
+            rewards = _group_totals(self.rewards['day'], size, self.rewards['amount'])
+            return [
+                {
+                    'date': datetime.fromordinal(day + _EPOCH_ORDINAL).strftime('%Y-%m-%d'),
+                    'bookings': int(bookings[code]),
+                    'revenue': revenue[code],
+                    'cancellations': int(cancellations[code]),
+                    'refunds': refunds[code],
+                    'mining_rewards': rewards[code]
+                }
+                for code, day in sorted(enumerate(self.days), key=lambda entry: entry[1])
+                if bookings[code] or cancellations[code] or rewards[code]
+            ]
+    
+    def occupancy_report(self, train_id=None):
+        """Share of seat-stops sold per train and travel date (None for open date)"""
+        with self.lock:
+            self.update()
+            train = self._train_codes.get(train_id)
+            if train_id is not None and train is None:
+                return []
+            report = [
+                {
+                    'train_id': self.trains[pair[0]],
+                    'travel_date': (None if pair[1] < 0 else datetime.fromordinal(
+                        self.days[pair[1]] + _EPOCH_ORDINAL).strftime('%Y-%m-%d')),
+                    'seat_stops': int(seat_stops),
+                    'occupancy': (seat_stops / self._capacity(pair[0])
+                                  if self._capacity(pair[0]) else 0.0)
+                }
+                for pair, seat_stops in self._net_seat_stops().items()
+                if train is None or pair[0] == train
+            ]
+            report.sort(key=lambda entry: (entry['train_id'], entry['travel_date'] or ''))
+            return report
+    
+    def save(self):
+        """Write the exported columns and dictionaries to directory
+        
+        Column files are replaced before the manifest, so a crash part way
+        through leaves columns at least as long as the manifest says, and
+        load() trims them.
+        """
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for table, prefix in ((self.bookings, 'bookings'),
+                                  (self.cancellations, 'cancellations'),
+                                  (self.rewards, 'rewards')):
+                table.save(self.directory, prefix)
+            with open(os.path.join(self.directory, 'blocks.bin.tmp'), 'wb') as blocks_file:
+                self._block_ends.tofile(blocks_file)
+                blocks_file.write(self._block_hashes)
+            os.replace(os.path.join(self.directory, 'blocks.bin.tmp'),
+                       os.path.join(self.directory, 'blocks.bin'))
+            
+            manifest = {
+                'blocks': self.height + 1,
+                'rows': [len(self.bookings), len(self.cancellations), len(self.rewards)],
+                'trains': self.trains,
+                'journeys': self.journeys,
+                'days': self.days,
+                'train_seats': self.train_seats.tolist(),
+                'train_segments': self.train_segments.tolist(),
+                'routes': self.routes,
+                'registrations': self._registrations
+            }
+            path = os.path.join(self.directory, 'manifest.json')
+            with open(path + '.tmp', 'w') as manifest_file:
+                json.dump(manifest, manifest_file, separators=(',', ':'))
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+            os.replace(path + '.tmp', path)
+    
+    def load(self):
+        """Restore columns written by save; returns False, keeping nothing,
+        if they are missing or incomplete
+        """
+        with self.lock:
+            try:
+                with open(os.path.join(self.directory, 'manifest.json')) as manifest_file:
+                    manifest = json.load(manifest_file)
+                blocks = manifest['blocks']
+                registrations = manifest['registrations']  # Older manifests are re-exported
+                block_ends = array.array('q')
+                with open(os.path.join(self.directory, 'blocks.bin'), 'rb') as blocks_file:
+                    block_ends.fromfile(blocks_file, 3 * blocks)
+                    block_hashes = bytearray(blocks_file.read(32 * blocks))
+            except (OSError, EOFError, ValueError, KeyError):
+                return False
+            
+            loaded = len(block_hashes) == 32 * blocks and all(
+                table.load(self.directory, prefix, rows)
+                for table, prefix, rows in zip((self.bookings, self.cancellations, self.rewards),
+                                               ('bookings', 'cancellations', 'rewards'),
+                                               manifest['rows'])
+            )
+            if not loaded:
+                self._reset()
+                return False
+            
+            self._block_ends, self._block_hashes = block_ends, block_hashes
+            self.trains = manifest['trains']
+            self.journeys = [tuple(journey) for journey in manifest['journeys']]
+            self.days = manifest['days']
+            self.train_seats = array.array('i', manifest['train_seats'])
+            self.train_segments = array.array('i', manifest['train_segments'])
+            self.routes = manifest['routes']
+            self._registrations = registrations
+            self._train_codes = {train_id: code for code, train_id in enumerate(self.trains)}
+            self._journey_codes = {journey: code for code, journey in enumerate(self.journeys)}
+            self._day_codes = {day: code for code, day in enumerate(self.days)}
+            return True
@@ -0,0 +1,237 @@
+# Binary record layout: one tag byte followed by each field in FIELDS order.
+#   str     - u32 byte length + UTF-8 bytes
+#   int     - signed 64-bit big-endian
+#   float   - IEEE 754 double, big-endian
+#   number  - b'i' + int, or b'd' + float, so ints and floats round-trip
+#   json    - str holding compact sorted JSON (free-form passenger details)
+#   strlist - u32 count + that many str values
+#   intlist - u32 count + that many u32 values
+#   optstr  - b'\x00' for None, or b'\x01' + str
+# Fields listed in a class's DEFAULTS may be missing from the end of an
+# encoding written before they were added; decoding fills in the default
+# and re-encoding omits them again, so the record keeps its original bytes.
+# Tag 0 is reserved for plain dict records, which are stored as JSON.
+_U32 = struct.Struct('>I')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+
+def _pack_str(value):
+    encoded = value.encode()
+    return _U32.pack(len(encoded)) + encoded
+
+def _unpack_str(buffer, offset):
+    (length,) = _U32.unpack_from(buffer, offset)
+    offset += 4
+    return str(buffer[offset:offset + length], 'utf-8'), offset + length
+
+def _pack_int(value):
+    return _I64.pack(value)
+
+def _pack_float(value):
+    return _F64.pack(value)
+
+def _pack_number(value):
+    if isinstance(value, int):
+        return b'i' + _I64.pack(value)
+    return b'd' + _F64.pack(value)
+
+def _pack_json(value):
+    return _pack_str(json.dumps(value, sort_keys=True, separators=(',', ':')))
+
+def _pack_strlist(value):
+    return _U32.pack(len(value)) + b''.join(_pack_str(item) for item in value)
+
+def _pack_intlist(value):
+    return _U32.pack(len(value)) + struct.pack(f'>{len(value)}I', *value)
+
+def _pack_optstr(value):
+    if value is None:
+        return b'\x00'
+    return b'\x01' + _pack_str(value)
+
+def _unpack_int(buffer, offset):
+    return _I64.unpack_from(buffer, offset)[0], offset + 8
+
+def _unpack_float(buffer, offset):
+    return _F64.unpack_from(buffer, offset)[0], offset + 8
+
+def _unpack_number(buffer, offset):
+    number_format = _I64 if buffer[offset] == 0x69 else _F64  # b'i'
+    return number_format.unpack_from(buffer, offset + 1)[0], offset + 9
+
+def _unpack_json(buffer, offset):
+    text, offset = _unpack_str(buffer, offset)
+    return json.loads(text), offset
+
+def _unpack_strlist(buffer, offset):
+    (count,) = _U32.unpack_from(buffer, offset)
+    offset += 4
+    items = []
+    for _ in range(count):
+        item, offset = _unpack_str(buffer, offset)
+        items.append(item)
+    return items, offset
+
+def _unpack_intlist(buffer, offset):
+    (count,) = _U32.unpack_from(buffer, offset)
+    offset += 4
+    return list(struct.unpack_from(f'>{count}I', buffer, offset)), offset + 4 * count
+
+def _unpack_optstr(buffer, offset):
+    if buffer[offset] == 0:
+        return None, offset + 1
+    return _unpack_str(buffer, offset + 1)
+
+_FIELD_CODECS = {
+    'str': (_pack_str, _unpack_str),
+    'int': (_pack_int, _unpack_int),
+    'float': (_pack_float, _unpack_float),
+    'number': (_pack_number, _unpack_number),
+    'json': (_pack_json, _unpack_json),
+    'strlist': (_pack_strlist, _unpack_strlist),
+    'intlist': (_pack_intlist, _unpack_intlist),
+    'optstr': (_pack_optstr, _unpack_optstr)
+}
+
+class Record(collections.abc.Mapping):
+    """Typed ledger record with a compact binary encoding
+    
+    Records behave as read-only mappings, so record['ticket_id'] and
+    record.get('type') work exactly as they did for the old dict records.
+    """
+    __slots__ = ('_field_count',)  # fields present in the encoding
+    TYPE = None
+    TAG = None
+    FIELDS = ()  # (name, kind) pairs, in encoding order
+    DEFAULTS = {}  # trailing fields that older encodings may lack
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._packers = tuple((name, _FIELD_CODECS[kind][0]) for name, kind in cls.FIELDS)
+        cls._unpackers = tuple(_FIELD_CODECS[kind][1] for _, kind in cls.FIELDS)
+        cls._names = tuple(name for name, _ in cls.FIELDS)
+    
+    def __init__(self, **fields):
+        for name in self._names:
+            if name in fields:
+                setattr(self, name, fields[name])
+            else:
+                setattr(self, name, copy.copy(self.DEFAULTS[name]))
+        self._field_count = len(self._names)
+    
+    def __getitem__(self, key):
+        if key == 'type':
+            return self.TYPE
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+    
+    def __iter__(self):
+        yield 'type'
+        yield from self._names
+    
+    def __len__(self):
+        return len(self.FIELDS) + 1
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+    
+    def to_dict(self):
+        """Return the record as a plain dict"""
+        return dict(self.items())
+    
+    def encode(self):
+        """Encode the record as deterministic bytes"""
+        parts = [bytes((self.TAG,))]
+        for name, pack in self._packers[:self._field_count]:
+            parts.append(pack(getattr(self, name)))
+        return b''.join(parts)
+    
+    @classmethod
+    def decode_fields(cls, buffer, offset=1):
+        """Decode a record of this class from encode output"""
+        record = cls.__new__(cls)
+        record._field_count = 0
+        for name, unpack in zip(cls._names, cls._unpackers):
+            if offset >= len(buffer):
+                setattr(record, name, copy.copy(cls.DEFAULTS[name]))
+                continue
+            value, offset = unpack(buffer, offset)
+            setattr(record, name, value)
+            record._field_count += 1
+        return record
+
+class TicketBooking(Record):
+    __slots__ = ('ticket_id', 'passenger_info', 'train_id', 'num_seats',
+                 'total_fare', 'booking_time', 'status',
+                 'travel_date', 'from_stop', 'to_stop', 'seats')
+    TYPE = 'ticket_booking'
+    TAG = 1
+    FIELDS = (('ticket_id', 'str'), ('passenger_info', 'json'), ('train_id', 'str'),
+              ('num_seats', 'int'), ('total_fare', 'number'),
+              ('booking_time', 'float'), ('status', 'str'),
+              ('travel_date', 'optstr'), ('from_stop', 'int'), ('to_stop', 'int'),
+              ('seats', 'intlist'))
+    # Bookings made before seat inventory cover the whole route, no seats assigned
+    DEFAULTS = {'travel_date': None, 'from_stop': 0, 'to_stop': -1, 'seats': []}
+
+class TicketCancellation(Record):
+    __slots__ = ('original_ticket_id', 'cancellation_time', 'refund_amount', 'reason')
+    TYPE = 'ticket_cancellation'
+    TAG = 2
+    FIELDS = (('original_ticket_id', 'str'), ('cancellation_time', 'float'),
+              ('refund_amount', 'number'), ('reason', 'str'))
+
+class TrainRegistration(Record):
+    __slots__ = ('train_id', 'route', 'total_seats', 'fare_per_seat', 'timestamp')
+    TYPE = 'train_registration'
+    TAG = 3
+    FIELDS = (('train_id', 'str'), ('route', 'strlist'), ('total_seats', 'int'),
+              ('fare_per_seat', 'number'), ('timestamp', 'float'))
+
+class UserRegistration(Record):
+    __slots__ = ('username', 'registration_time')
+    TYPE = 'user_registration'
+    TAG = 4
+    FIELDS = (('username', 'str'), ('registration_time', 'float'))
+
+class MiningReward(Record):
+    __slots__ = ('amount', 'to')
+    TYPE = 'mining_reward'
+    TAG = 5
+    FIELDS = (('amount', 'number'), ('to', 'str'))
+
+# A booking request that found no free seats; a later TicketBooking with
+# the same ticket_id records its promotion to a confirmed booking
+class WaitlistRequest(Record):
+    __slots__ = ('ticket_id', 'passenger_info', 'train_id', 'num_seats', 'total_fare',
+                 'booking_time', 'travel_date', 'from_stop', 'to_stop')
+    TYPE = 'waitlist_request'
+    TAG = 6
+    FIELDS = (('ticket_id', 'str'), ('passenger_info', 'json'), ('train_id', 'str'),
+              ('num_seats', 'int'), ('total_fare', 'number'), ('booking_time', 'float'),
+              ('travel_date', 'optstr'), ('from_stop', 'int'), ('to_stop', 'int'))
+
+RECORD_CLASSES = {
+    record_class.TAG: record_class
+    for record_class in (TicketBooking, TicketCancellation, TrainRegistration,
+                         UserRegistration, MiningReward, WaitlistRequest)
+}
+
+def encode_record(record):
+    """Encode a typed record, or any other JSON value, as bytes"""
+    if isinstance(record, Record):
+        return record.encode()
+    return b'\x00' + json.dumps(record, sort_keys=True, separators=(',', ':')).encode()
+
+def decode_record(buffer):
+    """Decode bytes produced by encode_record"""
+    if buffer[0] == 0:
+        return json.loads(bytes(buffer[1:]))
+    return RECORD_CLASSES[buffer[0]].decode_fields(buffer)
+
+def record_to_json(value):
+    """json.dumps default hook that serializes typed records as dicts"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,293 @@
+class RailwayAPIServer:
+    """Asyncio JSON-over-HTTP front end for a RailwayReservationSystem
+    
+    Every operation is a POST to /<operation> with a JSON object body, and
+    the JSON response is the system's own result dict. Connections are kept
+    alive, so one client can pipeline many requests. Operations run in a
+    thread pool, so neither proof of work nor a wait on the system's locks
+    (e.g. while a snapshot is written) blocks the event loop.
+    """
+    MAX_BODY_BYTES = 1024 * 1024
+    # Expected JSON types of request fields; anything else is a bad request
+    FIELD_TYPES = {
+        'username': str,
+        'password': str,
+        'personal_info': dict,
+        'source': str,
+        'destination': str,
+        'travel_date': (str, type(None)),
+        'train_id': str,
+        'num_seats': int,
+        'passenger_details': dict,
+        'waitlist': bool,
+        'ticket_id': str,
+        'reason': str,
+        'limit': int,
+        'cursor': (int, type(None))
+    }
+    
+    def __init__(self, railway_system, host='127.0.0.1', port=8080, executor_workers=32):
+        self.railway_system = railway_system
+        self.host = host
+        self.port = port
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=executor_workers, thread_name_prefix='api-worker'
+        )
+        self.server = None
+        self.routes = {
+            'register_user': self._register_user,
+            'search_trains': self._search_trains,
+            'make_reservation': self._make_reservation,
+            'check_pnr_status': self._check_pnr_status,
+            'cancel_reservation': self._cancel_reservation,
+            'get_user_bookings': self._get_user_bookings
+        }
+    
+    def _check_fields(self, request):
+        """Raise TypeError or ValueError unless request is an object with
+        well-typed fields
+        """
+        if not isinstance(request, dict):
+            raise TypeError('body must be a JSON object')
+        for field, value in request.items():
+            expected = self.FIELD_TYPES.get(field)
+            if expected is None:
+                continue
+            # bool subclasses int, but true is not a seat count
+            if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+                raise TypeError(f"{field} has the wrong type")
+        if request.get('travel_date') and not valid_travel_date(request['travel_date']):
+            raise ValueError('travel_date must be YYYY-MM-DD')
+    
+    def _authenticated(self, request):
+        return self.railway_system.authenticate_user(request['username'], request['password'])
+    
+    def _register_user(self, request):
+        return self.railway_system.register_user(
+            request['username'], request['password'], request.get('personal_info', {})
+        )
+    
+    def _search_trains(self, request):
+        return {
+            'status': 'success',
+            'trains': self.railway_system.search_trains(
+                request['source'], request['destination'], request.get('travel_date')
+            )
+        }
+    
+    def _make_reservation(self, request):
+        if not self._authenticated(request):
+            return {'status': 'failed', 'reason': 'Invalid credentials'}
+        passenger_details = dict(request['passenger_details'], user=request['username'])
+        return self.railway_system.make_reservation(
+            request['username'], request['train_id'], request['num_seats'],
+            passenger_details, request.get('travel_date'),
+            request.get('source'), request.get('destination'), request.get('waitlist', False)
+        )
+    
+    def _check_pnr_status(self, request):
+        return self.railway_system.check_pnr_status(request['ticket_id'])
+    
+    def _cancel_reservation(self, request):
+        if not self._authenticated(request):
+            return {'status': 'failed', 'reason': 'Invalid credentials'}
+        return self.railway_system.cancel_reservation(
+            request['username'], request['ticket_id'], request.get('reason', '')
+        )
+    
+    def _get_user_bookings(self, request):
+        if not self._authenticated(request):
+            return {'status': 'failed', 'reason': 'Invalid credentials'}
+        page = self.railway_system.get_user_bookings_page(
+            request['username'], request.get('limit', 20), request.get('cursor')
+        )
+        return dict(page, status='success')
+    
+    async def dispatch(self, path, body):
+        """Run one API operation and return (HTTP status, response dict)"""
+        handler = self.routes.get(path.strip('/'))
+        if handler is None:
+            return 404, {'status': 'failed', 'reason': 'Unknown operation'}
+        
+        try:
+            request = json.loads(body or b'{}')
+            self._check_fields(request)
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, handler, request)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {'status': 'failed', 'reason': f"Bad request: {error}"}
+        except Exception as error:
+            # Still answer, so one failed operation doesn't drop the connection
+            return 500, {'status': 'failed', 'reason': f"Internal error: {error}"}
+        if isinstance(result, dict) and result.get('reason') == MEMPOOL_FULL:
+            # Backpressure: clients should retry once mining catches up
+            return 503, result
+        return 200, result
+    
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                length = int(headers.get('content-length', 0))
+                if length > self.MAX_BODY_BYTES:
+                    status, response = 413, {'status': 'failed', 'reason': 'Request too large'}
+                    await self._respond(writer, status, response, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                
+                if method == 'GET' and path == '/health':
+                    status, response = 200, {'status': 'ok'}
+                elif method == 'GET' and path == '/metrics':
+                    status, response = 200, self.railway_system.metrics.render_text()
+                elif method != 'POST':
+                    status, response = 405, {'status': 'failed', 'reason': 'Use POST'}
+                else:
+                    status, response = await self.dispatch(path, body)
+                
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _respond(self, writer, status, response, keep_alive):
+        if isinstance(response, str):
+            # Plain-text responses use the Prometheus exposition format
+            payload = response.encode()
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            payload = json.dumps(response, default=record_to_json).encode()
+            content_type = 'application/json'
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                  405: 'Method Not Allowed', 413: 'Payload Too Large',
+                  500: 'Internal Server Error', 503: 'Service Unavailable'}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+    
+    async def start(self):
+        """Start listening; the bound port is available as self.port"""
+        self.server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, backlog=4096
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+    
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+def run_api_server(railway_system, host='127.0.0.1', port=8080):
+    """Serve the API until interrupted, sealing blocks in the background"""
+    server = RailwayAPIServer(railway_system, host, port)
+    railway_system.block_builder.start('system')
+    print(f"Railway API listening on http://{host}:{port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        railway_system.block_builder.stop()
+
+async def _api_request(reader, writer, host, operation, payload):
+    """Send one keep-alive API request and return the decoded response"""
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"POST /{operation} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    
+    await reader.readline()  # status line
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return json.loads(await reader.readexactly(length))
+
+async def run_load_generator(host='127.0.0.1', port=8080, connections=1000,
+                             requests_per_connection=20, source='Mumbai',
+                             destination='Pune', train_id='EXP001', book_every=10):
+    """Drive the API server from many concurrent keep-alive connections
+    
+    Each connection registers its own user, then mostly searches trains,
+    booking a seat (and checking its PNR) every book_every requests.
+    Returns throughput and latency percentiles per operation.
+    """
+    latencies = collections.defaultdict(list)
+    errors = 0
+    
+    async def client(number):
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        username = f"load_{number}_{random.getrandbits(32):08x}"
+        credentials = {'username': username, 'password': 'load_pass'}
+        
+        async def call(operation, payload):
+            nonlocal errors
+            start = time.perf_counter()
+            response = await _api_request(reader, writer, host, operation, payload)
+            latencies[operation].append(time.perf_counter() - start)
+            if response.get('status') in ('failed', 'not_found'):
+                errors += 1
+            return response
+        
+        try:
+            await call('register_user', credentials)
+            for i in range(requests_per_connection):
+                if i % book_every == book_every - 1:
+                    booking = await call('make_reservation', dict(
+                        credentials, train_id=train_id, num_seats=1,
+                        passenger_details={'name': f"Passenger {number}-{i}"}
+                    ))
+                    if booking.get('status') == 'success':
+                        await call('check_pnr_status', {'ticket_id': booking['ticket_id']})
+                else:
+                    await call('search_trains', {'source': source, 'destination': destination})
+        finally:
+            writer.close()
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(connections)))
+    elapsed = time.perf_counter() - start
+    
+    total_requests = sum(len(samples) for samples in latencies.values())
+    return {
+        'connections': connections,
+        'requests': total_requests,
+        'errors': errors,
+        'requests_per_second': total_requests / elapsed,
+        'operations': {operation: latency_summary(samples)
+                       for operation, samples in latencies.items()}
+    }
@@ -0,0 +1,142 @@
+class LatencyHistogram:
+    """Fixed-bucket latency histogram
+    
+    Bucket bounds are upper limits in seconds, as in the Prometheus text
+    format. observe() is a bisect plus a few additions under a lock, cheap
+    enough to leave on for every request.
+    """
+    BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+               0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, seconds):
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[slot] += 1
+            self.count += 1
+            self.total += seconds
+    
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return 0.0
+        rank = fraction * count
+        seen = 0
+        for slot, slot_count in enumerate(counts[:-1]):
+            seen += slot_count
+            if seen >= rank:
+                return self.buckets[slot]
+        return float('inf')
+    
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(0.50) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000
+        }
+
+class MetricsRegistry:
+    """In-process operation latencies, counters and gauges
+    
+    Gauges passed record=True also keep a bounded (timestamp, value)
+    history, used for mempool depth over time.
+    """
+    def __init__(self, history_size=720):
+        self.histograms = {}  # operation -> LatencyHistogram
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.history = {}  # gauge name -> deque of (timestamp, value)
+        self.history_size = history_size
+        self.lock = threading.Lock()
+    
+    def observe(self, operation, seconds):
+        histogram = self.histograms.get(operation)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(operation, LatencyHistogram())
+        histogram.observe(seconds)
+    
+    @contextlib.contextmanager
+    def timer(self, operation):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter() - start)
+    
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+    
+    def set_gauge(self, name, value, record=False):
+        with self.lock:
+            self.gauges[name] = value
+            if record:
+                samples = self.history.get(name)
+                if samples is None:
+                    samples = self.history[name] = collections.deque(maxlen=self.history_size)
+                samples.append((time.time(), value))
+    
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dict"""
+        with self.lock:
+            return {
+                'operations': {operation: histogram.summary()
+                               for operation, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'history': {name: list(samples) for name, samples in self.history.items()}
+            }
+    
+    def render_text(self, prefix='railway_'):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = []
+        histogram_name = f"{prefix}operation_duration_seconds"
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        
+        if histograms:
+            lines.append(f"# TYPE {histogram_name} histogram")
+        for operation, histogram in histograms:
+            with histogram.lock:
+                counts = list(histogram.counts)
+                count, total = histogram.count, histogram.total
+            cumulative = 0
+            for bound, slot_count in zip(histogram.buckets + ('+Inf',), counts):
+                cumulative += slot_count
+                lines.append(f'{histogram_name}_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'{histogram_name}_sum{{operation="{operation}"}} {total}')
+            lines.append(f'{histogram_name}_count{{operation="{operation}"}} {count}')
+        
+        for name, value in counters:
+            lines.append(f"# TYPE {prefix}{name} counter")
+            lines.append(f"{prefix}{name} {value}")
+        for name, value in gauges:
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.append(f"{prefix}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def timed(operation):
+    """Decorator recording a method's latency in self.metrics"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(operation, time.perf_counter() - start)
+        return wrapper
+    return decorate
@@ -0,0 +1,488 @@
+PEER_FRAME = struct.Struct('>IB')  # payload length, message type
+
+# Peer message types
+PEER_HELLO = 1        # JSON node status; sent first on every connection and answered in kind
+PEER_GET_HEADERS = 2  # JSON {'locator': [[height, hash], ...]} or {'start': height}
+PEER_HEADERS = 3      # JSON {'fork_height', 'height', 'headers': [header, ...]} or {'error', 'height'}
+PEER_GET_BLOCKS = 4   # JSON {'start': height, 'end': height}
+PEER_BLOCKS = 5       # u32-length-prefixed encoded blocks
+PEER_NEW_BLOCK = 6    # one encoded block, gossiped without a reply
+
+async def _send_peer_message(writer, kind, payload):
+    if not isinstance(payload, bytes):
+        payload = json.dumps(payload, default=record_to_json).encode()
+    writer.write(PEER_FRAME.pack(len(payload), kind) + payload)
+    await writer.drain()
+
+async def _read_peer_message(reader, max_bytes):
+    length, kind = PEER_FRAME.unpack(await reader.readexactly(PEER_FRAME.size))
+    if length > max_bytes:
+        raise ValueError('Peer message too large')
+    return kind, await reader.readexactly(length)
+
+def _encode_block_batch(blocks):
+    parts = []
+    for block in blocks:
+        encoded = block.encode()
+        parts.append(_U32.pack(len(encoded)) + encoded)
+    return b''.join(parts)
+
+def _decode_block_batch(payload):
+    blocks = []
+    offset = 0
+    while offset < len(payload):
+        (length,) = _U32.unpack_from(payload, offset)
+        offset += 4
+        blocks.append(Block.decode(payload[offset:offset + length]))
+        offset += length
+    return blocks
+
+class PeerNode:
+    """Replicate a RailwayReservationSystem's chain with peers over TCP
+    
+    Blocks appended locally, whether mined here or received, are gossiped
+    to every known peer. A node that falls behind, or receives a block it
+    cannot connect, syncs headers-first from the peer with the most work:
+    it fetches and checks the headers after the last common block, then
+    downloads the bodies in parallel batches over several connections
+    (spread across every peer on that tip). A branch replaces the local
+    one only if it carries more total proof of work.
+    """
+    HEADER_BATCH = 2000
+    BODY_BATCH = 250
+    MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+    
+    def __init__(self, railway_system, host='127.0.0.1', port=0, peers=(), body_fetchers=4):
+        self.railway_system = railway_system
+        self.blockchain = railway_system.blockchain
+        self.host = host
+        self.port = port
+        self.peers = set(peers)  # (host, port) of other nodes' peer listeners
+        self.body_fetchers = body_fetchers
+        self.server = None
+        self.loop = None
+        self.stats = collections.Counter()
+        self._work = []  # cumulative proof of work up to each height
+        self._sync_lock = None
+        self._sync_task = None
+        self._resync = False
+        self._syncing = False  # suppresses gossip while replaying a peer's branch
+        self._push_writers = {}  # peer -> push-only connection for gossip
+        self._push_locks = {}
+        self._connections = set()  # writers of inbound connections
+        self._tasks = set()
+    
+    def status(self):
+        chain = self.blockchain.chain
+        return {
+            'host': self.host,
+            'port': self.port,
+            'height': len(chain) - 1,
+            'tip': chain[-1].hash,
+            'work': self._work[-1] if self._work else 0,
+            # Pruned nodes without cold storage cannot serve older bodies
+            'bodies_from': (self.blockchain.pruned_height + 1
+                            if self.blockchain.cold_store is None else 0)
+        }
+    
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    def _on_block(self, block):
+        """Block listener: extend the work totals and gossip the block
+        
+        Listeners run on mining and executor threads, so both steps are
+        handed to the event loop, which owns the work totals.
+        """
+        if self.loop is None:
+            return  # start() totals the work of the chain as it then stands
+        self.loop.call_soon_threadsafe(self._extend_work, block)
+        if not self._syncing:
+            self.loop.call_soon_threadsafe(self._gossip, block)
+    
+    def _extend_work(self, block):
+        del self._work[block.index:]
+        previous = self._work[-1] if self._work else 0
+        self._work.append(previous + self.blockchain.block_work(block))
+    
+    def _gossip(self, block):
+        payload = block.encode()
+        for peer in list(self.peers):
+            self._spawn(self._push(peer, payload))
+        self.stats['blocks_gossiped'] += 1
+    
+    async def _push(self, peer, payload):
+        lock = self._push_locks.setdefault(peer, asyncio.Lock())
+        async with lock:
+            writer = self._push_writers.get(peer)
+            try:
+                if writer is None or writer.is_closing():
+                    _, writer, _ = await self._open(peer)
+                    self._push_writers[peer] = writer
+                await _send_peer_message(writer, PEER_NEW_BLOCK, payload)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                self._push_writers.pop(peer, None)
+    
+    async def start(self):
+        """Start listening; the bound port is available as self.port"""
+        self.loop = asyncio.get_running_loop()
+        self._sync_lock = asyncio.Lock()
+        self._work = list(itertools.accumulate(
+            await self.loop.run_in_executor(
+                None, lambda: [self.blockchain.block_work(block) for block in self.blockchain.chain]
+            )
+        ))
+        self.blockchain.block_listeners.append(self._on_block)
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def close(self):
+        self.blockchain.block_listeners.remove(self._on_block)
+        self.server.close()
+        await self.server.wait_closed()
+        for task in list(self._tasks):
+            task.cancel()
+        for writer in list(self._push_writers.values()) + list(self._connections):
+            writer.close()
+        self._push_writers = {}
+        await asyncio.sleep(0)  # let handlers see their connections close
+    
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                kind, payload = await _read_peer_message(reader, self.MAX_MESSAGE_BYTES)
+                if kind == PEER_HELLO:
+                    hello = json.loads(payload)
+                    # Learn the caller's listener, as reachable from here
+                    peer = (writer.get_extra_info('peername')[0], hello['port'])
+                    if hello['port'] != self.port or peer[0] != self.host:
+                        self.peers.add(peer)
+                    await _send_peer_message(writer, PEER_HELLO, self.status())
+                elif kind == PEER_GET_HEADERS:
+                    reply = await self.loop.run_in_executor(
+                        None, self._headers_reply, json.loads(payload)
+                    )
+                    await _send_peer_message(writer, PEER_HEADERS, reply)
+                elif kind == PEER_GET_BLOCKS:
+                    request = json.loads(payload)
+                    reply = await self.loop.run_in_executor(
+                        None, self._blocks_reply, request['start'], request['end']
+                    )
+                    await _send_peer_message(writer, PEER_BLOCKS, reply)
+                elif kind == PEER_NEW_BLOCK:
+                    self._spawn(self._receive_block(Block.decode(payload)))
+                else:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, KeyError, struct.error):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+    
+    def _headers_reply(self, request):
+        chain = self.blockchain.chain
+        height = len(chain) - 1
+        if 'locator' in request:
+            # The newest locator entry we share is the fork point
+            fork_height = 0
+            for block_height, block_hash in request['locator']:
+                if 0 <= block_height <= height and chain[block_height].hash == block_hash:
+                    fork_height = block_height
+                    break
+        elif 0 <= request['start'] <= height:
+            fork_height = request['start']
+        else:
+            # Negative heights would index back from our tip
+            return {'error': 'Start height out of range', 'height': height}
+        end = min(height, fork_height + self.HEADER_BATCH)
+        return {
+            'fork_height': fork_height,
+            'height': height,
+            'headers': [chain[i].header() for i in range(fork_height + 1, end + 1)]
+        }
+    
+    def _blocks_reply(self, start, end):
+        if start < 0:
+            return _encode_block_batch([])
+        end = min(end, len(self.blockchain.chain), start + self.BODY_BATCH)
+        blocks = []
+        for height in range(start, end):
+            block = self.blockchain.full_block(height)
+            if block is None:
+                break
+            blocks.append(block)
+        return _encode_block_batch(blocks)
+    
+    def _locator(self):
+        """Block hashes at exponentially spaced heights, newest first"""
+        chain = self.blockchain.chain
+        heights = []
+        height, step = len(chain) - 1, 1
+        while height > 0:
+            heights.append(height)
+            if len(heights) >= 10:
+                step *= 2
+            height -= step
+        heights.append(0)
+        return [[height, chain[height].hash] for height in heights]
+    
+    async def _open(self, peer):
+        """Connect to a peer and exchange hellos; returns (reader, writer, status)"""
+        reader, writer = await asyncio.open_connection(*peer)
+        await _send_peer_message(writer, PEER_HELLO, self.status())
+        kind, payload = await _read_peer_message(reader, self.MAX_MESSAGE_BYTES)
+        if kind != PEER_HELLO:
+            writer.close()
+            raise ValueError('Peer did not say hello')
+        return reader, writer, json.loads(payload)
+    
+    async def _request(self, reader, writer, kind, request, reply_kind):
+        await _send_peer_message(writer, kind, request)
+        got, payload = await _read_peer_message(reader, self.MAX_MESSAGE_BYTES)
+        if got != reply_kind:
+            raise ValueError('Unexpected peer reply')
+        return payload
+    
+    async def _peer_status(self, peer):
+        _, writer, status = await self._open(peer)
+        writer.close()
+        return dict(status, address=peer)
+    
+    async def _receive_block(self, block):
+        chain = self.blockchain.chain
+        if block.index < len(chain) and chain[block.index].hash == block.hash:
+            return  # Already have it
+        self.stats['blocks_received'] += 1
+        
+        if block.index == len(chain) and block.previous_hash == chain[-1].hash:
+            accepted = await self.loop.run_in_executor(
+                None, self.railway_system.accept_block, block
+            )
+            if accepted:
+                return
+        if block.index >= len(chain) - 1:
+            # Ahead of us or a competing tip: let the work totals decide
+            self.request_sync()
+    
+    def request_sync(self):
+        """Start a sync, or queue one more if a sync is already running"""
+        if self._sync_task is not None and not self._sync_task.done():
+            self._resync = True
+            return self._sync_task
+        
+        async def run():
+            while True:
+                self._resync = False
+                try:
+                    await self.sync()
+                except (ConnectionError, OSError, ValueError, asyncio.IncompleteReadError):
+                    self.stats['failed_syncs'] += 1
+                if not self._resync:
+                    break
+        
+        self._sync_task = self._spawn(run())
+        return self._sync_task
+    
+    async def sync(self):
+        """Catch up with the peer carrying the most work
+        
+        Returns the number of blocks adopted.
+        """
+        statuses = await asyncio.gather(
+            *(self._peer_status(peer) for peer in list(self.peers)), return_exceptions=True
+        )
+        statuses = [status for status in statuses if isinstance(status, dict)]
+        if not statuses:
+            return 0
+        best = max(statuses, key=lambda status: status['work'])
+        if best['work'] <= self._work[-1]:
+            return 0
+        candidates = [status for status in statuses if status['tip'] == best['tip']]
+        
+        async with self._sync_lock:
+            return await self._sync_from(candidates)
+    
+    async def _sync_from(self, candidates):
+        chain = self.blockchain.chain
+        fork_height, headers = await self._fetch_headers(candidates[0]['address'])
+        sources = [status['address'] for status in candidates
+                   if status.get('bodies_from', 0) <= fork_height + 1]
+        if not sources:
+            return 0
+        
+        work = self._work[fork_height] + sum(
+            self.blockchain.block_work(header) for header in headers
+        )
+        if work <= self._work[-1]:
+            return 0
+        if any(fork_height < height < len(chain) for height in self.blockchain.checkpoints):
+            return 0  # Never reorganize below a trusted checkpoint
+        if fork_height < self.blockchain.pruned_height:
+            return 0  # The bodies to replay from are gone
+        
+        start = time.perf_counter()
+        extending = fork_height == len(chain) - 1
+        adopted = 0
+        branch = []
+        self._syncing = True
+        try:
+            async for batch in self._fetch_bodies(sources, headers):
+                if extending:
+                    accepted = await self.loop.run_in_executor(
+                        None, self.railway_system.accept_blocks, batch
+                    )
+                    adopted += accepted
+                    if accepted < len(batch):
+                        break
+                else:
+                    branch.extend(batch)
+            if not extending:
+                if await self.loop.run_in_executor(None, self._adopt_branch, fork_height, branch):
+                    adopted = len(branch)
+                    self.stats['reorgs'] += 1
+        finally:
+            self._syncing = False
+        
+        self.stats['blocks_synced'] += adopted
+        self.stats['sync_seconds'] += time.perf_counter() - start
+        if adopted:
+            self._gossip(self.blockchain.get_latest_block())
+        return adopted
+    
+    async def _fetch_headers(self, peer):
+        """Headers after the last block shared with peer, checked as a chain"""
+        reader, writer, _ = await self._open(peer)
+        try:
+            locator = await self.loop.run_in_executor(None, self._locator)
+            reply = json.loads(await self._request(
+                reader, writer, PEER_GET_HEADERS, {'locator': locator}, PEER_HEADERS
+            ))
+            if 'error' in reply:
+                raise ValueError(reply['error'])
+            fork_height = reply['fork_height']
+            previous_hash = self.blockchain.chain[fork_height].hash
+            headers = []
+            while reply['headers']:
+                for header in reply['headers']:
+                    if (header['index'] != fork_height + len(headers) + 1 or
+                            header['previous_hash'] != previous_hash):
+                        raise ValueError('Peer sent disconnected headers')
+                    if header['version'] >= 3 and not verify_block_header(header):
+                        raise ValueError('Peer sent an invalid header')
+                    headers.append(header)
+                    previous_hash = header['hash']
+                if fork_height + len(headers) >= reply['height']:
+                    break
+                reply = json.loads(await self._request(
+                    reader, writer, PEER_GET_HEADERS,
+                    {'start': fork_height + len(headers)}, PEER_HEADERS
+                ))
+                if 'error' in reply:
+                    raise ValueError(reply['error'])
+            return fork_height, headers
+        finally:
+            writer.close()
+    
+    async def _fetch_bodies(self, sources, headers):
+        """Yield the blocks for headers in order, fetching batches in parallel"""
+        ranges = [(first, min(first + self.BODY_BATCH, len(headers)))
+                  for first in range(0, len(headers), self.BODY_BATCH)]
+        connections = asyncio.Queue()
+        writers = []
+        for number in range(min(self.body_fetchers, len(ranges))):
+            reader, writer, _ = await self._open(sources[number % len(sources)])
+            writers.append(writer)
+            connections.put_nowait((reader, writer))
+        
+        async def fetch(first, last):
+            blocks = []
+            reader, writer = await connections.get()
+            try:
+                # Peers may cap a reply below our batch size; ask for the rest
+                while first + len(blocks) < last:
+                    payload = await self._request(
+                        reader, writer, PEER_GET_BLOCKS,
+                        {'start': headers[first + len(blocks)]['index'],
+                         'end': headers[last - 1]['index'] + 1},
+                        PEER_BLOCKS
+                    )
+                    if not payload:
+                        raise ValueError('Peer does not have the blocks it announced')
+                    blocks.extend(await self.loop.run_in_executor(None, _decode_block_batch, payload))
+            finally:
+                connections.put_nowait((reader, writer))
+            if [block.hash for block in blocks] != [header['hash'] for header in headers[first:last]]:
+                raise ValueError('Peer sent bodies that do not match the headers')
+            return blocks
+        
+        # Keep a bounded window of batches in flight, delivered in order
+        in_flight = collections.deque()
+        next_range = 0
+        try:
+            while next_range < len(ranges) or in_flight:
+                while next_range < len(ranges) and len(in_flight) < 2 * len(writers):
+                    in_flight.append(asyncio.ensure_future(fetch(*ranges[next_range])))
+                    next_range += 1
+                yield await in_flight.popleft()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            for writer in writers:
+                writer.close()
+    
+    def _adopt_branch(self, fork_height, branch):
+        """Validate a competing branch in full and switch to it if heavier"""
+        chain = self.blockchain.chain
+        
+        def block_at(height):
+            return branch[height - fork_height - 1] if height > fork_height else chain[height]
+        
+        previous = chain[fork_height]
+        for block in branch:
+            if not self.blockchain.check_block(block, previous, block_at):
+                return False
+            previous = block
+        
+        branch_work = self._work[fork_height] + sum(
+            self.blockchain.block_work(block) for block in branch
+        )
+        if branch_work <= self._work[-1]:
+            return False  # We mined past it meanwhile
+        self.railway_system.switch_branch(fork_height, branch)
+        return True
+
+def run_replicated_node(railway_system, host='127.0.0.1', port=8080,
+                        peer_port=9000, peers=(), sync_interval=30):
+    """Serve the API and replicate the chain with peers until interrupted
+    
+    Besides gossip, the node re-syncs every sync_interval seconds so it
+    recovers from missed pushes and healed partitions.
+    """
+    async def resync(node):
+        while True:
+            node.request_sync()
+            await asyncio.sleep(sync_interval)
+    
+    async def serve():
+        node = PeerNode(railway_system, host, peer_port, peers)
+        await node.start()
+        resync_task = asyncio.ensure_future(resync(node))
+        server = RailwayAPIServer(railway_system, host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            resync_task.cancel()
+            await node.close()
+    
+    railway_system.block_builder.start('system')
+    print(f"Railway API listening on http://{host}:{port}, peers on port {peer_port}")
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        railway_system.block_builder.stop()
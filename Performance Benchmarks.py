@@ -0,0 +1,923 @@
+def latency_summary(samples):
+    """Summarize latency samples in seconds as count, throughput and percentiles"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+    
+    def percentile(fraction):
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000
+    
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'ops_per_second': len(ordered) / total if total else 0.0,
+        'mean_ms': total / len(ordered) * 1000,
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'max_ms': ordered[-1] * 1000
+    }
+
+def build_route_network(num_trains, route_length, num_stations, seed=42):
+    """Generate train details with random routes over a shared station pool"""
+    rng = random.Random(seed)
+    stations = [f"Station-{i}" for i in range(num_stations)]
+    
+    trains = []
+    for i in range(num_trains):
+        trains.append({
+            'train_id': f"TRN{i:06d}",
+            'route': rng.sample(stations, route_length),
+            'seats': rng.randint(50, 500),
+            'fare_per_seat': rng.randint(100, 2000)
+        })
+    return trains, stations
+
+def _linear_search_trains(train_schedules, source, destination):
+    """Original full-scan search, kept as the benchmark baseline"""
+    available_trains = []
+    for train_id, details in train_schedules.items():
+        route = details['route']
+        if source in route and destination in route:
+            if route.index(source) < route.index(destination):
+                available_trains.append(train_id)
+    return available_trains
+
+def benchmark_search_trains(num_trains=10000, route_length=40, num_stations=2000,
+                            num_queries=500, seed=42):
+    """Compare indexed search_trains latency against the full-scan baseline"""
+    railway_system = RailwayReservationSystem()
+    trains, stations = build_route_network(num_trains, route_length, num_stations, seed)
+    for train in trains:
+        railway_system.smart_contract.register_train(
+            train['train_id'], train['route'], train['seats'], train['fare_per_seat']
+        )
+    
+    rng = random.Random(seed + 1)
+    queries = [tuple(rng.sample(stations, 2)) for _ in range(num_queries)]
+    schedules = railway_system.smart_contract.train_schedules
+    
+    start = time.perf_counter()
+    indexed_results = [railway_system.search_trains(src, dst, None) for src, dst in queries]
+    indexed_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    linear_results = [_linear_search_trains(schedules, src, dst) for src, dst in queries]
+    linear_time = time.perf_counter() - start
+    
+    for indexed, linear in zip(indexed_results, linear_results):
+        assert sorted(t['train_id'] for t in indexed) == sorted(linear)
+    
+    results = {
+        'trains': num_trains,
+        'route_length': route_length,
+        'queries': num_queries,
+        'indexed_ms_per_search': indexed_time / num_queries * 1000,
+        'linear_ms_per_search': linear_time / num_queries * 1000,
+        'speedup': linear_time / indexed_time if indexed_time else float('inf')
+    }
+    
+    print(f"search_trains over {num_trains} trains x {route_length} stops:")
+    print(f"  indexed: {results['indexed_ms_per_search']:.4f} ms/search")
+    print(f"  linear:  {results['linear_ms_per_search']:.4f} ms/search")
+    print(f"  speedup: {results['speedup']:.1f}x")
+    return results
+
+def benchmark_group_commit(batch_sizes=(1, 10, 100), num_bookings=200, difficulty=3):
+    """Measure booking throughput as the block builder batch size grows"""
+    results = []
+    for batch_size in batch_sizes:
+        railway_system = RailwayReservationSystem(batch_size=batch_size)
+        railway_system.blockchain.difficulty = difficulty
+        railway_system.smart_contract.register_train(
+            'BENCH01', ['Mumbai', 'Pune', 'Bangalore'], num_bookings, 250
+        )
+        railway_system.register_user('bench_user', 'bench_pass', {})
+        railway_system.block_builder.flush('system')
+        
+        start = time.perf_counter()
+        for i in range(num_bookings):
+            railway_system.make_reservation(
+                'bench_user', 'BENCH01', 1,
+                {'user': 'bench_user', 'name': f"Passenger {i}"}
+            )
+        railway_system.block_builder.flush('system')
+        elapsed = time.perf_counter() - start
+        
+        results.append({
+            'batch_size': batch_size,
+            'bookings': num_bookings,
+            'blocks_mined': len(railway_system.blockchain.chain) - 2,
+            'bookings_per_second': num_bookings / elapsed
+        })
+        print(f"batch size {batch_size}: {num_bookings / elapsed:.1f} bookings/s "
+              f"over {results[-1]['blocks_mined']} blocks")
+    return results
+
+def benchmark_block_hashing(records_per_block=(1, 100, 1000), nonces=2000):
+    """Compare per-nonce hashing cost of the legacy and midstate formats"""
+    results = []
+    for num_records in records_per_block:
+        data = [
+            {
+                'type': 'ticket_booking',
+                'ticket_id': f"{i:012x}",
+                'passenger_info': {'user': f"user{i}", 'name': f"Passenger {i}"},
+                'train_id': 'BENCH01',
+                'num_seats': 1,
+                'total_fare': 250,
+                'booking_time': time.time(),
+                'status': 'confirmed'
+            }
+            for i in range(num_records)
+        ]
+        
+        row = {'records': num_records}
+        for version in (1, BLOCK_HASH_VERSION):
+            block = Block(1, time.time(), data, '0', hash_version=version)
+            hash_nonce = block.nonce_hasher()
+            start = time.perf_counter()
+            for nonce in range(nonces):
+                hash_nonce(nonce)
+            row[f"v{version}_hashes_per_second"] = nonces / (time.perf_counter() - start)
+        results.append(row)
+        
+        print(f"{num_records} records/block: "
+              f"v1 {row['v1_hashes_per_second']:.0f} H/s, "
+              f"v{BLOCK_HASH_VERSION} {row[f'v{BLOCK_HASH_VERSION}_hashes_per_second']:.0f} H/s")
+    return results
+
+def benchmark_record_encoding(num_records=100000):
+    """Compare memory and encode/decode cost of typed records against dicts"""
+    def booking_fields(i):
+        return {
+            'ticket_id': f"{i:012x}",
+            'passenger_info': {'user': f"user{i % 1000}", 'name': f"Passenger {i}",
+                               'age': 30, 'gender': 'F'},
+            'train_id': f"TRN{i % 500:06d}",
+            'num_seats': 1 + i % 4,
+            'total_fare': 250 * (1 + i % 4),
+            'booking_time': 1700000000.0 + i,
+            'status': 'confirmed'
+        }
+    
+    tracemalloc.start()
+    dict_records = [dict(booking_fields(i), type='ticket_booking') for i in range(num_records)]
+    dict_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del dict_records
+    
+    tracemalloc.start()
+    typed_records = [TicketBooking(**booking_fields(i)) for i in range(num_records)]
+    typed_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    dict_records = [record.to_dict() for record in typed_records]
+    
+    start = time.perf_counter()
+    json_encoded = [json.dumps(record, sort_keys=True, separators=(',', ':')).encode()
+                    for record in dict_records]
+    json_encode_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for encoded in json_encoded:
+        json.loads(encoded)
+    json_decode_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    binary_encoded = [record.encode() for record in typed_records]
+    binary_encode_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for encoded in binary_encoded:
+        decode_record(encoded)
+    binary_decode_time = time.perf_counter() - start
+    
+    results = {
+        'records': num_records,
+        'dict_bytes_per_record': dict_memory / num_records,
+        'typed_bytes_per_record': typed_memory / num_records,
+        'json_encoded_bytes': sum(map(len, json_encoded)) / num_records,
+        'binary_encoded_bytes': sum(map(len, binary_encoded)) / num_records,
+        'json_encode_us': json_encode_time / num_records * 1e6,
+        'json_decode_us': json_decode_time / num_records * 1e6,
+        'binary_encode_us': binary_encode_time / num_records * 1e6,
+        'binary_decode_us': binary_decode_time / num_records * 1e6
+    }
+    
+    print(f"{num_records} ticket_booking records:")
+    print(f"  memory:  dict {results['dict_bytes_per_record']:.0f} B/record, "
+          f"typed {results['typed_bytes_per_record']:.0f} B/record")
+    print(f"  encoded: JSON {results['json_encoded_bytes']:.0f} B, "
+          f"binary {results['binary_encoded_bytes']:.0f} B")
+    print(f"  encode:  JSON {results['json_encode_us']:.2f} us, "
+          f"binary {results['binary_encode_us']:.2f} us")
+    print(f"  decode:  JSON {results['json_decode_us']:.2f} us, "
+          f"binary {results['binary_decode_us']:.2f} us")
+    return results
+
+def benchmark_seat_inventory(num_trains=300, num_days=120, route_length=12,
+                             seats_per_train=800, num_bookings=200000,
+                             num_queries=100000, seed=42):
+    """Allocate, query and release seats across a full booking season"""
+    rng = random.Random(seed)
+    inventory = SeatInventory()
+    num_segments = route_length - 1
+    dates = [f"day-{day:03d}" for day in range(num_days)]
+    
+    def random_journey():
+        start = rng.randrange(num_segments)
+        return start, rng.randint(start + 1, num_segments)
+    
+    tracemalloc.start()
+    allocations = []
+    start_time = time.perf_counter()
+    for _ in range(num_bookings):
+        train_id = f"TRN{rng.randrange(num_trains):04d}"
+        travel_date = rng.choice(dates)
+        start, end = random_journey()
+        seats = inventory.allocate(train_id, travel_date, seats_per_train,
+                                   num_segments, start, end, rng.randint(1, 4))
+        if seats is not None:
+            allocations.append((train_id, travel_date, start, end, seats))
+    allocate_time = time.perf_counter() - start_time
+    inventory_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    start_time = time.perf_counter()
+    for _ in range(num_queries):
+        start, end = random_journey()
+        inventory.free_seats(f"TRN{rng.randrange(num_trains):04d}", rng.choice(dates),
+                             seats_per_train, start, end)
+    query_time = time.perf_counter() - start_time
+    
+    releases = allocations[:len(allocations) // 2]
+    start_time = time.perf_counter()
+    for train_id, travel_date, start, end, seats in releases:
+        inventory.release(train_id, travel_date, start, end, seats)
+    release_time = time.perf_counter() - start_time
+    
+    results = {
+        'trains': num_trains,
+        'days': num_days,
+        'segments': num_segments,
+        'seats_per_train': seats_per_train,
+        'bookings': len(allocations),
+        'allocate_us': allocate_time / num_bookings * 1e6,
+        'free_seats_query_us': query_time / num_queries * 1e6,
+        'release_us': release_time / max(len(releases), 1) * 1e6,
+        'booking_phase_mb': inventory_bytes / 2 ** 20
+    }
+    
+    print(f"Seat inventory, {num_trains} trains x {num_days} days x "
+          f"{num_segments} segments x {seats_per_train} seats:")
+    print(f"  allocate:   {results['allocate_us']:.2f} us")
+    print(f"  free seats: {results['free_seats_query_us']:.2f} us")
+    print(f"  release:    {results['release_us']:.2f} us")
+    print(f"  memory:     {results['booking_phase_mb']:.1f} MB traced while making "
+          f"{len(allocations)} bookings (inventory plus the benchmark's own booking list)")
+    return results
+
+def stress_concurrent_booking(num_threads=32, bookings_per_thread=200, num_trains=4,
+                              seats_per_train=300, difficulty=2, seed=42):
+    """Measure booking throughput from many threads at once
+    
+    Demand is several times the capacity, so most trains sell out while
+    the background block builder keeps sealing batches. The oversell
+    check lives in tests/test_concurrent_booking.py.
+    """
+    railway_system = RailwayReservationSystem(batch_size=50, batch_window=0.05)
+    railway_system.blockchain.difficulty = difficulty
+    route = ['Mumbai', 'Pune', 'Satara', 'Kolhapur', 'Belgaum', 'Bangalore']
+    train_ids = [f"STRESS{i:02d}" for i in range(num_trains)]
+    for train_id in train_ids:
+        railway_system.smart_contract.register_train(train_id, route, seats_per_train, 100)
+    railway_system.register_user('stress_user', 'stress_pass', {})
+    railway_system.block_builder.start('system')
+    
+    results = []
+    results_lock = threading.Lock()
+    
+    def book(worker):
+        rng = random.Random(seed + worker)
+        confirmed = []
+        for i in range(bookings_per_thread):
+            start = rng.randrange(len(route) - 1)
+            end = rng.randint(start + 1, len(route) - 1)
+            train_id = rng.choice(train_ids)
+            result = railway_system.make_reservation(
+                'stress_user', train_id, rng.randint(1, 3),
+                {'user': 'stress_user', 'name': f"Passenger {worker}-{i}"},
+                '2026-12-25', route[start], route[end]
+            )
+            if result['status'] == 'success':
+                confirmed.append(result['ticket_id'])
+        with results_lock:
+            results.extend(confirmed)
+    
+    threads = [threading.Thread(target=book, args=(worker,)) for worker in range(num_threads)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+    
+    railway_system.block_builder.stop()
+    railway_system.block_builder.flush('system')
+    
+    attempts = num_threads * bookings_per_thread
+    print(f"{num_threads} threads, {attempts} booking attempts: "
+          f"{len(results)} confirmed, "
+          f"{attempts / elapsed:.0f} attempts/s, "
+          f"{len(railway_system.blockchain.chain) - 1} blocks")
+    return {
+        'threads': num_threads,
+        'attempts': attempts,
+        'confirmed': len(results),
+        'attempts_per_second': attempts / elapsed,
+        'blocks': len(railway_system.blockchain.chain) - 1
+    }
+
+def run_workload_benchmark(num_users=200, num_trains=500, route_length=12,
+                           num_stations=300, num_operations=20000,
+                           operation_mix=(('search', 0.55), ('book', 0.25),
+                                          ('pnr', 0.12), ('cancel', 0.08)),
+                           batch_size=50, difficulty=3, sample_every=2000,
+                           track_memory=False, output_path=None, seed=42):
+    """Run mixed synthetic traffic against RailwayReservationSystem
+    
+    Reports per-operation throughput and latency percentiles, proof-of-work
+    time per block, and how chain size, traced heap memory and
+    is_chain_valid time grow with the chain. track_memory runs the whole
+    workload under tracemalloc, which inflates latencies; turn it off for
+    latency-only comparisons. Results are returned and, with output_path,
+    written as JSON so runs can be compared.
+    """
+    if track_memory:
+        tracemalloc.start()
+    rng = random.Random(seed)
+    railway_system = RailwayReservationSystem(batch_size=batch_size)
+    railway_system.blockchain.difficulty = difficulty
+    
+    mining_times = []
+    railway_system.blockchain.block_listeners.append(
+        lambda block: mining_times.append(block.mining_stats['elapsed'])
+        if hasattr(block, 'mining_stats') else None
+    )
+    
+    setup_start = time.perf_counter()
+    usernames = [f"bench_user_{i}" for i in range(num_users)]
+    for username in usernames:
+        railway_system.register_user(username, 'bench_pass', {'name': username})
+    trains, _ = build_route_network(num_trains, route_length, num_stations, seed)
+    for train in trains:
+        railway_system.admin_add_train('admin', 'railway_admin_2024', train)
+    railway_system.block_builder.flush('system')
+    setup_time = time.perf_counter() - setup_start
+    
+    dates = [f"2026-11-{day:02d}" for day in range(1, 31)]
+    latencies = {operation: [] for operation, _ in operation_mix}
+    tickets = []
+    growth = []
+    operations = [operation for operation, _ in operation_mix]
+    weights = [weight for _, weight in operation_mix]
+    
+    def sample_growth():
+        chain = railway_system.blockchain.chain
+        start = time.perf_counter()
+        railway_system.validate_blockchain_integrity(full=True)
+        full_time = time.perf_counter() - start
+        start = time.perf_counter()
+        railway_system.validate_blockchain_integrity()
+        incremental_time = time.perf_counter() - start
+        growth.append({
+            'operations': completed,
+            'blocks': len(chain),
+            'records': sum(len(block.records()) for block in chain),
+            'chain_bytes': sum(len(block.encode()) for block in chain),
+            'full_validation_ms': full_time * 1000,
+            'incremental_validation_ms': incremental_time * 1000,
+            'traced_memory_bytes': (tracemalloc.get_traced_memory()[0]
+                                    if track_memory else None)
+        })
+    
+    completed = 0
+    run_start = time.perf_counter()
+    for operation in rng.choices(operations, weights, k=num_operations):
+        train = rng.choice(trains)
+        start_stop = rng.randrange(route_length - 1)
+        end_stop = rng.randint(start_stop + 1, route_length - 1)
+        
+        start = time.perf_counter()
+        if operation == 'search':
+            railway_system.search_trains(
+                train['route'][start_stop], train['route'][end_stop], rng.choice(dates)
+            )
+        elif operation == 'book':
+            username = rng.choice(usernames)
+            result = railway_system.make_reservation(
+                username, train['train_id'], rng.randint(1, 4),
+                {'user': username, 'name': f"Passenger {completed}"},
+                rng.choice(dates), train['route'][start_stop], train['route'][end_stop]
+            )
+            if result['status'] == 'success':
+                tickets.append((username, result['ticket_id']))
+        elif operation == 'pnr' and tickets:
+            railway_system.check_pnr_status(rng.choice(tickets)[1])
+        elif operation == 'cancel' and tickets:
+            username, ticket_id = tickets.pop(rng.randrange(len(tickets)))
+            railway_system.cancel_reservation(username, ticket_id, 'benchmark')
+        else:
+            continue
+        latencies[operation].append(time.perf_counter() - start)
+        
+        completed += 1
+        if completed % sample_every == 0:
+            sample_growth()
+    run_time = time.perf_counter() - run_start
+    railway_system.block_builder.flush('system')
+    sample_growth()
+    if track_memory:
+        tracemalloc.stop()
+    
+    results = {
+        'config': {
+            'users': num_users,
+            'trains': num_trains,
+            'route_length': route_length,
+            'operations': num_operations,
+            'operation_mix': dict(operation_mix),
+            'batch_size': batch_size,
+            'difficulty': difficulty,
+            'track_memory': track_memory,
+            'seed': seed
+        },
+        'setup_seconds': setup_time,
+        'run_seconds': run_time,
+        'throughput_ops_per_second': completed / run_time if run_time else 0.0,
+        'operations': {operation: latency_summary(samples)
+                       for operation, samples in latencies.items()},
+        'mining': latency_summary(mining_times),
+        'chain_growth': growth
+    }
+    
+    if output_path is not None:
+        with open(output_path, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    
+    print(f"{completed} operations in {run_time:.2f}s "
+          f"({results['throughput_ops_per_second']:.0f} ops/s)")
+    for operation, summary in results['operations'].items():
+        if summary['count']:
+            print(f"  {operation:7s} p50 {summary['p50_ms']:.3f} ms, "
+                  f"p99 {summary['p99_ms']:.3f} ms ({summary['count']} ops)")
+    if mining_times:
+        print(f"  mining  p50 {results['mining']['p50_ms']:.1f} ms/block "
+              f"over {results['mining']['count']} blocks")
+    final = growth[-1]
+    print(f"  chain   {final['blocks']} blocks, {final['chain_bytes'] / 1024:.0f} KiB, "
+          f"full validation {final['full_validation_ms']:.1f} ms")
+    if track_memory:
+        print(f"  memory  {final['traced_memory_bytes'] / 1048576:.1f} MiB traced")
+    return results
+
+def _sync_source_process(num_blocks, records_per_block, ready, go, stop):
+    """Build a deterministic chain, then serve it to syncing peers"""
+    railway_system = RailwayReservationSystem()
+    railway_system.blockchain.difficulty = 1
+    
+    async def serve():
+        loop = asyncio.get_running_loop()
+        node = PeerNode(railway_system)
+        await node.start()
+        chain = railway_system.blockchain.chain
+        ready.put({'port': node.port, 'blocks': len(chain), 'tip': chain[-1].hash,
+                   'bytes': sum(block.encoded_size() for block in chain),
+                   'build_seconds': build_time})
+        
+        def mine_block():
+            railway_system.register_user('gossip_user', 'sync_pass', {})
+            railway_system.block_builder.flush('system')
+        
+        await loop.run_in_executor(None, go.wait)
+        mined_at = time.time()
+        await loop.run_in_executor(None, mine_block)
+        ready.put({'mined_at': mined_at})
+        await loop.run_in_executor(None, stop.wait)
+        await node.close()
+    
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        trains = [{'train_id': f"SYNC{i:02d}", 'route': ['North', 'Central', 'South'],
+                   'seats': 1000, 'fare_per_seat': 100} for i in range(10)]
+        railway_system.admin_add_trains('admin', 'railway_admin_2024', trains)
+        railway_system.register_user('sync_user', 'sync_pass', {})
+        railway_system.block_builder.flush('system')
+        railway_system.make_reservations(
+            ({'username': 'sync_user', 'train_id': f"SYNC{i % 10:02d}", 'num_seats': 1,
+              'travel_date': f"2027-01-{(i // 10) % 28 + 1:02d}",
+              'passenger_details': {'user': 'sync_user', 'name': f"Passenger {i}"}}
+             for i in range((num_blocks - 3) * records_per_block)),
+            chunk_size=records_per_block
+        )
+        build_time = time.perf_counter() - start
+        asyncio.run(serve())
+
+def _sync_follower_process(name, peers, body_fetchers, results, go, stop):
+    """Sync an empty node from peers, then time gossip of the next block"""
+    railway_system = RailwayReservationSystem()
+    
+    async def follow():
+        loop = asyncio.get_running_loop()
+        node = PeerNode(railway_system, peers=peers, body_fetchers=body_fetchers)
+        await node.start()
+        chain = railway_system.blockchain.chain
+        start = time.perf_counter()
+        blocks = await node.sync()
+        elapsed = time.perf_counter() - start
+        results.put({'node': name, 'port': node.port, 'blocks': blocks, 'seconds': elapsed,
+                     'tip': chain[-1].hash})
+        
+        height = len(chain)
+        await loop.run_in_executor(None, go.wait)
+        while len(chain) <= height:
+            await asyncio.sleep(0.0005)
+        results.put({'node': name, 'received_at': time.time()})
+        await loop.run_in_executor(None, stop.wait)
+        await node.close()
+    
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(follow())
+
+def benchmark_chain_sync(num_blocks=2000, records_per_block=20, num_followers=3,
+                         body_fetchers=4, timeout=600):
+    """Measure headers-first chain sync and block gossip between processes
+    
+    A source process builds a chain of num_blocks blocks. num_followers
+    empty nodes then sync from it at once, each in its own process, and a
+    late joiner syncs from all of them, spreading its body downloads
+    across every peer. Finally the source mines one more block and each
+    node reports when gossip delivered it.
+    """
+    ready = multiprocessing.Queue()
+    reports = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    processes = [multiprocessing.Process(
+        target=_sync_source_process, args=(num_blocks, records_per_block, ready, go, stop)
+    )]
+    processes[0].start()
+    
+    try:
+        source = ready.get(timeout=timeout)
+        peers = [('127.0.0.1', source['port'])]
+        
+        def sync_nodes(names, node_peers):
+            for name in names:
+                process = multiprocessing.Process(
+                    target=_sync_follower_process,
+                    args=(name, node_peers, body_fetchers, reports, go, stop)
+                )
+                process.start()
+                processes.append(process)
+            return [reports.get(timeout=timeout) for _ in names]
+        
+        followers = sync_nodes([f"follower-{i}" for i in range(num_followers)], peers)
+        late_joiner = sync_nodes(
+            ['late-joiner'], peers + [('127.0.0.1', follower['port']) for follower in followers]
+        )[0]
+        
+        go.set()
+        mined_at = ready.get(timeout=timeout)['mined_at']
+        received = [reports.get(timeout=timeout) for _ in range(num_followers + 1)]
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+    
+    def sync_summary(node):
+        return {
+            'node': node['node'],
+            'blocks': node['blocks'],
+            'seconds': node['seconds'],
+            'blocks_per_second': node['blocks'] / node['seconds'] if node['seconds'] else 0.0,
+            'mb_per_second': (source['bytes'] / 1048576 / node['seconds']
+                              if node['seconds'] else 0.0),
+            'tip_matches': node['tip'] == source['tip']
+        }
+    
+    results = {
+        'config': {
+            'blocks': num_blocks,
+            'records_per_block': records_per_block,
+            'followers': num_followers,
+            'body_fetchers': body_fetchers
+        },
+        'chain_bytes': source['bytes'],
+        'build_seconds': source['build_seconds'],
+        'followers': [sync_summary(follower) for follower in followers],
+        'late_joiner': sync_summary(late_joiner),
+        'gossip_ms': {node['node']: (node['received_at'] - mined_at) * 1000
+                      for node in received}
+    }
+    
+    print(f"chain of {source['blocks']} blocks, {source['bytes'] / 1048576:.1f} MiB "
+          f"(built in {source['build_seconds']:.1f}s)")
+    for node in results['followers'] + [results['late_joiner']]:
+        print(f"  {node['node']:12s} {node['blocks_per_second']:8.0f} blocks/s "
+              f"{node['mb_per_second']:6.1f} MiB/s "
+              f"{'in sync' if node['tip_matches'] else 'TIP MISMATCH'}")
+    print(f"  gossip       max {max(results['gossip_ms'].values()):.1f} ms to reach "
+          f"{len(results['gossip_ms'])} nodes")
+    return results
+
+def _resident_bytes():
+    """Resident set size of this process, or None without /proc"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _chain_memory_process(prune_depth, num_records, records_per_block, cancel_fraction,
+                          expired_fraction, seed, results):
+    """Grow a chain of synthetic bookings and report its resident memory"""
+    baseline = _resident_bytes()
+    rng = random.Random(seed)
+    railway_system = RailwayReservationSystem(prune_depth=prune_depth)
+    blockchain = railway_system.blockchain
+    blockchain.difficulty = 1
+    now = time.time()
+    dates = [datetime.fromtimestamp(now + day * 86400).strftime('%Y-%m-%d')
+             for day in range(-365, 91)]
+    past, upcoming = dates[:365], dates[365:]
+    
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        railway_system.admin_add_trains('admin', 'railway_admin_2024', [
+            {'train_id': f"MEM{i:03d}", 'route': ['North', 'Central', 'South'],
+             'seats': 1000, 'fare_per_seat': 100}
+            for i in range(100)
+        ])
+        railway_system.block_builder.flush('system')
+        
+        tickets = []
+        for first in range(0, num_records, records_per_block):
+            records = []
+            for i in range(first, min(first + records_per_block, num_records)):
+                if tickets and rng.random() < cancel_fraction:
+                    records.append(TicketCancellation(
+                        original_ticket_id=tickets.pop(rng.randrange(len(tickets))),
+                        cancellation_time=now, refund_amount=10, reason='benchmark'
+                    ))
+                    continue
+                ticket_id = f"{i:012x}"
+                tickets.append(ticket_id)
+                if len(tickets) > 100000:
+                    del tickets[:50000]  # Only cancel recent tickets; keeps the harness small
+                records.append(TicketBooking(
+                    ticket_id=ticket_id,
+                    passenger_info={'user': f"user_{i % 5000}", 'name': f"Passenger {i}"},
+                    train_id=f"MEM{i % 100:03d}", num_seats=1, total_fare=100,
+                    booking_time=now, status='confirmed',
+                    travel_date=rng.choice(past if rng.random() < expired_fraction else upcoming),
+                    from_stop=0, to_stop=2, seats=[i // 100 % 1000]
+                ))
+            block = Block(len(blockchain.chain), time.time(), records,
+                          blockchain.get_latest_block().hash, difficulty=1)
+            block.mine_block(1)
+            blockchain.append_block(block)
+            railway_system.apply_block(block)
+    build_time = time.perf_counter() - start
+    
+    resident = _resident_bytes()
+    start = time.perf_counter()
+    valid = blockchain.is_chain_valid(full=True)
+    validation_time = time.perf_counter() - start
+    results.put({
+        'mode': 'archival' if prune_depth is None else f"pruned (depth {prune_depth})",
+        'blocks': len(blockchain.chain),
+        'held_records': sum(len(block.records()) for block in blockchain.chain),
+        'indexed_tickets': len(blockchain.ticket_index),
+        'resident_bytes': (resident - baseline
+                           if resident is not None and baseline is not None else None),
+        'build_seconds': build_time,
+        'full_validation_seconds': validation_time,
+        'valid': valid
+    })
+
+def benchmark_pruned_memory(num_records=2000000, records_per_block=1000, prune_depth=100,
+                            cancel_fraction=0.1, expired_fraction=0.8, seed=42):
+    """Compare the memory of an archival node with a pruned one
+    
+    Each node grows the same chain of synthetic bookings in its own
+    process, where expired_fraction of bookings are for past travel dates
+    and cancel_fraction of records cancel an earlier booking. Resident
+    memory is measured from /proc, so it is only reported on Linux.
+    """
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_chain_memory_process,
+            args=(depth, num_records, records_per_block, cancel_fraction,
+                  expired_fraction, seed, results)
+        )
+        for depth in (None, prune_depth)
+    ]
+    for process in processes:
+        process.start()
+    reports = sorted((results.get() for _ in processes), key=lambda report: report['mode'])
+    for process in processes:
+        process.join()
+    
+    print(f"{num_records} records in blocks of {records_per_block}:")
+    for report in reports:
+        memory = (f"{report['resident_bytes'] / 1048576:.0f} MiB resident"
+                  if report['resident_bytes'] is not None else "resident memory unavailable")
+        print(f"  {report['mode']:18s} {memory}, {report['held_records']} records held, "
+              f"full validation {report['full_validation_seconds']:.1f}s")
+    return reports
+
+def benchmark_ledger_analytics(num_records=200000, records_per_block=1000, report_rows=20000000,
+                               num_trains=200, cancel_fraction=0.1, seed=42):
+    """Time the columnar analytics export and its reports
+    
+    A chain of num_records synthetic bookings and cancellations is
+    exported once; the exported rows are then repeated until there are
+    report_rows bookings, to time the reports at that scale.
+    """
+    rng = random.Random(seed)
+    railway_system = RailwayReservationSystem()
+    blockchain = railway_system.blockchain
+    blockchain.difficulty = 1
+    trains, _ = build_route_network(num_trains, 8, 100, seed)
+    now = time.time()
+    dates = [datetime.fromtimestamp(now + day * 86400).strftime('%Y-%m-%d') for day in range(90)]
+    
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        railway_system.admin_add_trains('admin', 'railway_admin_2024', trains)
+        railway_system.block_builder.flush('system')
+        
+        tickets = []
+        for first in range(0, num_records, records_per_block):
+            records = []
+            for i in range(first, min(first + records_per_block, num_records)):
+                if tickets and rng.random() < cancel_fraction:
+                    records.append(TicketCancellation(
+                        original_ticket_id=tickets.pop(rng.randrange(len(tickets))),
+                        cancellation_time=now, refund_amount=rng.choice((10, 50, 90)),
+                        reason='benchmark'
+                    ))
+                    continue
+                train = trains[i % num_trains]
+                from_stop = rng.randrange(len(train['route']) - 1)
+                to_stop = rng.randrange(from_stop + 1, len(train['route']))
+                num_seats = rng.randint(1, 4)
+                ticket_id = f"{i:012x}"
+                tickets.append(ticket_id)
+                records.append(TicketBooking(
+                    ticket_id=ticket_id, passenger_info={'name': f"Passenger {i}"},
+                    train_id=train['train_id'], num_seats=num_seats,
+                    total_fare=train['fare_per_seat'] * num_seats, booking_time=now,
+                    status='confirmed', travel_date=rng.choice(dates),
+                    from_stop=from_stop, to_stop=to_stop, seats=[]
+                ))
+            block = Block(len(blockchain.chain), time.time(), records,
+                          blockchain.get_latest_block().hash, difficulty=1)
+            block.mine_block(1)
+            blockchain.append_block(block)
+    build_time = time.perf_counter() - start
+    
+    analytics = railway_system.analytics
+    start = time.perf_counter()
+    analytics.update()
+    export_time = time.perf_counter() - start
+    exported = len(analytics.bookings) + len(analytics.cancellations)
+    
+    repeat = max(1, -(-report_rows // max(len(analytics.bookings), 1)))
+    for table in (analytics.bookings, analytics.cancellations, analytics.rewards):
+        for column in table.columns.values():
+            column *= repeat
+    
+    report_seconds = {}
+    for name in ('train', 'route', 'day', 'occupancy'):
+        start = time.perf_counter()
+        railway_system.admin_analytics('admin', 'railway_admin_2024', name)
+        report_seconds[name] = time.perf_counter() - start
+    
+    results = {
+        'records': num_records,
+        'build_seconds': build_time,
+        'export_seconds': export_time,
+        'export_records_per_second': exported / export_time if export_time else float('inf'),
+        'report_bookings': len(analytics.bookings),
+        'report_cancellations': len(analytics.cancellations),
+        'report_seconds': report_seconds,
+        'vectorized': numpy is not None
+    }
+    
+    print(f"exported {exported} records in {export_time:.2f}s "
+          f"({results['export_records_per_second']:.0f} records/s)")
+    print(f"reports over {results['report_bookings']} bookings and "
+          f"{results['report_cancellations']} cancellations "
+          f"({'NumPy' if numpy is not None else 'pure Python'}):")
+    for name, seconds in report_seconds.items():
+        print(f"  {name:10s} {seconds:.2f}s")
+    return results
+
+def benchmark_waitlist_storm(num_trains=20, route_length=8, seats_per_train=500,
+                             waitlist_depth=10000, storm_size=10000, num_lookups=100000,
+                             chunk_size=5000, seed=42):
+    """Cancel a burst of tickets on full trains with deep waitlists
+    
+    Every train is sold out for one date and waitlist_depth requests of
+    mixed journeys and party sizes wait behind it. storm_size random
+    confirmed tickets are then cancelled back to back, each promoting
+    whatever waitlisted requests the freed seats fit.
+    """
+    rng = random.Random(seed)
+    railway_system = RailwayReservationSystem()
+    railway_system.blockchain.difficulty = 1
+    smart_contract = railway_system.smart_contract
+    trains, _ = build_route_network(num_trains, route_length, route_length * 4, seed)
+    for train in trains:
+        train['seats'] = seats_per_train
+    travel_date = datetime.fromtimestamp(time.time() + 30 * 86400).strftime('%Y-%m-%d')
+    
+    def requests(count, waitlist):
+        for i in range(count):
+            train = trains[i % num_trains]
+            stops = sorted(rng.sample(range(route_length), 2))
+            yield {
+                'passenger_info': {'name': f"Passenger {i}"},
+                'train_id': train['train_id'],
+                'num_seats': rng.choice((1, 1, 1, 2, 4)),
+                'payment_amount': train['fare_per_seat'] * 4,
+                'travel_date': travel_date,
+                'source': train['route'][stops[0]],
+                'destination': train['route'][stops[1]],
+                'waitlist': waitlist
+            }
+    
+    confirmed, waitlisted = [], []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        railway_system.admin_add_trains('admin', 'railway_admin_2024', trains)
+        railway_system.block_builder.flush('system')
+        
+        # Sell every train out with whole-route bookings, then fill the waitlists
+        for train in trains:
+            results = smart_contract.book_tickets([{
+                'passenger_info': {'name': 'Passenger'}, 'train_id': train['train_id'],
+                'num_seats': 1, 'payment_amount': train['fare_per_seat'],
+                'travel_date': travel_date
+            }] * seats_per_train)
+            confirmed.extend(result['ticket_id'] for result in results)
+            railway_system.block_builder.flush('system')
+        start = time.perf_counter()
+        for chunk in iter_chunks(requests(num_trains * waitlist_depth, True), chunk_size):
+            waitlisted.extend(result['ticket_id'] for result in smart_contract.book_tickets(chunk)
+                              if result['status'] == 'waitlisted')
+            railway_system.block_builder.flush('system')
+        enqueue_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for _ in range(num_lookups):
+            smart_contract.waitlist.position(rng.choice(waitlisted))
+        lookup_time = time.perf_counter() - start
+        
+        rng.shuffle(confirmed)
+        cancel_times = []
+        promoted = 0
+        for first in range(0, min(storm_size, len(confirmed)), chunk_size):
+            for ticket_id in confirmed[first:min(first + chunk_size, storm_size)]:
+                start = time.perf_counter()
+                result = smart_contract.cancel_ticket(ticket_id, 'benchmark')
+                cancel_times.append(time.perf_counter() - start)
+                promoted += len(result.get('promoted', ()))
+            railway_system.block_builder.flush('system')
+    
+    cancel_times.sort()
+    cancelled = len(cancel_times)
+    results = {
+        'trains': num_trains,
+        'waitlisted': len(waitlisted),
+        'enqueue_us': enqueue_time / max(len(waitlisted), 1) * 1e6,
+        'position_lookup_us': lookup_time / num_lookups * 1e6,
+        'cancellations': cancelled,
+        'promotions': promoted,
+        'cancel_mean_us': sum(cancel_times) / max(cancelled, 1) * 1e6,
+        'cancel_p99_us': cancel_times[int(cancelled * 0.99)] * 1e6 if cancel_times else 0.0,
+        'still_waiting': len(smart_contract.waitlist)
+    }
+    
+    print(f"{results['waitlisted']} waitlisted across {num_trains} trains "
+          f"({results['enqueue_us']:.1f} us per request, mining included)")
+    print(f"  position lookup  {results['position_lookup_us']:.2f} us")
+    print(f"  cancellation     mean {results['cancel_mean_us']:.1f} us, "
+          f"p99 {results['cancel_p99_us']:.1f} us")
+    print(f"  {cancelled} cancellations promoted {promoted} requests; "
+          f"{results['still_waiting']} still waiting")
+    return results
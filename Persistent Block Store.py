@@ -0,0 +1,317 @@
+class BlockStore:
+    """Append-only on-disk block log with memory-mapped reads
+    
+    Blocks are framed as <length:u32><crc32:u32><payload> and appended
+    to numbered segment files. blocks.idx holds one fixed-size
+    (segment, offset, length) entry per block height. Appends are fsynced in
+    batches of sync_every blocks or every sync_interval seconds, and opening
+    the store recovers from a crash by truncating any torn tail.
+    """
+    FRAME_HEADER = struct.Struct('>II')
+    INDEX_ENTRY = struct.Struct('>IQI')
+    
+    def __init__(self, directory, segment_size=64 * 1024 * 1024,
+                 sync_every=64, sync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.index = array.array('Q')  # flat (segment, offset, length) triples
+        self._maps = {}  # segment -> mmap of that segment file
+        self.lock = threading.RLock()  # guards the files, index and maps
+        self._unsynced = 0
+        self._last_sync = time.time()
+        
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        
+        self._index_file = open(self._index_path(), 'ab')
+        self._segment = self._last_segment()
+        self._segment_file = open(self._segment_path(self._segment), 'ab')
+    
+    def _index_path(self):
+        return os.path.join(self.directory, 'blocks.idx')
+    
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+    
+    def _last_segment(self):
+        segments = [
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith('segment-') and name.endswith('.log')
+        ]
+        return max(segments, default=0)
+    
+    def _read_frame(self, data, offset):
+        """Return the payload length of a valid frame at offset, or None"""
+        if offset + self.FRAME_HEADER.size > len(data):
+            return None
+        length, checksum = self.FRAME_HEADER.unpack_from(data, offset)
+        start = offset + self.FRAME_HEADER.size
+        if start + length > len(data):
+            return None
+        if zlib.crc32(data[start:start + length]) != checksum:
+            return None
+        return length
+    
+    def _read_segment(self, segment):
+        """Return a segment file's bytes, or b'' if it does not exist"""
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return b''
+        with open(path, 'rb') as segment_file:
+            return segment_file.read()
+    
+    def _recover(self):
+        """Load the offset index and repair a torn tail after a crash"""
+        index_bytes = b''
+        if os.path.exists(self._index_path()):
+            with open(self._index_path(), 'rb') as index_file:
+                index_bytes = index_file.read()
+        
+        entry_size = self.INDEX_ENTRY.size
+        entries = [
+            self.INDEX_ENTRY.unpack_from(index_bytes, position)
+            for position in range(0, len(index_bytes) - entry_size + 1, entry_size)
+        ]
+        
+        # Drop index entries whose frames never made it to disk intact
+        segments = {}
+        while entries:
+            segment, offset, length = entries[-1]
+            if segment not in segments:
+                segments[segment] = self._read_segment(segment)
+            if self._read_frame(segments[segment], offset) == length:
+                break
+            entries.pop()
+        
+        # Re-index intact frames written after the last index entry and
+        # truncate the segment at the first torn frame
+        if entries:
+            segment, offset, length = entries[-1]
+            position = offset + self.FRAME_HEADER.size + length
+        else:
+            segment, position = 0, 0
+        
+        last_segment = self._last_segment()
+        while segment <= last_segment:
+            path = self._segment_path(segment)
+            data = self._read_segment(segment)
+            while True:
+                length = self._read_frame(data, position)
+                if length is None:
+                    break
+                entries.append((segment, position, length))
+                position += self.FRAME_HEADER.size + length
+            if position < len(data):
+                with open(path, 'r+b') as segment_file:
+                    segment_file.truncate(position)
+                # Nothing after a torn frame can be trusted
+                for later in range(segment + 1, last_segment + 1):
+                    if os.path.exists(self._segment_path(later)):
+                        os.remove(self._segment_path(later))
+                break
+            segment, position = segment + 1, 0
+        
+        with open(self._index_path(), 'wb') as index_file:
+            for entry in entries:
+                index_file.write(self.INDEX_ENTRY.pack(*entry))
+                self.index.extend(entry)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+    
+    def __len__(self):
+        return len(self.index) // 3
+    
+    def payload_bytes(self):
+        """Total encoded size of the stored blocks, excluding framing"""
+        return sum(self.index[2::3])
+    
+    def append(self, block):
+        """Append a block and return its height"""
+        payload = block.encode()
+        frame = self.FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            return self._append_frame(frame, len(payload))
+    
+    def _append_frame(self, frame, length):
+        offset = self._segment_file.tell()
+        if offset > 0 and offset + len(frame) > self.segment_size:
+            self.sync()
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_file = open(self._segment_path(self._segment), 'ab')
+            offset = 0
+        
+        self._segment_file.write(frame)
+        self._segment_file.flush()
+        entry = (self._segment, offset, length)
+        self._index_file.write(self.INDEX_ENTRY.pack(*entry))
+        self.index.extend(entry)
+        
+        self._unsynced += 1
+        if (self._unsynced >= self.sync_every or
+                time.time() - self._last_sync >= self.sync_interval):
+            self.sync()
+        return len(self) - 1
+    
+    def sync(self):
+        """Flush pending appends to stable storage"""
+        with self.lock:
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.time()
+    
+    def read(self, height):
+        """Read the block at height through the segment's memory map"""
+        with self.lock:
+            segment, offset, length = self.index[height * 3:height * 3 + 3]
+            offset += self.FRAME_HEADER.size
+            segment_map = self._maps.get(segment)
+            if segment_map is None or offset + length > len(segment_map):
+                if segment_map is not None:
+                    segment_map.close()
+                with open(self._segment_path(segment), 'rb') as segment_file:
+                    segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = segment_map
+            # Copy the payload out, so no view into a map outlives the lock
+            payload = segment_map[offset:offset + length]
+        if payload[:1] == b'{':
+            return Block.from_dict(json.loads(payload))  # Pre-binary stores
+        return Block.decode(memoryview(payload))
+    
+    def truncate(self, height):
+        """Drop the blocks at height and above, e.g. an abandoned fork
+        
+        Segment data is cut before the index, so a crash part way through
+        leaves index entries without frames, which _recover discards.
+        """
+        with self.lock:
+            self._truncate(height)
+    
+    def _truncate(self, height):
+        if height >= len(self):
+            return
+        segment, offset, _ = self.index[height * 3:height * 3 + 3]
+        self.sync()
+        self._segment_file.close()
+        for mapped in [mapped for mapped in self._maps if mapped >= segment]:
+            self._maps.pop(mapped).close()
+        
+        for later in range(segment + 1, self._segment + 1):
+            if os.path.exists(self._segment_path(later)):
+                os.remove(self._segment_path(later))
+        with open(self._segment_path(segment), 'r+b') as segment_file:
+            segment_file.truncate(offset)
+            os.fsync(segment_file.fileno())
+        
+        del self.index[height * 3:]
+        self._index_file.truncate(height * self.INDEX_ENTRY.size)
+        os.fsync(self._index_file.fileno())
+        self._segment = segment
+        self._segment_file = open(self._segment_path(segment), 'ab')
+    
+    def close(self):
+        """Sync outstanding appends and release files and memory maps"""
+        with self.lock:
+            self.sync()
+            self._segment_file.close()
+            self._index_file.close()
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps = {}
+
+class PersistentChain:
+    """List-like view of a BlockStore used as RailwayBlockchain.chain
+    
+    Only the most recently used blocks are kept in memory. The cache is
+    shared by API workers, the block builder and peer threads.
+    """
+    def __init__(self, store, cache_size=256):
+        self.store = store
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.store)
+    
+    def __getitem__(self, height):
+        if height < 0:
+            height += len(self.store)
+        if not 0 <= height < len(self.store):
+            raise IndexError('block height out of range')
+        
+        with self._cache_lock:
+            block = self._cache.get(height)
+            if block is not None:
+                self._cache.move_to_end(height)
+                return block
+        
+        block = self.store.read(height)
+        with self._cache_lock:
+            # Keep a block appended at this height while we were reading
+            block = self._cache.setdefault(height, block)
+            self._evict()
+        return block
+    
+    def __iter__(self):
+        for height in range(len(self.store)):
+            yield self[height]
+    
+    def append(self, block):
+        height = self.store.append(block)
+        with self._cache_lock:
+            self._cache[height] = block
+            self._evict()
+    
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    def truncate(self, height):
+        self.store.truncate(height)
+        with self._cache_lock:
+            for cached in [cached for cached in self._cache if cached >= height]:
+                del self._cache[cached]
+
+class SnapshotStore:
+    """Directory of JSON state snapshots tagged with block height and hash"""
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+    
+    def _heights(self):
+        return sorted(
+            int(name[9:21]) for name in os.listdir(self.directory)
+            if name.startswith('snapshot-') and name.endswith('.json')
+        )
+    
+    def _path(self, height):
+        return os.path.join(self.directory, f"snapshot-{height:012d}.json")
+    
+    def save(self, snapshot):
+        """Atomically write a snapshot and drop all but the newest few"""
+        path = self._path(snapshot['height'])
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file, separators=(',', ':'))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+        
+        for height in self._heights()[:-self.keep]:
+            os.remove(self._path(height))
+    
+    def snapshots(self):
+        """Yield stored snapshots, newest first"""
+        for height in reversed(self._heights()):
+            try:
+                with open(self._path(height)) as snapshot_file:
+                    yield json.load(snapshot_file)
+            except ValueError:
+                continue  # Skip a snapshot that was never completely written
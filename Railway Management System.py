@@ -1,15 +1,112 @@
+def iter_chunks(iterable, size):
+    """Yield lists of up to size items without materializing the iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def read_batch_file(path):
+    """Stream (line number, row dict) pairs from a .csv or .jsonl file"""
+    with open(path, newline='') as batch_file:
+        if path.endswith('.csv'):
+            # Line 1 is the header row
+            for line, row in enumerate(csv.DictReader(batch_file), start=2):
+                yield line, row
+        elif path.endswith('.jsonl'):
+            for line, text in enumerate(batch_file, start=1):
+                if text.strip():
+                    yield line, json.loads(text)
+        else:
+            raise ValueError(f"Unsupported batch file type: {path}")
+
+def valid_travel_date(value):
+    """Check for a YYYY-MM-DD date, the form pruning can compare as text"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') == value
+    except (TypeError, ValueError):
+        return False
+
+def _extra_columns(row, known):
+    """Collect the columns of a flat CSV row that are not named fields"""
+    return {key: value for key, value in row.items() if key not in known}
+
+def _train_from_row(row):
+    route = row['route']
+    if isinstance(route, str):
+        # CSV routes are semicolon separated: "Mumbai;Pune;Bangalore"
+        route = [station.strip() for station in route.split(';')]
+    return {
+        'train_id': row['train_id'],
+        'route': route,
+        'seats': int(row['seats']),
+        'fare_per_seat': float(row['fare_per_seat'])
+    }
+
+def _user_from_row(row):
+    personal_info = row.get('personal_info')
+    if personal_info is None:
+        personal_info = _extra_columns(row, ('username', 'password'))
+    return {
+        'username': row['username'],
+        'password': row['password'],
+        'personal_info': personal_info
+    }
+
+def _batch_key(item):
+    """Match a batch result to the record it queued, and back"""
+    for field in ('ticket_id', 'username', 'train_id'):
+        if field in item:
+            return field, item[field]
+    return None
+
+BOOKING_FIELDS = ('username', 'train_id', 'num_seats', 'travel_date',
+                  'source', 'destination', 'passenger_details')
+
+def _booking_from_row(row):
+    passenger_details = row.get('passenger_details')
+    if passenger_details is None:
+        passenger_details = _extra_columns(row, BOOKING_FIELDS)
+    return {
+        'username': row['username'],
+        'train_id': row['train_id'],
+        'num_seats': int(row['num_seats']),
+        'passenger_details': passenger_details,
+        'travel_date': row.get('travel_date') or None,
+        'source': row.get('source') or None,
+        'destination': row.get('destination') or None
+    }
+
 class RailwayReservationSystem:
-    def __init__(self):
-        self.blockchain = RailwayBlockchain()
+    def __init__(self, batch_size=1, batch_window=None, data_dir=None,
+                 snapshot_interval=100, target_block_time=None, prune_depth=None):
+        self.block_store = None
+        self.snapshot_store = None
+        if data_dir is not None:
+            self.block_store = BlockStore(os.path.join(data_dir, 'blocks'))
+            self.snapshot_store = SnapshotStore(os.path.join(data_dir, 'snapshots'))
+        self.blockchain = RailwayBlockchain(self.block_store, build_indexes=data_dir is None)
+        self.blockchain.target_block_time = target_block_time
+        self.blockchain.prune_depth = prune_depth
         self.smart_contract = SmartContract(self.blockchain)
+        self.metrics = self.blockchain.metrics
+        self.block_builder = BlockBuilder(self.blockchain, batch_size, batch_window)
+        self.analytics = LedgerAnalytics(
+            self.blockchain, None if data_dir is None else os.path.join(data_dir, 'analytics')
+        )
         self.users = {}
         self.admin_credentials = {'admin': 'railway_admin_2024'}
+        self._users_lock = threading.Lock()
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_height = 0
+        
+        if self.snapshot_store is not None:
+            self.restore_state()
+            self.blockchain.block_listeners.append(self._snapshot_if_due)
         
     def register_user(self, username, password, personal_info):
         """Register new user in the system"""
-        if username in self.users:
-            return {'status': 'failed', 'reason': 'User already exists'}
-        
         user_data = {
             'username': username,
             'password': hashlib.sha256(password.encode()).hexdigest(),
@@ -17,17 +114,83 @@ class RailwayReservationSystem:
             'registration_time': time.time()
         }
         
-        self.users[username] = user_data
+        with self._users_lock:
+            if username in self.users:
+                return {'status': 'failed', 'reason': 'User already exists'}
+            
+            # Record user registration on blockchain
+            registration_record = UserRegistration(
+                username=username,
+                registration_time=time.time()
+            )
+            
+            queued = self.blockchain.add_reservation(registration_record)
+            if queued['status'] != 'success':
+                return queued
+            
+            self.users[username] = user_data
+        return {'status': 'success', 'message': 'User registered successfully'}
+    
+    def register_users(self, users, chunk_size=1000):
+        """Register many users, mining each chunk of registrations as one block
         
-        # Record user registration on blockchain
-        registration_record = {
-            'type': 'user_registration',
-            'username': username,
-            'registration_time': time.time()
-        }
+        users is an iterable of dicts with username, password and
+        personal_info. Returns one result per user, in order.
+        """
+        results = []
+        for chunk in iter_chunks(users, chunk_size):
+            results.extend(self._register_user_chunk(chunk))
+        return results
+    
+    def _register_user_chunk(self, users):
+        """Validate a chunk of users, then add them all and seal their block"""
+        since = len(self.blockchain.chain)
+        results = []
+        valid = []
+        registration_time = time.time()
         
-        self.blockchain.add_reservation(registration_record)
-        return {'status': 'success', 'message': 'User registered successfully'}
+        with self._users_lock:
+            seen = set()
+            for user in users:
+                username, password = user.get('username'), user.get('password')
+                if not isinstance(username, str) or not username:
+                    reason = 'Invalid username'
+                elif not isinstance(password, str) or not password:
+                    reason = 'Password required'
+                elif username in self.users or username in seen:
+                    reason = 'User already exists'
+                else:
+                    seen.add(username)
+                    valid.append(user)
+                    results.append({'status': 'success', 'username': username})
+                    continue
+                results.append({'status': 'failed', 'username': username, 'reason': reason})
+            
+            records = [
+                UserRegistration(username=user['username'], registration_time=registration_time)
+                for user in valid
+            ]
+            queued = self.blockchain.add_reservations(records)
+            if queued['status'] != 'success':
+                return [result if result['status'] != 'success' else dict(result, **queued)
+                        for result in results]
+            
+            for user in valid:
+                self.users[user['username']] = {
+                    'username': user['username'],
+                    'password': hashlib.sha256(user['password'].encode()).hexdigest(),
+                    'personal_info': user.get('personal_info', {}),
+                    'registration_time': registration_time
+                }
+        
+        return self._seal_batch(results, 'system', since)
+    
+    def import_users_file(self, path, chunk_size=1000):
+        """Stream user registrations from a CSV or JSONL file
+        
+        CSV columns other than username and password become personal_info.
+        """
+        return self._import_rows(path, _user_from_row, self._register_user_chunk, chunk_size)
     
     def authenticate_user(self, username, password):
         """Authenticate user credentials"""
@@ -37,10 +200,13 @@ class RailwayReservationSystem:
             return stored_password == provided_password
         return False
     
+    def _is_admin(self, admin_username, admin_password):
+        return (admin_username in self.admin_credentials and
+                self.admin_credentials[admin_username] == admin_password)
+    
     def admin_add_train(self, admin_username, admin_password, train_details):
         """Admin function to add new trains"""
-        if (admin_username in self.admin_credentials and 
-            self.admin_credentials[admin_username] == admin_password):
+        if self._is_admin(admin_username, admin_password):
             
             return self.smart_contract.register_train(
                 train_details['train_id'],
@@ -51,29 +217,82 @@ class RailwayReservationSystem:
         
         return {'status': 'failed', 'reason': 'Admin authentication failed'}
     
+    def admin_analytics(self, admin_username, admin_password, group_by='train'):
+        """Admin function to report occupancy, revenue and cancellations
+        
+        group_by is 'train', 'route', 'day', or 'occupancy' for each train
+        and travel date.
+        """
+        if not self._is_admin(admin_username, admin_password):
+            return {'status': 'failed', 'reason': 'Admin authentication failed'}
+        
+        reports = {
+            'train': self.analytics.train_report,
+            'route': self.analytics.route_report,
+            'day': self.analytics.daily_report,
+            'occupancy': self.analytics.occupancy_report
+        }
+        if group_by not in reports:
+            return {'status': 'failed', 'reason': 'Unknown report'}
+        return {'status': 'success', 'report': reports[group_by]()}
+    
+    def admin_add_trains(self, admin_username, admin_password, trains, chunk_size=1000):
+        """Admin function to add many trains, one block per chunk
+        
+        trains is an iterable of admin_add_train's train_details dicts.
+        Returns one result per train, in order.
+        """
+        if not self._is_admin(admin_username, admin_password):
+            return {'status': 'failed', 'reason': 'Admin authentication failed'}
+        
+        results = []
+        for chunk in iter_chunks(trains, chunk_size):
+            results.extend(self._add_train_chunk(chunk))
+        return results
+    
+    def _add_train_chunk(self, trains):
+        since = len(self.blockchain.chain)
+        results = self.smart_contract.register_trains(trains)
+        return self._seal_batch(results, 'system', since)
+    
+    def import_trains_file(self, admin_username, admin_password, path, chunk_size=1000):
+        """Stream a timetable of trains from a CSV or JSONL file
+        
+        CSV rows have train_id, route (stations separated by ';'), seats
+        and fare_per_seat columns.
+        """
+        if not self._is_admin(admin_username, admin_password):
+            return {'status': 'failed', 'reason': 'Admin authentication failed'}
+        return self._import_rows(path, _train_from_row, self._add_train_chunk, chunk_size)
+    
+    @timed('search_trains')
     def search_trains(self, source, destination, travel_date):
-        """Search available trains for given route"""
+        """Search available trains for given route
+        
+        Seat counts are for the source -> destination journey on travel_date;
+        an empty or None travel_date uses the open-date seat pool. waitlisted
+        counts the requests already waiting for the train on that date.
+        """
         available_trains = []
+        travel_date = travel_date or None
         
-        for train_id, details in self.smart_contract.train_schedules.items():
-            route = details['route']
-            if source in route and destination in route:
-                # Check if source comes before destination in route
-                source_index = route.index(source)
-                dest_index = route.index(destination)
-                
-                if source_index < dest_index:
-                    available_trains.append({
-                        'train_id': train_id,
-                        'route': route,
-                        'available_seats': details['available_seats'],
-                        'fare_per_seat': details['fare_per_seat']
-                    })
+        for train_id in self.smart_contract.trains_between(source, destination):
+            details = self.smart_contract.train_schedules[train_id]
+            available_trains.append({
+                'train_id': train_id,
+                'route': details['route'],
+                'available_seats': self.smart_contract.available_seats(
+                    train_id, travel_date, source, destination
+                ),
+                'fare_per_seat': details['fare_per_seat'],
+                'waitlisted': self.smart_contract.waitlist.depth(train_id, travel_date)
+            })
         
         return available_trains
     
-    def make_reservation(self, username, train_id, num_seats, passenger_details):
-        """Make a new reservation"""
+    def make_reservation(self, username, train_id, num_seats, passenger_details,
+                         travel_date=None, source=None, destination=None, waitlist=False):
+        """Make a new reservation, joining the waitlist if asked and the train is full"""
         if username not in self.users:
             return {'status': 'failed', 'reason': 'User not registered'}
         
@@ -81,6 +300,8 @@ class RailwayReservationSystem:
         train_info = self.smart_contract.train_schedules.get(train_id)
         if not train_info:
             return {'status': 'failed', 'reason': 'Invalid train'}
+        if travel_date and not valid_travel_date(travel_date):
+            return {'status': 'failed', 'reason': 'Invalid travel date'}
         
         total_amount = train_info['fare_per_seat'] * num_seats
         
@@ -89,31 +310,200 @@ class RailwayReservationSystem:
             passenger_details,
             train_id,
             num_seats,
-            total_amount
+            total_amount,
+            travel_date or None,
+            source,
+            destination,
+            waitlist
         )
         
-        # Mine the block after successful booking
-        if result['status'] == 'success':
-            self.blockchain.mine_pending_reservations(username)
+        # Seal the block once the batch is full
+        if result['status'] in ('success', 'waitlisted'):
+            self._seal_if_due(result, username)
         
         return result
     
+    def make_reservations(self, bookings, chunk_size=1000):
+        """Make many reservations, mining each chunk of bookings as one block
+        
+        bookings is an iterable of dicts with make_reservation's arguments
+        as keys, e.g. a group or tour booking. Returns one result per
+        booking, in order.
+        """
+        results = []
+        for chunk in iter_chunks(bookings, chunk_size):
+            results.extend(self._reservation_chunk(chunk))
+        return results
+    
+    def _reservation_chunk(self, bookings):
+        """Check users and fares for a chunk, then book it in one pass"""
+        since = len(self.blockchain.chain)
+        requests = []
+        failures = []  # per booking: its failed result, or None if it was sent on
+        for booking in bookings:
+            reason = self._booking_item_error(booking)
+            failures.append(None if reason is None else {'status': 'failed', 'reason': reason})
+            if reason is not None:
+                continue
+            username = booking['username']
+            train_info = self.smart_contract.train_schedules.get(booking.get('train_id'))
+            num_seats = booking.get('num_seats')
+            passenger_details = booking.get('passenger_details') or {}
+            requests.append({
+                'passenger_info': dict(passenger_details, user=username),
+                'train_id': booking.get('train_id'),
+                'num_seats': num_seats,
+                'payment_amount': (train_info['fare_per_seat'] * num_seats
+                                   if train_info and isinstance(num_seats, int) else 0),
+                'travel_date': booking.get('travel_date') or None,
+                'source': booking.get('source'),
+                'destination': booking.get('destination'),
+                'waitlist': booking.get('waitlist', False)
+            })
+        
+        booked = iter(self.smart_contract.book_tickets(requests))
+        results = [failure or next(booked) for failure in failures]
+        return self._seal_batch(results, 'system', since)
+    
+    def _booking_item_error(self, booking):
+        """Return why a make_reservations item cannot be sent on, or None"""
+        if not isinstance(booking, dict):
+            return 'Invalid booking'
+        username = booking.get('username')
+        if not isinstance(username, str) or username not in self.users:
+            return 'User not registered'
+        if not isinstance(booking.get('passenger_details') or {}, dict):
+            return 'Passenger details must be an object'
+        if not isinstance(booking.get('train_id'), str):
+            return 'Invalid train'
+        for field in ('travel_date', 'source', 'destination'):
+            if not isinstance(booking.get(field), (str, type(None))):
+                return f"Invalid {field}"
+        if booking.get('travel_date') and not valid_travel_date(booking['travel_date']):
+            return 'Invalid travel date'
+        return None
+    
+    def import_bookings_file(self, path, chunk_size=1000):
+        """Stream bookings from a CSV or JSONL file
+        
+        CSV columns other than make_reservation's arguments become the
+        passenger details, e.g. name and age.
+        """
+        return self._import_rows(path, _booking_from_row, self._reservation_chunk, chunk_size)
+    
+    def _seal_batch(self, results, mining_reward_address, since):
+        """Mine a batch's records and mark each result with the block holding it
+        
+        since is the chain length before the batch was queued; a batch can
+        span several blocks, some mined by another thread.
+        """
+        self.block_builder.flush(mining_reward_address)
+        mined = {}
+        for height in range(since, len(self.blockchain.chain)):
+            block = self.blockchain.chain[height]
+            for record in block.records():
+                key = _batch_key(record) if isinstance(record, collections.abc.Mapping) else None
+                if key is not None:
+                    mined[key] = block.hash
+        for result in results:
+            if result['status'] in ('success', 'waitlisted'):
+                block_hash = mined.get(_batch_key(result))
+                result['confirmation'] = 'confirmed' if block_hash is not None else 'pending'
+                if block_hash is not None:
+                    result['block_hash'] = block_hash
+        return results
+    
+    def _import_rows(self, path, parse_row, apply_chunk, chunk_size):
+        """Feed a batch file through apply_chunk one chunk at a time
+        
+        Only one chunk of rows is held in memory. Returns counts and the
+        failed rows, each tagged with its line number.
+        """
+        summary = {'status': 'success', 'processed': 0, 'succeeded': 0, 'failed': []}
+        for chunk in iter_chunks(read_batch_file(path), chunk_size):
+            items, lines = [], []
+            for line, row in chunk:
+                summary['processed'] += 1
+                try:
+                    items.append(parse_row(row))
+                    lines.append(line)
+                except (KeyError, ValueError, TypeError, AttributeError) as error:
+                    summary['failed'].append(
+                        {'status': 'failed', 'line': line, 'reason': f"Bad row: {error!r}"}
+                    )
+            
+            for line, result in zip(lines, apply_chunk(items)):
+                if result['status'] == 'success':
+                    summary['succeeded'] += 1
+                else:
+                    summary['failed'].append(dict(result, line=line))
+        return summary
+    
+    def _seal_if_due(self, result, mining_reward_address):
+        """Seal pending reservations and record whether result is on chain"""
+        block = self.block_builder.seal_if_due(mining_reward_address)
+        if block is not None:
+            result['confirmation'] = 'confirmed'
+            result['block_hash'] = block.hash
+        else:
+            result['confirmation'] = 'pending'
+    
+    @timed('check_pnr_status')
     def check_pnr_status(self, ticket_id):
-        """Check reservation status using ticket ID"""
-        for block in self.blockchain.chain:
-            block_data = block.data if isinstance(block.data, list) else [block.data]
-            for reservation in block_data:
-                if (isinstance(reservation, dict) and 
-                    reservation.get('ticket_id') == ticket_id):
-                    return {
-                        'status': 'found',
-                        'reservation_details': reservation,
-                        'block_hash': block.hash,
-                        'block_timestamp': block.timestamp
-                    }
+        """Check reservation status using ticket ID
+        
+        reservation_details is the booking as recorded on chain, so its
+        Merkle proof verifies; ticket_status and refund_amount give its
+        current state, and waitlist_position its place while waitlisted.
+        """
+        block, reservation = self.blockchain.find_ticket(ticket_id)
+        if reservation is not None and block is None:
+            return self._with_ticket_state({
+                'status': 'pending',
+                'reservation_details': reservation,
+                'message': 'Awaiting block confirmation'
+            }, ticket_id)
+        
+        if reservation is not None:
+            result = self._with_ticket_state({
+                'status': 'found',
+                'reservation_details': reservation,
+                'block_hash': block.hash,
+                'block_timestamp': block.timestamp
+            }, ticket_id)
+            if block.hash_version >= 3:
+                # Lets kiosks verify the ticket with verify_ticket_proof
+                _, offset = self.blockchain.ticket_index[ticket_id]
+                result['block_header'] = block.header()
+                result['merkle_proof'] = block.merkle_proof(offset)
+            return result
         
         return {'status': 'not_found', 'message': 'Invalid ticket ID'}
     
+    def _with_ticket_state(self, result, ticket_id):
+        """Add a ticket's current status, any refund paid and any waitlist
+        position to result
+        """
+        state = self.smart_contract.ticket_states.get(ticket_id)
+        if state is not None:
+            result['ticket_status'] = state[0]
+            if state[1] is not None:
+                result['refund_amount'] = state[1]
+            if state[0] == TicketStates.WAITLISTED:
+                result['waitlist_position'] = self.smart_contract.waitlist.position(ticket_id)
+        return result
+    
+    def _current_booking(self, location):
+        """Return the booking at location with its current status"""
+        booking = self.blockchain.get_record(location)
+        state = None if booking is None else self.smart_contract.ticket_states.get(booking['ticket_id'])
+        if state is None:
+            return booking
+        booking = dict(booking, status=state[0])
+        if state[1] is not None:
+            booking['refund_amount'] = state[1]
+        return booking
+    
     def cancel_reservation(self, username, ticket_id, reason):
         """Cancel existing reservation"""
         if username not in self.users:
@@ -121,26 +511,302 @@ class RailwayReservationSystem:
         
         result = self.smart_contract.cancel_ticket(ticket_id, reason)
         
-        # Mine the cancellation block
+        # Seal the cancellation block once the batch is full
         if result['status'] == 'success':
-            self.blockchain.mine_pending_reservations(username)
+            self._seal_if_due(result, username)
         
         return result
     
     def get_user_bookings(self, username):
-        """Get all bookings for a specific user"""
-        user_bookings = []
+        """Get all bookings for a specific user, with their current status"""
+        return [
+            self._current_booking(location)
+            for location in self.blockchain.find_user_bookings(username)
+        ]
+    
+    def get_user_bookings_page(self, username, limit=20, cursor=None):
+        """Get one page of a user's bookings, newest first
+        
+        Pass the returned next_cursor back in to fetch the following page;
+        it is None once the oldest booking has been returned.
+        """
+        locations = self.blockchain.find_user_bookings(username)
+        end = len(locations) if cursor is None else min(cursor, len(locations))
+        start = max(end - limit, 0)
         
+        bookings = [
+            self._current_booking(locations[i])
+            for i in range(end - 1, start - 1, -1)
+        ]
+        
+        return {
+            'bookings': bookings,
+            'next_cursor': start if start > 0 else None
+        }
+    
+    def apply_block(self, block):
+        """Replay the state changes recorded in a mined block"""
+        self.apply_records(block.records())
+    
+    def apply_records(self, records):
+        """Replay the state changes of records in chain order"""
+        for record in records:
+            if not isinstance(record, collections.abc.Mapping):
+                continue
+            if record.get('type') == 'user_registration':
+                # Passwords never go on chain, so replayed users must reset theirs
+                self.users.setdefault(record['username'], {
+                    'username': record['username'],
+                    'password': None,
+                    'personal_info': {},
+                    'registration_time': record['registration_time']
+                })
+            else:
+                self.smart_contract.apply_record(record)
+    
+    def replay_blocks(self, start, end):
+        """Index and replay chain blocks in the range [start, end)"""
+        for height in range(start, end):
+            block = self.blockchain.chain[height]
+            self.blockchain.index_block(block)
+            self.apply_block(block)
+    
+    def accept_block(self, block):
+        """Append a block mined by a peer and apply its records
+        
+        Returns False, changing nothing, unless the block validly extends
+        the current tip.
+        """
+        return self.accept_blocks([block]) == 1
+    
+    def accept_blocks(self, blocks):
+        """Append consecutive peer blocks to the tip, stopping at the first
+        one that does not validly extend it; returns how many were accepted
+        """
+        accepted = []
+        with self.blockchain.mining_lock:
+            with self.smart_contract.quiesce():
+                for block in blocks:
+                    if not self.blockchain.check_block(block, self.blockchain.get_latest_block()):
+                        break
+                    self.blockchain.append_block(block, notify=False)
+                    self.apply_block(block)
+                    self.blockchain.mempool.discard(block.records())
+                    accepted.append(block)
+        for block in accepted:
+            self.blockchain.notify_block_listeners(block)
+        return len(accepted)
+    
+    def switch_branch(self, fork_height, blocks):
+        """Replace the blocks above fork_height with a heavier branch
+        
+        blocks must already be validated against the chain up to
+        fork_height. Records from abandoned blocks that the new branch does
+        not contain go back into the mempool, and the contract state is
+        rebuilt from the new chain plus the mempool. Waiting bookings whose
+        seats the new branch has given away, and cancellations of tickets it
+        already cancelled, are dropped, as are records a full mempool
+        refuses. Returns the number of re-queued and dropped records. fork_height must not be below the
+        chain's pruned_height.
+        """
+        chain = self.blockchain.chain
+        with self.blockchain.mining_lock, self.smart_contract.quiesce():
+            orphaned = [
+                record
+                for height in range(fork_height + 1, len(chain))
+                for record in chain[height].records()
+                if isinstance(record, collections.abc.Mapping) and
+                record.get('type') != 'mining_reward'
+            ]
+            self.blockchain.truncate(fork_height + 1)
+            self.snapshot_height = min(self.snapshot_height, fork_height)
+            for block in blocks:
+                self.blockchain.append_block(block, notify=False)
+            
+            on_chain = {Mempool.record_id(record) for block in blocks for record in block.records()
+                        if isinstance(record, collections.abc.Mapping)}
+            orphaned = [record for record in orphaned if Mempool.record_id(record) not in on_chain]
+            self.blockchain.mempool.discard([record for block in blocks for record in block.records()
+                                             if isinstance(record, collections.abc.Mapping)])
+            
+            # Orphaned records were queued before the waiting ones, so they
+            # go back first: a waiting cancellation must follow its booking
+            waiting = list(self.blockchain.mempool)
+            self.blockchain.mempool.discard(waiting)
+            self._rebuild_state()
+            dropped = []
+            for record in orphaned + waiting:
+                # Queue each record before replaying it, so a cancellation
+                # finds a booking that went back into the mempool before it
+                if (self.smart_contract.can_apply(record) and
+                        self.blockchain.add_reservation(record)['status'] == 'success'):
+                    self.apply_records([record])
+                else:
+                    dropped.append(record)
+            dropped_ids = {id(record) for record in dropped}
+            requeued = [record for record in orphaned if id(record) not in dropped_ids]
+        
+        for block in blocks:
+            self.blockchain.notify_block_listeners(block)
+        return {'requeued': len(requeued), 'dropped': len(dropped)}
+    
+    def _rebuild_state(self):
+        """Recompute trains, seats and ticket states from the whole chain
+        
+        Pruned blocks replay the records they kept, which is all the live
+        state depends on. Users keep their local password hashes; callers
+        hold the contract locks.
+        """
+        self.smart_contract.reset()
         for block in self.blockchain.chain:
-            block_data = block.data if isinstance(block.data, list) else [block.data]
-            for reservation in block_data:
-                if (isinstance(reservation, dict) and 
-                    reservation.get('type') == 'ticket_booking' and
-                    reservation.get('passenger_info', {}).get('user') == username):
-                    user_bookings.append(reservation)
-        
-        return user_bookings
-    
-    def validate_blockchain_integrity(self):
-        """Validate the entire blockchain for tampering"""
-        return self.blockchain.is_chain_valid()
+            self.apply_block(block)
+    
+    def export_state(self):
+        """Return the contract, user and index state as plain data"""
+        state = {
+            'train_schedules': self.smart_contract.train_schedules,
+            'seat_inventory': self.smart_contract.seat_inventory.export(),
+            'ticket_states': self.smart_contract.ticket_states.export(),
+            'waitlist': self.smart_contract.waitlist.export(),
+            'users': self.users
+        }
+        state.update(self.blockchain.export_indexes())
+        return state
+    
+    def save_snapshot(self):
+        """Write a snapshot of the state at the current chain tip
+        
+        Records still waiting to be mined are left out, so a busy node
+        snapshots as often as an idle one.
+        """
+        # Pause mining, bookings and registrations so the state holds still
+        with self.blockchain.mining_lock, self.smart_contract.quiesce(), self._users_lock:
+            if self.block_store is not None:
+                self.block_store.sync()
+            
+            tip = self.blockchain.get_latest_block()
+            snapshot = {'height': tip.index, 'block_hash': tip.hash}
+            if self.blockchain.pending_reservations or self.blockchain.mining_batch is not None:
+                state = self._tip_state()  # The live state includes those records
+            else:
+                state = self.export_state()
+            # Serialize while paused; the state keeps changing once we resume
+            snapshot.update(json.loads(json.dumps(state)))
+        self.snapshot_store.save(snapshot)
+        self.snapshot_height = tip.index
+        return True
+    
+    def _tip_state(self):
+        """Return export_state as of the chain tip, without pending records
+        
+        A replica loads the newest snapshot and replays the blocks after it,
+        looking tickets up in this node's indexes, which only cover the
+        chain. Callers hold the mining lock.
+        """
+        chain = self.blockchain.chain
+        replica = RailwayReservationSystem()
+        replica.blockchain.chain = chain
+        replica.blockchain.ticket_index = self.blockchain.ticket_index
+        replica.blockchain.user_index = self.blockchain.user_index
+        start = 0
+        snapshot = self._newest_snapshot()
+        if snapshot is not None:
+            replica._load_snapshot(snapshot)
+            start = snapshot['height'] + 1
+        for height in range(start, len(chain)):
+            replica.apply_block(chain[height])
+        
+        # Drop tickets pruned from the chain since that snapshot
+        for ticket_id in list(replica.smart_contract.ticket_states.states):
+            if ticket_id not in self.blockchain.ticket_index:
+                replica.smart_contract._forget_ticket(ticket_id)
+        
+        state = replica.export_state()
+        # Passwords and personal details only live on this node
+        state['users'] = {username: self.users.get(username, user)
+                          for username, user in replica.users.items()}
+        return state
+    
+    def _snapshot_if_due(self, block):
+        """Block listener that snapshots every snapshot_interval blocks"""
+        if block.index - self.snapshot_height >= self.snapshot_interval:
+            self.save_snapshot()
+    
+    def restore_state(self):
+        """Load the newest usable snapshot and replay the blocks after it"""
+        start = 0
+        snapshot = self._newest_snapshot()
+        if snapshot is not None:
+            self.blockchain.load_indexes(snapshot)
+            self._load_snapshot(snapshot)
+            self.snapshot_height = snapshot['height']
+            start = snapshot['height'] + 1
+        
+        self.replay_blocks(start, len(self.blockchain.chain))
+    
+    def _newest_snapshot(self):
+        """Return the newest stored snapshot of a block on the chain, or None"""
+        chain = self.blockchain.chain
+        for snapshot in self.snapshot_store.snapshots():
+            height = snapshot['height']
+            if 'ticket_states' not in snapshot:
+                continue  # Written before seat inventory or ticket states existed
+            if height < len(chain) and chain[height].hash == snapshot['block_hash']:
+                return snapshot
+        return None
+    
+    def _load_snapshot(self, snapshot):
+        """Load a snapshot's contract and user state; the indexes must be loaded"""
+        self.smart_contract.load_schedules(snapshot['train_schedules'])
+        self.smart_contract.seat_inventory.load(snapshot['seat_inventory'])
+        self.smart_contract.ticket_states.load(snapshot['ticket_states'])
+        self.smart_contract.load_waitlist(snapshot.get('waitlist', []))
+        self.users = snapshot['users']
+    
+    def verify_snapshot(self, snapshot):
+        """Check a snapshot against a full replay of the chain up to its height"""
+        height = snapshot['height']
+        if height >= len(self.blockchain.chain):
+            return False
+        if self.blockchain.chain[height].hash != snapshot['block_hash']:
+            return False
+        
+        replica = RailwayReservationSystem()
+        replica.blockchain.chain = self.blockchain.chain
+        replica.blockchain.ticket_index = {}
+        replica.blockchain.user_index = {}
+        replica.replay_blocks(0, height + 1)
+        
+        # Round-trip through JSON so both sides use the same container types
+        expected = json.loads(json.dumps(replica.export_state()))
+        actual = json.loads(json.dumps({key: snapshot[key] for key in expected}))
+        
+        # Passwords and personal details are only in the snapshot, and
+        # pruned blocks no longer hold the registrations they covered
+        expected_users = set(expected.pop('users'))
+        actual_users = set(actual.pop('users'))
+        if self.blockchain.pruned_height > 0:
+            users_match = expected_users <= actual_users
+        else:
+            users_match = expected_users == actual_users
+        return users_match and expected == actual
+    
+    def close(self):
+        """Mine pending records, snapshot the state, save the analytics
+        columns and close the block store
+        """
+        if self.snapshot_store is not None:
+            self.block_builder.flush('system')
+            self.save_snapshot()
+        if self.analytics.directory is not None and self.analytics.height >= 0:
+            self.analytics.save()
+        if self.block_store is not None:
+            self.block_store.close()
+    
+    def validate_blockchain_integrity(self, full=False, workers=1):
+        """Validate the blockchain for tampering
+        
+        Only blocks added since the last successful check are validated
+        unless full=True.
+        """
+        return self.blockchain.is_chain_valid(full, workers)
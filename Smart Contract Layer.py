@@ -1,126 +1,911 @@
+def _popcount(bits):
+    """Count set bits in a non-negative int"""
+    return bin(bits).count('1')
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+
+class SeatInventory:
+    """Seat occupancy per (train, travel date) and route segment
+    
+    Segment i covers the stretch from stop i to stop i + 1. Each segment is
+    one int bitmap with bit s set while seat s is taken on that stretch, so
+    a journey from stop i to stop j conflicts only with bookings that
+    overlap segments i..j-1. Inventory for a date is created when a seat on
+    it is first taken, and dropped once every seat is free again.
+    """
+    def __init__(self):
+        self.occupancy = {}  # train_id -> {travel_date: [segment bitmap, ...]}
+    
+    def _segments(self, train_id, travel_date, num_segments):
+        dates = self.occupancy.setdefault(train_id, {})
+        segments = dates.get(travel_date)
+        if segments is None:
+            segments = dates[travel_date] = [0] * num_segments
+        return segments
+    
+    def _free_bits(self, segments, total_seats, start, end):
+        taken = 0
+        for i in range(start, end):
+            taken |= segments[i]
+        return ((1 << total_seats) - 1) & ~taken
+    
+    def free_seats(self, train_id, travel_date, total_seats, start, end):
+        """Count seats free on every segment between stop start and stop end"""
+        segments = self.occupancy.get(train_id, {}).get(travel_date)
+        if segments is None:
+            return total_seats
+        return _popcount(self._free_bits(segments, total_seats, start, end))
+    
+    def allocate(self, train_id, travel_date, total_seats, num_segments,
+                 start, end, num_seats):
+        """Take the lowest-numbered free seats for a journey, or return None"""
+        segments = self.occupancy.get(train_id, {}).get(travel_date) or [0] * num_segments
+        free = self._free_bits(segments, total_seats, start, end)
+        if _popcount(free) < num_seats:
+            return None
+        
+        segments = self._segments(train_id, travel_date, num_segments)
+        seats = []
+        mask = 0
+        for _ in range(num_seats):
+            lowest = free & -free
+            seats.append(lowest.bit_length() - 1)
+            mask |= lowest
+            free ^= lowest
+        for i in range(start, end):
+            segments[i] |= mask
+        return seats
+    
+    def is_free(self, train_id, travel_date, total_seats, start, end, seats):
+        """Check that specific seats are free for a whole journey"""
+        segments = self.occupancy.get(train_id, {}).get(travel_date)
+        if segments is None:
+            return all(seat < total_seats for seat in seats)
+        mask = sum(1 << seat for seat in seats)
+        return mask & self._free_bits(segments, total_seats, start, end) == mask
+    
+    def occupy(self, train_id, travel_date, num_segments, start, end, seats):
+        """Mark specific seats taken, e.g. when replaying a booking"""
+        segments = self._segments(train_id, travel_date, num_segments)
+        mask = sum(1 << seat for seat in seats)
+        for i in range(start, end):
+            segments[i] |= mask
+    
+    def release(self, train_id, travel_date, start, end, seats):
+        """Free seats previously allocated for a journey"""
+        segments = self.occupancy.get(train_id, {}).get(travel_date)
+        if segments is None:
+            return
+        mask = sum(1 << seat for seat in seats)
+        for i in range(start, end):
+            segments[i] &= ~mask
+        if not any(segments):
+            del self.occupancy[train_id][travel_date]
+    
+    def reset_train(self, train_id):
+        """Drop all bookings held for a train"""
+        self.occupancy.pop(train_id, None)
+    
+    def export(self):
+        """Return occupancy as JSON-serializable data"""
+        return sorted(
+            ([train_id, travel_date, [format(bits, 'x') for bits in segments]]
+             for train_id, dates in self.occupancy.items()
+             for travel_date, segments in dates.items()),
+            key=lambda entry: (entry[0], entry[1] or '')
+        )
+    
+    def load(self, exported):
+        """Restore occupancy saved by export"""
+        self.occupancy = {}
+        for train_id, travel_date, segments in exported:
+            self.occupancy.setdefault(train_id, {})[travel_date] = [
+                int(bits, 16) for bits in segments
+            ]
+
+class FenwickTree:
+    """Growable binary indexed tree with O(log n) updates and prefix sums"""
+    def __init__(self):
+        self.tree = [0]  # 1-based; tree[i] sums the lowbit(i) items ending at i
+    
+    def __len__(self):
+        return len(self.tree) - 1
+    
+    def append(self, value):
+        index = len(self.tree)
+        self.tree.append(value + self.prefix_sum(index - 1)
+                         - self.prefix_sum(index - (index & -index)))
+    
+    def add(self, position, delta):
+        """Add delta to the item at a 0-based position"""
+        index = position + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+    
+    def prefix_sum(self, count):
+        """Sum the first count items"""
+        total = 0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+        return total
+
+class Waitlist:
+    """Booking requests waiting for seats, per train and travel date
+    
+    Freed seats go to the oldest request they can hold. Each queue groups
+    its requests by journey and seat count, so finding that request looks
+    at one head per group rather than at every request; withdrawn requests
+    are dropped lazily when they reach a head. A Fenwick tree over arrival
+    order counts the requests still waiting ahead of any one of them.
+    """
+    def __init__(self):
+        self.queues = {}  # (train_id, travel_date) -> queue dict
+        self.requests = {}  # ticket_id -> (queue key, sequence, (start, end, num_seats), record)
+    
+    def __len__(self):
+        return len(self.requests)
+    
+    def __contains__(self, ticket_id):
+        return ticket_id in self.requests
+    
+    def add(self, record, start, end):
+        """Queue a waitlist request covering stops start..end; returns its position"""
+        key = (record['train_id'], record.get('travel_date'))
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = {'groups': {}, 'arrivals': FenwickTree(), 'live': 0}
+        sequence = len(queue['arrivals'])
+        queue['arrivals'].append(1)
+        queue['live'] += 1
+        group = (start, end, record['num_seats'])
+        queue['groups'].setdefault(group, collections.deque()).append((sequence, record['ticket_id']))
+        self.requests[record['ticket_id']] = (key, sequence, group, record)
+        return queue['arrivals'].prefix_sum(sequence + 1)
+    
+    def remove(self, ticket_id):
+        """Withdraw a request; returns its entry for restore, or None"""
+        entry = self.requests.pop(ticket_id, None)
+        if entry is None:
+            return None
+        key, sequence = entry[:2]
+        queue = self.queues[key]
+        queue['live'] -= 1
+        if queue['live']:
+            queue['arrivals'].add(sequence, -1)
+        else:
+            # An empty queue starts over rather than keep dead arrivals
+            del self.queues[key]
+        return entry
+    
+    def restore(self, entry):
+        """Put back a request removed by remove or next_fitting, in its old place"""
+        key, sequence, group, record = entry
+        queue = self.queues.get(key)
+        if queue is None:
+            self.add(record, group[0], group[1])
+            return
+        queue['arrivals'].add(sequence, 1)
+        queue['live'] += 1
+        # remove() leaves the request in its group, to be dropped lazily, and
+        # restoring it makes that copy live again. next_fitting took it from
+        # the head, so it goes back there
+        waiting = queue['groups'].setdefault(group, collections.deque())
+        if not waiting or waiting[0][0] > sequence:
+            waiting.appendleft((sequence, record['ticket_id']))
+        self.requests[record['ticket_id']] = entry
+    
+    def position(self, ticket_id):
+        """Return a request's 1-based place in its queue, or None if not waiting"""
+        entry = self.requests.get(ticket_id)
+        if entry is None:
+            return None
+        key, sequence = entry[:2]
+        return self.queues[key]['arrivals'].prefix_sum(sequence + 1)
+    
+    def depth(self, train_id, travel_date):
+        """Count the requests waiting for a train on a date"""
+        queue = self.queues.get((train_id, travel_date))
+        return queue['live'] if queue is not None else 0
+    
+    def next_fitting(self, train_id, travel_date, fits):
+        """Remove and return the entry of the oldest request that fits
+        
+        fits(start, end, num_seats) says whether the free seats can hold a
+        group's requests. Returns None when no waiting request fits.
+        """
+        key = (train_id, travel_date)
+        queue = self.queues.get(key)
+        if queue is None:
+            return None
+        heads = []
+        for group, waiting in list(queue['groups'].items()):
+            while waiting and self._is_withdrawn(key, *waiting[0]):
+                waiting.popleft()
+            if waiting:
+                heads.append((waiting[0][0], group))
+            else:
+                del queue['groups'][group]
+        heads.sort()
+        for _, group in heads:
+            if fits(*group):
+                _, ticket_id = queue['groups'][group].popleft()
+                return self.remove(ticket_id)
+        return None
+    
+    def _is_withdrawn(self, key, sequence, ticket_id):
+        entry = self.requests.get(ticket_id)
+        return entry is None or entry[0] != key or entry[1] != sequence
+    
+    def export(self):
+        """Return [train_id, travel_date, ticket IDs oldest first] per queue"""
+        exported = {}
+        for ticket_id, (key, sequence, _, _) in self.requests.items():
+            exported.setdefault(key, []).append((sequence, ticket_id))
+        return [[train_id, travel_date, [ticket_id for _, ticket_id in sorted(waiting)]]
+                for (train_id, travel_date), waiting in exported.items()]
+
+class TicketStates:
+    """Materialized status of every known ticket
+    
+    Maps each ticket ID to (status, refund amount, seats held). Entries
+    change as bookings and cancellations are queued or replayed, so
+    cancelling a ticket or reporting its status never goes back to the
+    chain. A cancelled ticket holds no seats and cannot be cancelled again;
+    a waitlisted one holds none until it is promoted.
+    """
+    CONFIRMED = 'confirmed'
+    WAITLISTED = 'waitlisted'
+    CANCELLED = 'cancelled'
+    
+    def __init__(self):
+        self.states = {}  # ticket_id -> (status, refund amount or None, seats held)
+    
+    def __len__(self):
+        return len(self.states)
+    
+    def get(self, ticket_id):
+        """Return (status, refund amount, seats held), or None if unknown"""
+        return self.states.get(ticket_id)
+    
+    def status(self, ticket_id):
+        state = self.states.get(ticket_id)
+        return state[0] if state is not None else None
+    
+    def seats_held(self, ticket_id):
+        state = self.states.get(ticket_id)
+        return state[2] if state is not None else []
+    
+    def book(self, ticket_id, seats):
+        self.states[ticket_id] = (self.CONFIRMED, None, seats)
+    
+    def waitlist(self, ticket_id):
+        self.states[ticket_id] = (self.WAITLISTED, None, [])
+    
+    def cancel(self, ticket_id, refund_amount):
+        self.states[ticket_id] = (self.CANCELLED, refund_amount, [])
+    
+    def forget(self, ticket_id):
+        """Drop a ticket, e.g. once pruning removes its booking"""
+        self.states.pop(ticket_id, None)
+    
+    def export(self):
+        """Return the ticket states as JSON-serializable data"""
+        return {ticket_id: list(state) for ticket_id, state in self.states.items()}
+    
+    def load(self, exported):
+        """Restore ticket states saved by export"""
+        self.states = {ticket_id: (status, refund_amount, seats)
+                       for ticket_id, (status, refund_amount, seats) in exported.items()}
+
 class SmartContract:
     def __init__(self, blockchain):
         self.blockchain = blockchain
+        self.metrics = blockchain.metrics
         self.train_schedules = {}
         self.seat_availability = {}
         self.fare_structure = {}
+        self.station_index = {}  # station -> {train_id: stop position}
+        self.seat_inventory = SeatInventory()
+        self.ticket_states = TicketStates()
+        self.waitlist = Waitlist()
+        self._train_locks = {}  # train_id -> lock guarding that train's seats
+        self._registration_lock = threading.Lock()
+        blockchain.prune_listeners.append(self._prune_ticket)
+    
+    def train_lock(self, train_id):
+        """Return the lock serializing seat changes for one train"""
+        lock = self._train_locks.get(train_id)
+        if lock is None:
+            # dict.setdefault is atomic, so racing callers share one lock
+            lock = self._train_locks.setdefault(train_id, threading.RLock())
+        return lock
+    
+    @contextlib.contextmanager
+    def quiesce(self):
+        """Hold every train lock so no booking or cancellation is mid-flight"""
+        with self._registration_lock:
+            locks = [self.train_lock(train_id) for train_id in sorted(self._train_locks)]
+            for lock in locks:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
         
     def register_train(self, train_id, route, seats, fare_per_seat):
         """Register a new train in the system"""
-        contract_data = {
-            'type': 'train_registration',
-            'train_id': train_id,
-            'route': route,
-            'total_seats': seats,
-            'fare_per_seat': fare_per_seat,
-            'timestamp': time.time()
-        }
+        contract_data = TrainRegistration(
+            train_id=train_id,
+            route=route,
+            total_seats=seats,
+            fare_per_seat=fare_per_seat,
+            timestamp=time.time()
+        )
         
-        self.train_schedules[train_id] = {
-            'route': route,
-            'total_seats': seats,
-            'available_seats': seats,
-            'fare_per_seat': fare_per_seat
-        }
+        with self._registration_lock, self.train_lock(train_id):
+            queued = self.blockchain.add_reservation(contract_data)
+            if queued['status'] != 'success':
+                return queued
+            
+            self._set_schedule(train_id, {
+                'route': route,
+                'total_seats': seats,
+                'fare_per_seat': fare_per_seat
+            })
+        return {'status': 'success', 'train_id': train_id}
+    
+    def register_trains(self, trains):
+        """Register many trains, queueing all records in one mempool update
+        
+        trains is a list of dicts with train_id, route, seats and
+        fare_per_seat. Invalid entries and train IDs repeated within the
+        batch fail without affecting the rest. Returns one result per train.
+        """
+        results = []
+        valid = []
+        seen = set()
+        for train in trains:
+            train_id, route = train.get('train_id'), train.get('route')
+            seats, fare = train.get('seats'), train.get('fare_per_seat')
+            if not isinstance(train_id, str) or not train_id:
+                reason = 'Invalid train ID'
+            elif train_id in seen:
+                reason = 'Duplicate train ID in batch'
+            elif (not isinstance(route, list) or len(route) < 2 or
+                    len(set(route)) != len(route) or
+                    not all(isinstance(station, str) and station for station in route)):
+                reason = 'Route needs at least two distinct stations'
+            elif not isinstance(seats, int) or seats < 1:
+                reason = 'Invalid seat count'
+            elif not isinstance(fare, (int, float)) or fare < 0:
+                reason = 'Invalid fare'
+            else:
+                reason = None
+            
+            if reason is None:
+                seen.add(train_id)
+                valid.append(train)
+                results.append({'status': 'success', 'train_id': train_id})
+            else:
+                results.append({'status': 'failed', 'train_id': train_id, 'reason': reason})
+        
+        timestamp = time.time()
+        records = [
+            TrainRegistration(
+                train_id=train['train_id'],
+                route=train['route'],
+                total_seats=train['seats'],
+                fare_per_seat=train['fare_per_seat'],
+                timestamp=timestamp
+            )
+            for train in valid
+        ]
+        with self._registration_lock:
+            queued = self.blockchain.add_reservations(records)
+            if queued['status'] != 'success':
+                return [result if result['status'] != 'success' else dict(result, **queued)
+                        for result in results]
+            
+            for train in valid:
+                with self.train_lock(train['train_id']):
+                    self._set_schedule(train['train_id'], {
+                        'route': train['route'],
+                        'total_seats': train['seats'],
+                        'fare_per_seat': train['fare_per_seat']
+                    })
+        return results
+    
+    def _set_schedule(self, train_id, schedule):
+        """Store a train schedule and index its stations"""
+        self.seat_inventory.reset_train(train_id)
+        if train_id in self.train_schedules:
+            for station in self.train_schedules[train_id]['route']:
+                self.station_index.get(station, {}).pop(train_id, None)
         
-        self.blockchain.add_reservation(contract_data)
-        return True
+        for position, station in enumerate(schedule['route']):
+            self.station_index.setdefault(station, {}).setdefault(train_id, position)
+        
+        self.train_schedules[train_id] = schedule
+    
+    def reset(self):
+        """Forget all trains and seat state, before replaying a new chain"""
+        self.train_schedules = {}
+        self.station_index = {}
+        self.seat_inventory = SeatInventory()
+        self.ticket_states = TicketStates()
+        self.waitlist = Waitlist()
+    
+    def _forget_ticket(self, ticket_id):
+        self.ticket_states.forget(ticket_id)
+        self.waitlist.remove(ticket_id)
+    
+    def _prune_ticket(self, record):
+        """Prune listener: free the seats a pruned booking still holds
+        
+        Replaying the pruned chain never sees the booking, so its seats and
+        ticket state go too. The train lock is reentrant, as accepting
+        peer blocks prunes while quiesced.
+        """
+        with self.train_lock(record['train_id']):
+            if record.get('type') == 'ticket_booking':
+                self._release_booking(record)
+            self._forget_ticket(record['ticket_id'])
+    
+    def load_waitlist(self, exported):
+        """Rebuild the waitlist from Waitlist.export data, e.g. from a state snapshot"""
+        self.waitlist = Waitlist()
+        for train_id, travel_date, ticket_ids in exported:
+            train = self.train_schedules.get(train_id)
+            for ticket_id in ticket_ids:
+                _, request = self.blockchain.find_ticket(ticket_id)
+                if train is not None and request is not None and \
+                        request.get('type') == 'waitlist_request':
+                    self.waitlist.add(request, *self._journey_stops(train, request))
     
-    def book_ticket(self, passenger_info, train_id, num_seats, payment_amount):
-        """Execute ticket booking smart contract"""
+    def load_schedules(self, train_schedules):
+        """Replace all train schedules, e.g. from a state snapshot"""
+        self.train_schedules = {}
+        self.station_index = {}
+        for train_id, schedule in train_schedules.items():
+            self._set_schedule(train_id, schedule)
+    
+    def apply_record(self, record):
+        """Replay the state change of a mined contract record"""
+        record_type = record.get('type')
+        
+        if record_type == 'train_registration':
+            self._set_schedule(record['train_id'], {
+                'route': record['route'],
+                'total_seats': record['total_seats'],
+                'fare_per_seat': record['fare_per_seat']
+            })
+        
+        elif record_type == 'ticket_booking':
+            train = self.train_schedules.get(record['train_id'])
+            if train is not None:
+                start, end = self._journey_stops(train, record)
+                seats = record.get('seats')
+                if seats:
+                    self.seat_inventory.occupy(
+                        record['train_id'], record.get('travel_date'),
+                        len(train['route']) - 1, start, end, seats
+                    )
+                else:
+                    # Bookings made before seat inventory get the lowest free seats
+                    seats = self.seat_inventory.allocate(
+                        record['train_id'], record.get('travel_date'), train['total_seats'],
+                        len(train['route']) - 1, start, end, record['num_seats']
+                    ) or []
+                self.ticket_states.book(record['ticket_id'], seats)
+                # A booking for a waitlisted ticket records its promotion
+                self.waitlist.remove(record['ticket_id'])
+        
+        elif record_type == 'waitlist_request':
+            train = self.train_schedules.get(record['train_id'])
+            if train is not None and self.ticket_states.status(record['ticket_id']) is None:
+                self.waitlist.add(record, *self._journey_stops(train, record))
+                self.ticket_states.waitlist(record['ticket_id'])
+        
+        elif record_type == 'ticket_cancellation':
+            ticket_id = record['original_ticket_id']
+            # Repeated cancellations of one ticket release nothing
+            status = self.ticket_states.status(ticket_id)
+            if status == TicketStates.CONFIRMED:
+                _, booking = self.blockchain.find_ticket(ticket_id)
+                if booking is not None:
+                    self._release_booking(booking)
+                self.ticket_states.cancel(ticket_id, record['refund_amount'])
+            elif status == TicketStates.WAITLISTED:
+                self.waitlist.remove(ticket_id)
+                self.ticket_states.cancel(ticket_id, record['refund_amount'])
+    
+    def can_apply(self, record):
+        """Check that replaying a record would not take seats already held,
+        cancel a ticket that is no longer live or waitlist a known ticket
+        """
+        if record.get('type') == 'ticket_cancellation':
+            return self.ticket_states.status(record['original_ticket_id']) in (
+                TicketStates.CONFIRMED, TicketStates.WAITLISTED)
+        if record.get('type') == 'waitlist_request':
+            return self.ticket_states.status(record['ticket_id']) is None
+        if record.get('type') != 'ticket_booking' or not record.get('seats'):
+            return True
+        train = self.train_schedules.get(record['train_id'])
+        if train is None:
+            return False
+        start, end = self._journey_stops(train, record)
+        return self.seat_inventory.is_free(
+            record['train_id'], record.get('travel_date'), train['total_seats'],
+            start, end, record['seats']
+        )
+    
+    def _journey_stops(self, train, booking):
+        """Return the (start, end) stop positions a booking covers"""
+        to_stop = booking.get('to_stop', -1)
+        if to_stop < 0:
+            to_stop = len(train['route']) - 1
+        return booking.get('from_stop', 0), to_stop
+    
+    def _release_booking(self, booking):
+        """Return the seats a booking holds to the inventory"""
+        train = self.train_schedules.get(booking['train_id'])
+        if train is None:
+            return
+        start, end = self._journey_stops(train, booking)
+        seats = self.ticket_states.seats_held(booking['ticket_id'])
+        self.seat_inventory.release(
+            booking['train_id'], booking.get('travel_date'), start, end, seats
+        )
+    
+    def available_seats(self, train_id, travel_date=None, source=None, destination=None):
+        """Count seats free for a journey on a date (defaults: whole route, open date)"""
+        train = self.train_schedules[train_id]
+        start = self.station_index[source][train_id] if source else 0
+        end = self.station_index[destination][train_id] if destination else len(train['route']) - 1
+        return self.seat_inventory.free_seats(
+            train_id, travel_date, train['total_seats'], start, end
+        )
+    
+    def trains_between(self, source, destination):
+        """Return IDs of trains that stop at source before destination"""
+        source_stops = self.station_index.get(source, {})
+        dest_stops = self.station_index.get(destination, {})
+        
+        # Walk a copy of the smaller of the two station maps; list() copies
+        # in one step, so concurrent train registrations cannot break the walk
+        if len(dest_stops) < len(source_stops):
+            return [train_id for train_id, dest_pos in list(dest_stops.items())
+                    if source_stops.get(train_id, dest_pos) < dest_pos]
+        return [train_id for train_id, source_pos in list(source_stops.items())
+                if source_pos < dest_stops.get(train_id, source_pos)]
+    
+    @timed('book_ticket')
+    def book_ticket(self, passenger_info, train_id, num_seats, payment_amount,
+                    travel_date=None, source=None, destination=None, waitlist=False):
+        """Execute ticket booking smart contract
+        
+        The journey defaults to the whole route; travel_date None books from
+        the open-date seat pool. With waitlist set, a request that finds no
+        free seats joins the train's waitlist instead of failing.
+        """
         if train_id not in self.train_schedules:
             return {'status': 'failed', 'reason': 'Train not found'}
         
-        train = self.train_schedules[train_id]
+        with self.train_lock(train_id):
+            checked = self._check_booking(train_id, num_seats, payment_amount, source, destination)
+            if isinstance(checked, dict):
+                return checked
+            
+            reservation_data, result = self._issue_ticket(
+                passenger_info, train_id, num_seats, payment_amount, travel_date, *checked,
+                waitlist=waitlist
+            )
+            if reservation_data is None:
+                return result
+            
+            # Add to blockchain, handing the seats back if the mempool refuses
+            queued = self.blockchain.add_reservation(reservation_data)
+            if queued['status'] != 'success':
+                self._withdraw_ticket(reservation_data)
+                return queued
+            
+            return result
+    
+    def _withdraw_ticket(self, record):
+        """Undo _issue_ticket for a record the mempool refused"""
+        self._release_booking(record)
+        self.waitlist.remove(record['ticket_id'])
+        self.ticket_states.forget(record['ticket_id'])
+    
+    def _check_booking(self, train_id, num_seats, payment_amount, source, destination):
+        """Validate a booking request against the train schedule
+        
+        Returns (start stop, end stop, total fare), or a failed result dict.
+        """
+        train = self.train_schedules.get(train_id)
+        if train is None:
+            return {'status': 'failed', 'reason': 'Train not found'}
+        if (not isinstance(num_seats, int) or isinstance(num_seats, bool) or
+                not 1 <= num_seats <= train['total_seats']):
+            return {'status': 'failed', 'reason': 'Invalid number of seats'}
         total_fare = train['fare_per_seat'] * num_seats
         
-        # Validate booking conditions
-        if train['available_seats'] < num_seats:
-            return {'status': 'failed', 'reason': 'Insufficient seats'}
+        start = self.station_index.get(source, {}).get(train_id) if source else 0
+        end = (self.station_index.get(destination, {}).get(train_id) if destination
+               else len(train['route']) - 1)
+        if start is None or end is None or start >= end:
+            return {'status': 'failed', 'reason': 'Invalid journey for this train'}
         
+        # Validate booking conditions
         if payment_amount < total_fare:
             return {'status': 'failed', 'reason': 'Insufficient payment'}
+        return start, end, total_fare
+    
+    def _issue_ticket(self, passenger_info, train_id, num_seats, payment_amount,
+                      travel_date, start, end, total_fare, waitlist=False):
+        """Allocate seats and build the booking record; caller holds the train lock
         
-        # Generate unique ticket ID
+        Returns (record, result), with record None when no seats are free.
+        With waitlist set, a full train yields a waitlist request instead.
+        """
+        # Generate unique ticket ID (the random salt keeps concurrent
+        # bookings for the same passenger from colliding). This reads the
+        # passenger name, so a bad request fails before any seat is taken
         ticket_id = hashlib.sha256(
-            f"{passenger_info['name']}{train_id}{time.time()}".encode()
+            f"{passenger_info['name']}{train_id}{time.time()}{random.getrandbits(64)}".encode()
         ).hexdigest()[:12]
         
-        # Create reservation record
-        reservation_data = {
-            'type': 'ticket_booking',
-            'ticket_id': ticket_id,
-            'passenger_info': passenger_info,
-            'train_id': train_id,
-            'num_seats': num_seats,
-            'total_fare': total_fare,
-            'booking_time': time.time(),
-            'status': 'confirmed'
-        }
+        train = self.train_schedules[train_id]
+        seats = self.seat_inventory.allocate(
+            train_id, travel_date, train['total_seats'], len(train['route']) - 1,
+            start, end, num_seats
+        )
+        if seats is None and not waitlist:
+            return None, {'status': 'failed', 'reason': 'Insufficient seats'}
         
-        # Update seat availability
-        train['available_seats'] -= num_seats
+        if seats is None:
+            request = WaitlistRequest(
+                ticket_id=ticket_id,
+                passenger_info=passenger_info,
+                train_id=train_id,
+                num_seats=num_seats,
+                total_fare=total_fare,
+                booking_time=time.time(),
+                travel_date=travel_date,
+                from_stop=start,
+                to_stop=end
+            )
+            self.ticket_states.waitlist(ticket_id)
+            return request, {
+                'status': 'waitlisted',
+                'ticket_id': ticket_id,
+                'waitlist_position': self.waitlist.add(request, start, end),
+                'fare_paid': total_fare,
+                'remaining_balance': payment_amount - total_fare
+            }
         
-        # Add to blockchain
-        self.blockchain.add_reservation(reservation_data)
+        # Create reservation record
+        reservation_data = TicketBooking(
+            ticket_id=ticket_id,
+            passenger_info=passenger_info,
+            train_id=train_id,
+            num_seats=num_seats,
+            total_fare=total_fare,
+            booking_time=time.time(),
+            status='confirmed',
+            travel_date=travel_date,
+            from_stop=start,
+            to_stop=end,
+            seats=seats
+        )
+        self.ticket_states.book(ticket_id, seats)
         
-        return {
+        return reservation_data, {
             'status': 'success',
             'ticket_id': ticket_id,
+            'seats': seats,
             'fare_paid': total_fare,
             'remaining_balance': payment_amount - total_fare
         }
     
-    def cancel_ticket(self, ticket_id, cancellation_reason):
-        """Execute cancellation smart contract with refund logic"""
-        # Find ticket in blockchain
-        ticket_found = False
-        original_reservation = None
-        
-        for block in self.blockchain.chain:
-            for reservation in block.data if isinstance(block.data, list) else [block.data]:
-                if (isinstance(reservation, dict) and 
-                    reservation.get('ticket_id') == ticket_id):
-                    ticket_found = True
-                    original_reservation = reservation
-                    break
-        
-        if not ticket_found:
-            return {'status': 'failed', 'reason': 'Ticket not found'}
+    def book_tickets(self, bookings):
+        """Book many tickets, queueing all records in one mempool update
         
-        # Calculate refund based on cancellation policy
-        booking_time = original_reservation['booking_time']
-        current_time = time.time()
-        hours_before_travel = (current_time - booking_time) / 3600
+        bookings is a list of dicts with book_ticket's arguments as keys.
+        Every booking is validated before any seat is allocated; each
+        train's lock is then taken once for all of its bookings. Returns one
+        result per booking, in order.
+        """
+        results = [None] * len(bookings)
+        by_train = {}
+        for position, booking in enumerate(bookings):
+            checked = self._check_booking(
+                booking.get('train_id'), booking.get('num_seats'),
+                booking.get('payment_amount', 0), booking.get('source'),
+                booking.get('destination')
+            )
+            if isinstance(checked, dict):
+                results[position] = checked
+            elif not isinstance(booking.get('passenger_info'), dict) or \
+                    'name' not in booking['passenger_info']:
+                results[position] = {'status': 'failed', 'reason': 'Passenger name required'}
+            else:
+                by_train.setdefault(booking['train_id'], []).append((position, checked))
         
-        # Refund policy
-        if hours_before_travel > 24:
-            refund_percentage = 0.9  # 90% refund
-        elif hours_before_travel > 12:
-            refund_percentage = 0.5  # 50% refund
-        else:
-            refund_percentage = 0.1  # 10% refund
+        records = []
+        booked = []
+        for train_id, train_bookings in by_train.items():
+            schedule = self.train_schedules[train_id]
+            with self.train_lock(train_id):
+                for position, checked in train_bookings:
+                    booking = bookings[position]
+                    if self.train_schedules[train_id] is not schedule:
+                        # Re-registered since validation; its stops may have moved
+                        checked = self._check_booking(
+                            train_id, booking['num_seats'], booking['payment_amount'],
+                            booking.get('source'), booking.get('destination')
+                        )
+                        if isinstance(checked, dict):
+                            results[position] = checked
+                            continue
+                    record, results[position] = self._issue_ticket(
+                        booking['passenger_info'], train_id, booking['num_seats'],
+                        booking['payment_amount'], booking.get('travel_date'), *checked,
+                        waitlist=booking.get('waitlist', False)
+                    )
+                    if record is not None:
+                        records.append(record)
+                        booked.append(position)
         
-        refund_amount = original_reservation['total_fare'] * refund_percentage
+        queued = self.blockchain.add_reservations(records)
+        if queued['status'] != 'success':
+            for record in records:
+                with self.train_lock(record['train_id']):
+                    self._withdraw_ticket(record)
+            for position in booked:
+                results[position] = queued
+        return results
+    
+    @timed('cancel_ticket')
+    def cancel_ticket(self, ticket_id, cancellation_reason):
+        """Execute cancellation smart contract with refund logic
         
-        # Create cancellation record
-        cancellation_data = {
-            'type': 'ticket_cancellation',
-            'original_ticket_id': ticket_id,
-            'cancellation_time': current_time,
-            'refund_amount': refund_amount,
-            'reason': cancellation_reason
-        }
+        Seats freed by a confirmed ticket go straight to waitlisted requests
+        that fit them, oldest first. Their bookings are queued together with
+        the cancellation, so they are mined in the same block. A waitlisted
+        ticket is withdrawn with a full refund.
+        """
+        if self.ticket_states.status(ticket_id) is None:
+            return {'status': 'failed', 'reason': 'Ticket not found'}
+        _, original_reservation = self.blockchain.find_ticket(ticket_id)
+        if original_reservation is None:
+            return {'status': 'failed', 'reason': 'Ticket not found'}
         
-        # Restore seat availability
-        train_id = original_reservation['train_id']
-        if train_id in self.train_schedules:
-            self.train_schedules[train_id]['available_seats'] += original_reservation['num_seats']
+        with self.train_lock(original_reservation['train_id']):
+            # Checked under the lock so concurrent cancellations refund once
+            status = self.ticket_states.status(ticket_id)
+            if status == TicketStates.CANCELLED:
+                return {'status': 'failed', 'reason': 'Ticket already cancelled'}
+            if status is None:
+                return {'status': 'failed', 'reason': 'Ticket not found'}
+            
+            # Calculate refund based on cancellation policy
+            booking_time = original_reservation['booking_time']
+            current_time = time.time()
+            hours_before_travel = (current_time - booking_time) / 3600
+            
+            # Refund policy
+            if status == TicketStates.WAITLISTED:
+                refund_percentage = 1.0  # Never held a seat
+            elif hours_before_travel > 24:
+                refund_percentage = 0.9  # 90% refund
+            elif hours_before_travel > 12:
+                refund_percentage = 0.5  # 50% refund
+            else:
+                refund_percentage = 0.1  # 10% refund
+            
+            refund_amount = original_reservation['total_fare'] * refund_percentage
+            
+            # Create cancellation record
+            cancellation_data = TicketCancellation(
+                original_ticket_id=ticket_id,
+                cancellation_time=current_time,
+                refund_amount=refund_amount,
+                reason=cancellation_reason
+            )
+            
+            if status == TicketStates.WAITLISTED:
+                withdrawn = self.waitlist.remove(ticket_id)
+                promotions = []
+            else:
+                # Restore seat availability and hand it to the waitlist
+                withdrawn = None
+                self._release_booking(original_reservation)
+                promotions = self._promote_waitlist(
+                    original_reservation['train_id'], original_reservation.get('travel_date')
+                )
+            
+            queued = self.blockchain.add_reservations(
+                [cancellation_data] + [booking for booking, _ in promotions]
+            )
+            if queued['status'] != 'success':
+                for booking, entry in reversed(promotions):
+                    self._release_booking(booking)
+                    self.ticket_states.waitlist(booking['ticket_id'])
+                    self.waitlist.restore(entry)
+                if withdrawn is not None:
+                    self.waitlist.restore(withdrawn)
+                else:
+                    self._occupy_booking(original_reservation)
+                return queued
+            self.ticket_states.cancel(ticket_id, refund_amount)
+            
+            result = {
+                'status': 'success',
+                'refund_amount': refund_amount,
+                'processing_time': '3-5 business days'
+            }
+            if promotions:
+                result['promoted'] = [booking['ticket_id'] for booking, _ in promotions]
+            return result
+    
+    def _occupy_booking(self, booking):
+        """Take back the seats a booking still holds in its ticket state"""
+        train = self.train_schedules.get(booking['train_id'])
+        if train is None:
+            return
+        start, end = self._journey_stops(train, booking)
+        self.seat_inventory.occupy(
+            booking['train_id'], booking.get('travel_date'), len(train['route']) - 1,
+            start, end, self.ticket_states.seats_held(booking['ticket_id'])
+        )
+    
+    def _promote_waitlist(self, train_id, travel_date):
+        """Seat waitlisted requests in the free seats, oldest that fits first
         
-        self.blockchain.add_reservation(cancellation_data)
+        Returns (booking record, waitlist entry) pairs for the promoted
+        requests; the caller holds the train lock and queues the bookings.
+        """
+        train = self.train_schedules.get(train_id)
+        if train is None or not self.waitlist.depth(train_id, travel_date):
+            return []
         
-        return {
-            'status': 'success',
-            'refund_amount': refund_amount,
-            'processing_time': '3-5 business days'
-        }
+        free = {}  # (start, end) -> free seats, until the next allocation
+        
+        def fits(start, end, num_seats):
+            if (start, end) not in free:
+                free[start, end] = self.seat_inventory.free_seats(
+                    train_id, travel_date, train['total_seats'], start, end
+                )
+            return free[start, end] >= num_seats
+        
+        promotions = []
+        while True:
+            entry = self.waitlist.next_fitting(train_id, travel_date, fits)
+            if entry is None:
+                return promotions
+            free.clear()
+            _, _, (start, end, num_seats), request = entry
+            seats = self.seat_inventory.allocate(
+                train_id, travel_date, train['total_seats'], len(train['route']) - 1,
+                start, end, num_seats
+            )
+            booking = TicketBooking(
+                ticket_id=request['ticket_id'],
+                passenger_info=request['passenger_info'],
+                train_id=train_id,
+                num_seats=num_seats,
+                total_fare=request['total_fare'],
+                booking_time=time.time(),
+                status='confirmed',
+                travel_date=travel_date,
+                from_stop=start,
+                to_stop=end,
+                seats=seats
+            )
+            self.ticket_states.book(request['ticket_id'], seats)
+            promotions.append((booking, entry))
@@ -28,6 +28,9 @@ def user_menu(railway_system, username):
             source = input("Enter source station: ")
             destination = input("Enter destination station: ")
             travel_date = input("Enter travel date (YYYY-MM-DD): ")
+            if travel_date and not valid_travel_date(travel_date):
+                print("Invalid date; use YYYY-MM-DD")
+                continue
             
             trains = railway_system.search_trains(source, destination, travel_date)
             
@@ -37,6 +40,8 @@ def user_menu(railway_system, username):
                     print(f"{i+1}. Train ID: {train['train_id']}")
                     print(f"   Route: {' -> '.join(train['route'])}")
                     print(f"   Available Seats: {train['available_seats']}")
+                    if train['waitlisted']:
+                        print(f"   Waitlisted: {train['waitlisted']}")
                     print(f"   Fare per Seat: ${train['fare_per_seat']}")
                     print()
                 
@@ -56,30 +61,63 @@ def user_menu(railway_system, username):
                         username,
                         selected_train['train_id'],
                         num_seats,
-                        passenger_details
+                        passenger_details,
+                        travel_date,
+                        source,
+                        destination
                     )
+                    if (result['status'] == 'failed' and result['reason'] == 'Insufficient seats' and
+                            input("Join the waitlist? (y/n): ").lower() == 'y'):
+                        result = railway_system.make_reservation(
+                            username,
+                            selected_train['train_id'],
+                            num_seats,
+                            passenger_details,
+                            travel_date,
+                            source,
+                            destination,
+                            waitlist=True
+                        )
                     
                     if result['status'] == 'success':
                         print(f"\n✓ Booking Successful!")
                         print(f"Ticket ID: {result['ticket_id']}")
+                        print(f"Seat Numbers: {', '.join(str(seat + 1) for seat in result['seats'])}")
                         print(f"Amount Paid: ${result['fare_paid']}")
+                        if result['confirmation'] == 'pending':
+                            print("Confirmation: pending (will be confirmed in the next block)")
+                    elif result['status'] == 'waitlisted':
+                        print(f"\n✓ Added to the Waitlist")
+                        print(f"Ticket ID: {result['ticket_id']}")
+                        print(f"Waitlist Position: {result['waitlist_position']}")
+                        print(f"Amount Paid: ${result['fare_paid']}")
+                        print("Seats are assigned automatically when a cancellation frees them")
                     else:
                         print(f"✗ Booking Failed: {result['reason']}")
             else:
                 print("No trains available for this route.")
         
         elif choice == '2':
-            # Show user bookings
-            bookings = railway_system.get_user_bookings(username)
-            if bookings:
+            # Show user bookings, newest first, one page at a time
+            page = railway_system.get_user_bookings_page(username, limit=10)
+            if page['bookings']:
                 print("\nYour Bookings:")
-                for booking in bookings:
-                    print(f"Ticket ID: {booking['ticket_id']}")
-                    print(f"Train ID: {booking['train_id']}")
-                    print(f"Seats: {booking['num_seats']}")
-                    print(f"Total Fare: ${booking['total_fare']}")
-                    print(f"Status: {booking['status']}")
-                    print("-" * 30)
+                while True:
+                    for booking in page['bookings']:
+                        print(f"Ticket ID: {booking['ticket_id']}")
+                        print(f"Train ID: {booking['train_id']}")
+                        print(f"Seats: {booking['num_seats']}")
+                        print(f"Total Fare: ${booking['total_fare']}")
+                        print(f"Status: {booking['status']}")
+                        print("-" * 30)
+                    
+                    if page['next_cursor'] is None:
+                        break
+                    if input("Show older bookings? (y/n): ").lower() != 'y':
+                        break
+                    page = railway_system.get_user_bookings_page(
+                        username, limit=10, cursor=page['next_cursor']
+                    )
             else:
                 print("No bookings found.")
         
@@ -94,17 +132,18 @@ def user_menu(railway_system, username):
                 print(f"✓ Cancellation Successful!")
                 print(f"Refund Amount: ${result['refund_amount']}")
                 print(f"Processing Time: {result['processing_time']}")
+                if result.get('promoted'):
+                    print(f"Seats passed to {len(result['promoted'])} waitlisted booking(s)")
+                if result['confirmation'] == 'pending':
+                    print("Confirmation: pending (will be confirmed in the next block)")
             else:
                 print(f"✗ Cancellation Failed: {result['reason']}")
         
         elif choice == '4':
             break
 
-def main():
-    """Main application entry point"""
-    railway_system = RailwayReservationSystem()
-    
-    # Initialize with sample trains (admin operation)
+def load_sample_trains(railway_system):
+    """Register the sample trains that are not on the chain yet"""
     sample_trains = [
         {
             'train_id': 'EXP001',
@@ -121,10 +160,21 @@ def main():
     ]
     
     for train in sample_trains:
-        railway_system.admin_add_train('admin', 'railway_admin_2024', train)
+        if train['train_id'] not in railway_system.smart_contract.train_schedules:
+            railway_system.admin_add_train('admin', 'railway_admin_2024', train)
     
     # Mine initial blocks
-    railway_system.blockchain.mine_pending_reservations('system')
+    railway_system.block_builder.flush('system')
+
+def main():
+    """Main application entry point"""
+    # Chain and state persist across restarts in RAILWAY_DATA_DIR
+    data_dir = os.environ.get('RAILWAY_DATA_DIR', 'railway_data')
+    block_time = float(os.environ.get('RAILWAY_BLOCK_TIME', '1.0'))
+    railway_system = RailwayReservationSystem(data_dir=data_dir, target_block_time=block_time)
+    
+    # Initialize with sample trains (admin operation)
+    load_sample_trains(railway_system)
     
     while True:
         display_menu()
@@ -170,6 +220,8 @@ def main():
                 print("1. Add New Train")
                 print("2. View All Trains")
                 print("3. View Blockchain Stats")
+                print("4. Full Blockchain Revalidation")
+                print("5. Analytics Reports")
                 
                 admin_choice = input("Enter choice: ")
                 
@@ -187,25 +239,84 @@ def main():
                         'fare_per_seat': fare
                     }
                     
-                    railway_system.admin_add_train(admin_user, admin_pass, train_details)
-                    railway_system.blockchain.mine_pending_reservations('admin')
-                    print("✓ Train added successfully!")
+                    result = railway_system.admin_add_train(admin_user, admin_pass, train_details)
+                    if result['status'] == 'success':
+                        railway_system.block_builder.flush('admin')
+                        print("✓ Train added successfully!")
+                    else:
+                        print(f"✗ Could not add train: {result['reason']}")
                 
                 elif admin_choice == '2':
                     print("\nRegistered Trains:")
                     for train_id, details in railway_system.smart_contract.train_schedules.items():
                         print(f"Train ID: {train_id}")
                         print(f"Route: {' -> '.join(details['route'])}")
-                        print(f"Total/Available Seats: {details['total_seats']}/{details['available_seats']}")
+                        available = railway_system.smart_contract.available_seats(train_id)
+                        print(f"Total/Available Seats (open date): {details['total_seats']}/{available}")
                         print(f"Fare per Seat: ${details['fare_per_seat']}")
                         print("-" * 40)
                 
                 elif admin_choice == '3':
                     print(f"\nBlockchain Statistics:")
                     print(f"Total Blocks: {len(railway_system.blockchain.chain)}")
-                    print(f"Pending Reservations: {len(railway_system.blockchain.pending_reservations)}")
-                    print(f"Mining Difficulty: {railway_system.blockchain.difficulty}")
+                    mempool = railway_system.blockchain.mempool.stats()
+                    print(f"Pending Reservations: {mempool['depth']}/{mempool['capacity']} "
+                          f"(oldest waiting {mempool['oldest_wait_seconds']:.1f}s)")
+                    print(f"Mempool: {mempool['arrivals_per_second']:.2f} arrivals/s, "
+                          f"{mempool['mean_block_records']:.1f} records/block, "
+                          f"{mempool['rejected_full']} rejected as full, "
+                          f"{mempool['rejected_duplicate']} duplicates")
+                    blockchain = railway_system.blockchain
+                    print(f"Mining Difficulty: {blockchain.get_latest_block().difficulty or blockchain.difficulty}"
+                          f" (next block: {blockchain.next_difficulty()})")
+                    if blockchain.target_block_time is not None:
+                        print(f"Target Block Time: {blockchain.target_block_time}s, "
+                              f"retargeted every {blockchain.retarget_interval} blocks")
                     print(f"Chain Valid: {railway_system.validate_blockchain_integrity()}")
+                    print(f"Validated Height: {railway_system.blockchain.validated_height}")
+                    
+                    metrics = railway_system.metrics.snapshot()
+                    gauges, counters = metrics['gauges'], metrics['counters']
+                    print(f"Chain Size: {gauges.get('chain_bytes', 0) / 1024:.1f} KiB")
+                    print(f"Blocks Mined: {counters.get('blocks_mined_total', 0):.0f} "
+                          f"({counters.get('mining_nonces_total', 0):.0f} nonces tried, "
+                          f"last {gauges.get('mining_hashes_per_second', 0):.0f} H/s)")
+                    depths = [depth for _, depth in metrics['history'].get('mempool_depth_at_seal', [])]
+                    if depths:
+                        print(f"Mempool Depth at Seal: last {depths[-1]}, max {max(depths)} "
+                              f"over {len(depths)} blocks")
+                    print("\nOperation Latency:")
+                    for operation, summary in sorted(metrics['operations'].items()):
+                        print(f"  {operation:17s} {summary['count']:6d} calls, "
+                              f"p50 <= {summary['p50_ms']:.2f} ms, p99 <= {summary['p99_ms']:.2f} ms")
+                
+                elif admin_choice == '4':
+                    is_valid = railway_system.validate_blockchain_integrity(full=True, workers=None)
+                    print(f"Full Revalidation: {'✓ VALID' if is_valid else '✗ INVALID'}")
+                
+                elif admin_choice == '5':
+                    group_by = input("Group by (train/route/day/occupancy): ").strip().lower()
+                    result = railway_system.admin_analytics(admin_user, admin_pass, group_by)
+                    if result['status'] != 'success':
+                        print(f"✗ {result['reason']}")
+                    elif group_by == 'occupancy':
+                        for row in result['report']:
+                            print(f"{row['train_id']:10s} {row['travel_date'] or 'open date':10s} "
+                                  f"{row['occupancy']:6.1%} occupied")
+                    elif group_by == 'day':
+                        for row in result['report']:
+                            print(f"{row['date']} {row['bookings']:7d} bookings "
+                                  f"${row['revenue']:12,.2f}  {row['cancellations']:6d} cancelled "
+                                  f"${row['refunds']:10,.2f} refunded")
+                    else:
+                        for row in sorted(result['report'], key=lambda row: -row['net_revenue']):
+                            name = (row['train_id'] if group_by == 'train'
+                                    else f"{row['source']} -> {row['destination']}")
+                            occupancy = (f" {row['occupancy']:6.1%} occupied"
+                                         if group_by == 'train' else '')
+                            print(f"{name:24s} {row['bookings']:7d} bookings "
+                                  f"{row['cancellation_rate']:6.1%} cancelled "
+                                  f"${row['net_revenue']:12,.2f} net{occupancy}")
             else:
                 print("✗ Admin authentication failed!")
         
@@ -213,7 +324,10 @@ def main():
             # Search trains (public access)
             source = input("Enter source station: ")
             destination = input("Enter destination station: ")
-            travel_date = input("Enter travel date: ")
+            travel_date = input("Enter travel date (YYYY-MM-DD): ")
+            if travel_date and not valid_travel_date(travel_date):
+                print("Invalid date; use YYYY-MM-DD")
+                continue
             
             trains = railway_system.search_trains(source, destination, travel_date)
             
@@ -233,17 +347,26 @@ def main():
             ticket_id = input("Enter Ticket ID: ")
             result = railway_system.check_pnr_status(ticket_id)
             
-            if result['status'] == 'found':
+            if result['status'] in ('found', 'pending'):
                 details = result['reservation_details']
                 print(f"\n--- Ticket Details ---")
                 print(f"Ticket ID: {details['ticket_id']}")
                 print(f"Train ID: {details['train_id']}")
                 print(f"Passenger: {details['passenger_info']['name']}")
                 print(f"Seats: {details['num_seats']}")
+                if details.get('travel_date'):
+                    print(f"Travel Date: {details['travel_date']}")
                 print(f"Total Fare: ${details['total_fare']}")
-                print(f"Status: {details['status']}")
+                print(f"Status: {result.get('ticket_status', details.get('status'))}")
+                if 'waitlist_position' in result:
+                    print(f"Waitlist Position: {result['waitlist_position']}")
+                if 'refund_amount' in result:
+                    print(f"Refund Amount: ${result['refund_amount']}")
                 print(f"Booking Time: {datetime.fromtimestamp(details['booking_time'])}")
-                print(f"Block Hash: {result['block_hash']}")
+                if result['status'] == 'found':
+                    print(f"Block Hash: {result['block_hash']}")
+                else:
+                    print("Block Hash: pending confirmation")
             else:
                 print("✗ Ticket not found!")
         
@@ -253,6 +376,7 @@ def main():
             print(f"Blockchain Integrity: {'✓ VALID' if is_valid else '✗ INVALID'}")
         
         elif choice == '7':
+            railway_system.close()
             print("Thank you for using Blockchain Railway Reservation System!")
             break
         
@@ -260,4 +384,33 @@ def main():
             print("Invalid choice! Please try again.")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        # python railway_blockchain.py --serve [host] [port]
+        host = sys.argv[2] if len(sys.argv) > 2 else '127.0.0.1'
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 8080
+        data_dir = os.environ.get('RAILWAY_DATA_DIR', 'railway_data')
+        block_time = float(os.environ.get('RAILWAY_BLOCK_TIME', '1.0'))
+        railway_system = RailwayReservationSystem(
+            batch_size=100, batch_window=0.5, data_dir=data_dir,
+            target_block_time=block_time
+        )
+        # RAILWAY_PEERS=host:port,... joins an existing network of nodes
+        peers = [(peer.rpartition(':')[0], int(peer.rpartition(':')[2]))
+                 for peer in os.environ.get('RAILWAY_PEERS', '').split(',') if peer]
+        if not peers:
+            load_sample_trains(railway_system)
+        try:
+            if peers or 'RAILWAY_PEER_PORT' in os.environ:
+                run_replicated_node(railway_system, host, port,
+                                    int(os.environ.get('RAILWAY_PEER_PORT', '9000')), peers)
+            else:
+                run_api_server(railway_system, host, port)
+        finally:
+            railway_system.close()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        # python railway_blockchain.py --benchmark [results.json] [--memory]
+        arguments = [argument for argument in sys.argv[2:] if argument != '--memory']
+        run_workload_benchmark(track_memory='--memory' in sys.argv,
+                               output_path=arguments[0] if arguments else None)
+    else:
+        main()
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import unittest
+
+from test_switch_branch import ADMIN, load_railway_blockchain
+
+
+class APIServerTest(unittest.TestCase):
+    def setUp(self):
+        self.railway = load_railway_blockchain()
+        self.system = self.railway.RailwayReservationSystem(batch_size=100)
+        self.system.blockchain.difficulty = 1
+        self.system.admin_add_train(*ADMIN, {'train_id': 'T', 'route': ['A', 'B'],
+                                             'seats': 2, 'fare_per_seat': 10})
+        self.system.register_user('alice', 'secret', {})
+        self.system.block_builder.flush('system')
+        self.server = self.railway.RailwayAPIServer(self.system, executor_workers=2)
+        self.addCleanup(self.server.executor.shutdown)
+
+    def dispatch(self, operation, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        return asyncio.run(self.server.dispatch('/' + operation, body))
+
+    def booking(self, **fields):
+        return dict({'username': 'alice', 'password': 'secret', 'train_id': 'T',
+                     'num_seats': 1, 'passenger_details': {'name': 'alice'}}, **fields)
+
+    def test_booking_succeeds(self):
+        status, result = self.dispatch('make_reservation', self.booking())
+        self.assertEqual(status, 200)
+        self.assertEqual(result['status'], 'success')
+
+    def test_unknown_operation_is_404(self):
+        self.assertEqual(self.dispatch('nope', {})[0], 404)
+
+    def test_malformed_requests_are_400(self):
+        for body in (b'not json', b'[1]', self.booking(num_seats='1'),
+                     self.booking(num_seats=True), self.booking(passenger_details=[]),
+                     self.booking(travel_date='12/25/2030')):
+            with self.subTest(body=body):
+                status, result = self.dispatch('make_reservation', body)
+                self.assertEqual(status, 400)
+                self.assertEqual(result['status'], 'failed')
+        booking = self.booking()
+        del booking['train_id']
+        self.assertEqual(self.dispatch('make_reservation', booking)[0], 400)
+        self.assertEqual(self.system.smart_contract.available_seats('T'), 2)
+
+    def test_full_mempool_is_503_and_hands_seats_back(self):
+        mempool = self.system.blockchain.mempool
+        mempool.capacity = len(mempool)
+        status, result = self.dispatch('make_reservation', self.booking())
+        self.assertEqual(status, 503)
+        self.assertEqual(result['reason'], self.railway.MEMPOOL_FULL)
+        self.assertEqual(self.system.smart_contract.available_seats('T'), 2)
+        self.assertEqual(self.system.smart_contract.ticket_states.states, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
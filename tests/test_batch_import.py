@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from test_switch_branch import ADMIN, load_railway_blockchain
+
+
+class BatchImportTest(unittest.TestCase):
+    def setUp(self):
+        self.railway = load_railway_blockchain()
+        self.system = self.railway.RailwayReservationSystem()
+        self.system.blockchain.difficulty = 1
+        self.system.admin_add_train(*ADMIN, {'train_id': 'T', 'route': ['A', 'B'],
+                                             'seats': 3, 'fare_per_seat': 10})
+        self.system.register_user('alice', 'secret', {})
+        self.system.block_builder.flush('system')
+
+    def write_file(self, suffix, text):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', newline='') as batch_file:
+            batch_file.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_fails_bad_rows_individually(self):
+        path = self.write_file('.csv', 'username,train_id,num_seats,name\n'
+                                       'alice,T,1,Alice\n'
+                                       'alice,T,two,Bob\n'
+                                       'mallory,T,1,Mallory\n'
+                                       'alice,NOPE,1,Carol\n'
+                                       'alice,T,1,Dave\n')
+        summary = self.system.import_bookings_file(path)
+        self.assertEqual(summary['processed'], 5)
+        self.assertEqual(summary['succeeded'], 2)
+        failed = {entry['line']: entry['reason'] for entry in summary['failed']}
+        self.assertEqual(sorted(failed), [3, 4, 5])
+        self.assertTrue(failed[3].startswith('Bad row'))
+        self.assertEqual(failed[4], 'User not registered')
+        self.assertEqual(failed[5], 'Train not found')
+        self.assertEqual(self.system.smart_contract.available_seats('T'), 1)
+
+    def test_batch_results_carry_their_own_block(self):
+        results = self.system.make_reservations([
+            {'username': 'alice', 'train_id': 'T', 'num_seats': 1,
+             'passenger_details': {'name': 'Alice'}},
+            {'username': 'alice', 'train_id': 'T', 'num_seats': 1,
+             'passenger_details': 'not an object'},
+            {'username': 'alice', 'train_id': 'T', 'num_seats': 1,
+             'passenger_details': {'name': 'Bob'}},
+        ])
+        self.assertEqual([result['status'] for result in results],
+                         ['success', 'failed', 'success'])
+        self.assertEqual(results[1]['reason'], 'Passenger details must be an object')
+        for result in (results[0], results[2]):
+            block, _ = self.system.blockchain.find_ticket(result['ticket_id'])
+            self.assertEqual(result['confirmation'], 'confirmed')
+            self.assertEqual(result['block_hash'], block.hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
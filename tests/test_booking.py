@@ -0,0 +1,55 @@
+import unittest
+
+from test_switch_branch import ADMIN, load_railway_blockchain
+
+
+class BookingTest(unittest.TestCase):
+    def setUp(self):
+        self.railway = load_railway_blockchain()
+        self.system = self.railway.RailwayReservationSystem()
+        self.system.blockchain.difficulty = 1
+        self.system.admin_add_train(*ADMIN, {'train_id': 'T', 'route': ['A', 'B', 'C'],
+                                             'seats': 2, 'fare_per_seat': 10})
+        self.system.register_user('alice', 'secret', {})
+        self.system.block_builder.flush('system')
+
+    def book(self, source, destination, num_seats=1, travel_date=None):
+        return self.system.make_reservation('alice', 'T', num_seats, {'name': 'alice'},
+                                            travel_date, source, destination)
+
+    def test_disjoint_segments_share_seats(self):
+        self.assertEqual(self.book('A', 'B', 2)['status'], 'success')
+        self.assertEqual(self.book('B', 'C', 2)['status'], 'success')
+        self.assertEqual(self.book('A', 'C')['reason'], 'Insufficient seats')
+        self.assertEqual(self.system.smart_contract.available_seats('T', None, 'A', 'B'), 0)
+
+    def test_travel_dates_have_separate_inventory(self):
+        self.assertEqual(self.book('A', 'C', 2, '2030-01-01')['status'], 'success')
+        self.assertEqual(self.book('A', 'C', 2, '2030-01-02')['status'], 'success')
+        self.assertEqual(self.book('A', 'C', 1, '2030-01-01')['reason'], 'Insufficient seats')
+
+    def test_cancellation_frees_only_its_segments(self):
+        first = self.book('A', 'B', 2)
+        self.book('B', 'C', 2)
+        self.system.block_builder.flush('system')
+        cancelled = self.system.cancel_reservation('alice', first['ticket_id'], 'plans changed')
+        self.assertEqual(cancelled['status'], 'success')
+        contract = self.system.smart_contract
+        self.assertEqual(contract.available_seats('T', None, 'A', 'B'), 2)
+        self.assertEqual(contract.available_seats('T', None, 'B', 'C'), 0)
+
+    def test_bad_travel_dates_are_rejected(self):
+        for travel_date in ('12/25/2030', 'tomorrow', '2030-1-5', '20301225'):
+            with self.subTest(travel_date=travel_date):
+                result = self.book('A', 'C', 1, travel_date)
+                self.assertEqual(result['reason'], 'Invalid travel date')
+        self.assertEqual(self.system.smart_contract.seat_inventory.export(), [])
+
+    def test_booking_without_name_keeps_seats(self):
+        with self.assertRaises(KeyError):
+            self.system.make_reservation('alice', 'T', 1, {})
+        self.assertEqual(self.system.smart_contract.available_seats('T'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
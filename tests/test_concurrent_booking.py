@@ -0,0 +1,70 @@
+import random
+import threading
+import unittest
+
+from test_switch_branch import load_railway_blockchain
+
+ROUTE = ['Mumbai', 'Pune', 'Satara', 'Kolhapur', 'Belgaum']
+
+
+class ConcurrentBookingTest(unittest.TestCase):
+    def setUp(self):
+        self.railway = load_railway_blockchain()
+
+    def test_no_seat_is_oversold(self):
+        system = self.railway.RailwayReservationSystem(batch_size=20, batch_window=0.01)
+        system.blockchain.difficulty = 1
+        train_ids = ['S0', 'S1']
+        for train_id in train_ids:
+            system.smart_contract.register_train(train_id, ROUTE, 12, 100)
+        system.register_user('stress', 'secret', {})
+        system.block_builder.start('system')
+
+        results = []
+        results_lock = threading.Lock()
+
+        def book(worker):
+            rng = random.Random(worker)
+            confirmed = []
+            for i in range(30):
+                start = rng.randrange(len(ROUTE) - 1)
+                end = rng.randint(start + 1, len(ROUTE) - 1)
+                result = system.make_reservation(
+                    'stress', rng.choice(train_ids), rng.randint(1, 3),
+                    {'user': 'stress', 'name': f"P{worker}-{i}"},
+                    '2030-12-25', ROUTE[start], ROUTE[end]
+                )
+                if result['status'] == 'success':
+                    confirmed.append(result['ticket_id'])
+            with results_lock:
+                results.extend(confirmed)
+
+        threads = [threading.Thread(target=book, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        system.block_builder.stop()
+        system.block_builder.flush('system')
+
+        self.assertEqual(len(set(results)), len(results))
+        # Every seat is held by at most one mined booking on each segment
+        occupied = set()
+        mined = set()
+        for block in system.blockchain.chain:
+            for record in block.records():
+                if getattr(record, 'TYPE', None) != 'ticket_booking':
+                    continue
+                mined.add(record['ticket_id'])
+                for segment in range(record['from_stop'], record['to_stop']):
+                    for seat in record['seats']:
+                        key = (record['train_id'], segment, seat)
+                        self.assertNotIn(key, occupied)
+                        self.assertLess(seat, 12)
+                        occupied.add(key)
+        self.assertEqual(mined, set(results))
+        self.assertTrue(system.validate_blockchain_integrity(full=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import importlib.util
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# railway_blockchain.py is assembled from the section files in README order
+SECTIONS = [
+    'Blockchain Infrastructure.py',
+    'Operational Metrics.py',
+    'Persistent Block Store.py',
+    'Ledger Records.py',
+    'Smart Contract Layer.py',
+    'Railway Management System.py',
+    'Ledger Analytics.py',
+    'Performance Benchmarks.py',
+    'Network API Server.py',
+    'Peer Replication.py',
+    'User Interface and Main Application.py',
+]
+ADMIN = ('admin', 'railway_admin_2024')
+
+
+def load_railway_blockchain():
+    if 'railway_blockchain' in sys.modules:
+        return sys.modules['railway_blockchain']
+    sections = []
+    for name in SECTIONS:
+        with open(os.path.join(ROOT, name), encoding='utf-8') as section:
+            sections.append(section.read())
+    source = '\n'.join(sections)
+    spec = importlib.util.spec_from_loader('railway_blockchain', loader=None)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['railway_blockchain'] = module
+    exec(compile(source, 'railway_blockchain.py', 'exec'), module.__dict__)
+    return module
+
+
+class SwitchBranchTest(unittest.TestCase):
+    def setUp(self):
+        self.railway = load_railway_blockchain()
+
+    def make_system(self):
+        system = self.railway.RailwayReservationSystem()
+        system.blockchain.difficulty = 1
+        return system
+
+    def test_requeued_cancellation_releases_requeued_booking(self):
+        node = self.make_system()
+        node.admin_add_train(*ADMIN, {'train_id': 'T', 'route': ['A', 'B'],
+                                      'seats': 3, 'fare_per_seat': 10})
+        node.register_user('alice', 'secret', {})
+        node.block_builder.flush('system')
+        for name in ('first', 'second'):
+            node.make_reservation('alice', 'T', 1, {'name': name})
+        node.block_builder.flush('system')
+        fork_height = len(node.blockchain.chain) - 1
+
+        peer = self.make_system()
+        self.assertEqual(peer.accept_blocks(node.blockchain.chain[1:]), fork_height)
+        for name in ('bob', 'carol', 'dave'):
+            peer.register_user(name, 'secret', {})
+            peer.block_builder.flush('system')
+
+        # Seat 2 is booked and cancelled only on the branch being abandoned
+        booking = node.make_reservation('alice', 'T', 1, {'name': 'third'})
+        node.block_builder.flush('system')
+        self.assertEqual(booking['seats'], [2])
+        self.assertEqual(node.cancel_reservation('alice', booking['ticket_id'], 'plans changed')['status'],
+                         'success')
+        node.block_builder.flush('system')
+
+        result = node.switch_branch(fork_height, peer.blockchain.chain[fork_height + 1:])
+        self.assertEqual(result, {'requeued': 2, 'dropped': 0})
+        self.assertEqual(node.search_trains('A', 'B', None)[0]['available_seats'], 1)
+
+        node.block_builder.flush('system')
+        self.assertEqual(node.search_trains('A', 'B', None)[0]['available_seats'], 1)
+        self.assertEqual(node.check_pnr_status(booking['ticket_id'])['ticket_status'], 'cancelled')
+
+
+if __name__ == '__main__':
+    unittest.main()
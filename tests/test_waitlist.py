@@ -0,0 +1,32 @@
+import unittest
+
+from test_switch_branch import load_railway_blockchain
+
+
+class WaitlistTest(unittest.TestCase):
+    def setUp(self):
+        self.railway = load_railway_blockchain()
+        self.waitlist = self.railway.Waitlist()
+        for ticket_id in ('a', 'b', 'c'):
+            self.waitlist.add({'ticket_id': ticket_id, 'train_id': 'T', 'num_seats': 1}, 0, 1)
+
+    def drain(self):
+        order = []
+        while True:
+            entry = self.waitlist.next_fitting('T', None, lambda *group: True)
+            if entry is None:
+                return order
+            order.append(entry[3]['ticket_id'])
+
+    def test_restoring_a_withdrawn_request_keeps_one_copy_in_place(self):
+        self.waitlist.restore(self.waitlist.remove('b'))
+        self.assertEqual(self.waitlist.position('b'), 2)
+        self.assertEqual(self.drain(), ['a', 'b', 'c'])
+
+    def test_restoring_a_promoted_request_puts_it_back_first(self):
+        self.waitlist.restore(self.waitlist.next_fitting('T', None, lambda *group: True))
+        self.assertEqual(self.drain(), ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()